@@ -0,0 +1,260 @@
+"""
+Deterministic benchmarks for the physics step and the renderer.
+
+Every scenario is scripted and seeded, so two runs simulate exactly the same thing and
+only the timings differ. Physics runs headless with no frame cap.
+
+Usage:
+    python bench.py                          # all physics scenarios
+    python bench.py --render                 # also time drawing (needs pygame)
+    python bench.py --contacts               # also time single edge and corner contacts
+    python bench.py --json out.json          # write the results for later comparison
+    python bench.py --compare old.json       # print the speed-up against an earlier run
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import time
+
+from numpy import arange
+
+from engine import World, Ball, Rectangle, MovingPlatform, DEFAULT_LEVEL, pi
+from profiler import Profiler
+
+
+# Scenarios: each returns a world and a script(world, frame) that applies that frame's input
+def scenario_default():
+    world = World(DEFAULT_LEVEL, adaptive=True)
+    ball = world.addBall(Ball(0, 200, 10, 2, "red"))
+
+    def script(world, frame):
+        # Roll right over the zig-zag, back left, with a jump every few seconds
+        if (frame // 60) % 4 in (0, 1) and frame % 4 == 0:
+            ball.exertForce(1, 0)
+        if (frame // 60) % 4 == 3 and frame % 4 == 0:
+            ball.exertForce(-1, 0)
+        if frame % 170 < 6:
+            ball.exertForce(0, 1)
+    return world, script
+
+def dense_level(seed=1, columns=400, rows=12):
+    """
+    Save code of a procedurally generated map: a long rough floor of small tiles with
+    randomly rotated blocks scattered above it, like a map built click by click in the editor.
+    """
+    rng = random.Random(seed)
+    records = ["-99999.0,-200.0,199998.0,50.0,0.0,black,0.85"]
+    for c in range(columns):
+        records.append(f"{c * 20.0 - 200},{rng.uniform(-4, 4)},20,20,0.0,black,0.8")
+        for r in range(rows):
+            if rng.random() < 0.25:
+                records.append(f"{c * 20.0 - 200},{60.0 + r * 45 + rng.uniform(-10, 10)},{rng.uniform(8, 30)},{rng.uniform(8, 30)},{rng.uniform(0, 2 * pi)},black,0.8")
+    return ":".join(records)
+
+def scenario_dense():
+    world = World(dense_level(), adaptive=True)
+    balls = [world.addBall(Ball(k * 400.0, 700, 8, 1, "red")) for k in range(4)]
+
+    def script(world, frame):
+        if frame % 3 == 0:
+            for i in balls:
+                i.exertForce(1, 0)
+    return world, script
+
+def scenario_pile():
+    # A V-shaped bowl with a few hundred balls dropped into it: both arms slope down onto the ends of the bottom plate
+    world = World(f"-645.0,395.0,700,20,{pi / 4},black,0.6:150.0,-100.0,700,20,{7 * pi / 4},black,0.6:-150.0,-100.0,300,40,0.0,black,0.6", adaptive=True)
+    rng = random.Random(2)
+    for k in range(300):
+        # On a jittered grid, so that no two balls start overlapping
+        world.addBall(Ball((k % 20) * 30.0 - 285 + rng.uniform(-4, 4), 100 + (k // 20) * 30.0 + rng.uniform(-4, 4), rng.uniform(5, 10), 1, "red"))
+    return world, lambda world, frame: None
+
+def scenario_corners():
+    # A fast ball skimming the tips of a long row of diamonds, without gravity
+    records = [f"{k * 60.0},0.0,30,30,{pi / 4},black,0.9" for k in range(200)]
+    world = World(":".join(records), adaptive=True)
+    world.fly = True
+    ball = world.addBall(Ball(-50, 14, 10, 1, "red"))
+    ball._vX = 25
+
+    def script(world, frame):
+        # Keep it skimming: pull it back down onto the tips and keep the speed up
+        if ball._y > 12:
+            ball.exertForce(0, -0.5)
+        if ball._vX < 20:
+            ball.exertForce(1, 0)
+    return world, script
+
+def scenario_platforms():
+    # Three hundred platforms moving back and forth, with balls dropped onto them
+    world = World("-99999.0,-200.0,199998.0,50.0,0.0,black,0.85", adaptive=True)
+    rng = random.Random(3)
+    for k in range(300):
+        x, y = (k % 30) * 150.0, 100.0 + (k // 30) * 120
+        if k % 3:
+            world.addRectangle(MovingPlatform(x, y, 80, 15, 0, x + rng.uniform(30, 70), y, rng.uniform(0.5, 2)))
+        else:
+            world.addRectangle(MovingPlatform(x, y, 80, 15, 0, x, y + rng.uniform(20, 60), rng.uniform(0.3, 1)))
+    for k in range(40):
+        world.addBall(Ball(k * 110.0 + 40, 1400, 8, 1, "red"))
+    return world, lambda world, frame: None
+
+def scenario_granular():
+    # Three thousand particles poured into a box, and a ball dropped onto the pile
+    world = World("-400.0,0.0,800,40,0.0,black,0.6:-440.0,800.0,40,840,0.0,black,0.6:400.0,800.0,40,840,0.0,black,0.6", adaptive=True)
+    k = arange(3000)
+    world.addParticles(-380 + (k % 55) * 13.8, 30 + (k // 55) * 9.0, 4)
+    world.addBall(Ball(0, 700, 10, 2, "red"))
+    return world, lambda world, frame: None
+
+SCENARIOS = {
+    "default": scenario_default,
+    "dense": scenario_dense,
+    "pile": scenario_pile,
+    "corners": scenario_corners,
+    "platforms": scenario_platforms,
+    "granular": scenario_granular,
+}
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+def bench_physics(name, frames, timeline=None):
+    world, script = SCENARIOS[name]()
+    if timeline is not None:
+        world.profiler = Profiler()
+    latencies = []
+    start = time.perf_counter()
+    for frame in range(frames):
+        script(world, frame)
+        # Same as World.run(1), with every substep timed
+        if world.adaptive:
+            world.substeps = world.chooseSubsteps()
+        for _ in range(world.substeps):
+            t = time.perf_counter()
+            world.step()
+            latencies.append(time.perf_counter() - t)
+        world.frame += 1
+        if world.profiler is not None:
+            world.profiler.endFrame()
+    elapsed = time.perf_counter() - start
+    if timeline is not None:
+        world.profiler.export(timeline)
+    substeps = len(latencies)
+    return {
+        "frames": frames,
+        "substeps": substeps,
+        "seconds": elapsed,
+        "frames_per_second": frames / elapsed,
+        "substeps_per_second": substeps / elapsed,
+        "substep_us_p50": percentile(latencies, 50) * 1e6,
+        "substep_us_p90": percentile(latencies, 90) * 1e6,
+        "substep_us_p99": percentile(latencies, 99) * 1e6,
+        "checks_per_substep": world.collisionChecks / substeps,
+        "final_positions": [[i._x, i._y] for i in world.balls[:4]],
+    }
+
+def bench_render(name, frames):
+    import os
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import pygame
+    from render import draw_world, TileCache
+    pygame.init()
+    screen = pygame.Surface((1280, 720))
+    world, script = SCENARIOS[name]()
+    results = {}
+    for mode, tiles in (("direct", None), ("tiles", TileCache())):
+        latencies = []
+        drawn = 0
+        for frame in range(frames):
+            # Pan along the level at a steady speed so the view keeps changing
+            t = time.perf_counter()
+            drawn += draw_world(screen, world, frame * 8.0, 200, 1, tiles)
+            latencies.append(time.perf_counter() - t)
+        results[mode] = {
+            "frames_per_second": frames / sum(latencies),
+            "frame_ms_p50": percentile(latencies, 50) * 1e3,
+            "frame_ms_p99": percentile(latencies, 99) * 1e3,
+            "rectangles_drawn_per_frame": drawn / frames,
+        }
+    return results
+
+def bench_contacts(hits=20000, repeat=5):
+    """
+    Cost of resolving one contact of a ball with a rotated rectangle, per contact type:
+    the ball is put back in the same overlapping spot and resolveCollision is timed.
+    Best of repeat runs, in microseconds per hit.
+    """
+    world = World()
+    rect = world.addRectangle(Rectangle(0, 0, 100, 40, 30))
+    ball = world.addBall(Ball(0, 0, 10, 2, "red"))
+    normalX, normalY = rect._normals[0]
+    (startX, startY), (endX, endY) = rect._polygon1, rect._polygon2
+    cornerX, cornerY = rect._polygon2
+    cases = {
+        "edge": ((startX + endX) / 2 + normalX * 9.5, (startY + endY) / 2 + normalY * 9.5, 1.0, -2.0, (True, False, False, False)),
+        "corner": (cornerX + 6.5, cornerY + 6.0, -1.0, -2.0, (True, True, False, False)),
+    }
+    results = {}
+    for name, (x, y, vX, vY, edges) in cases.items():
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(hits):
+                ball._x, ball._y, ball._vX, ball._vY = x, y, vX, vY
+                ball.resolveCollision(rect, *edges, world)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[name] = best / hits * 1e6
+    return results
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Deterministic physics and render benchmarks")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="run only this scenario (repeatable)")
+    parser.add_argument("--frames", type=int, default=600, help="frames to simulate per scenario")
+    parser.add_argument("--render", action="store_true", help="also benchmark drawing")
+    parser.add_argument("--contacts", action="store_true", help="also time the resolution of a single edge and corner contact")
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="earlier --json output to compare against")
+    parser.add_argument("--timeline", help="profile the physics and write a per-frame CSV timeline per scenario, to TIMELINE with the scenario name inserted before the extension")
+    args = parser.parse_args()
+
+    results = {"commit": git_commit(), "python": platform.python_version(), "frames": args.frames, "physics": {}, "render": {}}
+    if args.contacts:
+        results["contacts"] = bench_contacts()
+        print("contacts " + "  ".join(f"{name} {us:.2f} us/hit" for name, us in results["contacts"].items()))
+    for name in args.scenario or SCENARIOS:
+        timeline = None
+        if args.timeline:
+            base, dot, extension = args.timeline.rpartition(".")
+            timeline = f"{base}-{name}.{extension}" if dot else f"{args.timeline}-{name}"
+        r = results["physics"][name] = bench_physics(name, args.frames, timeline)
+        print(f"{name:8} {r['substeps_per_second']:10.0f} substeps/s  p50 {r['substep_us_p50']:8.1f} us  p99 {r['substep_us_p99']:8.1f} us  {r['checks_per_substep']:7.1f} checks/substep  {r['substeps'] / r['frames']:5.2f} substeps/frame")
+        if args.render:
+            results["render"][name] = bench_render(name, args.frames)
+            for mode, m in results["render"][name].items():
+                print(f"{'':8} render {mode:6} {m['frames_per_second']:8.0f} frames/s  p50 {m['frame_ms_p50']:6.2f} ms  p99 {m['frame_ms_p99']:6.2f} ms")
+
+    if args.compare:
+        with open(args.compare) as f:
+            old = json.load(f)
+        print(f"compared to {old.get('commit')}:")
+        for name, r in results["physics"].items():
+            if name in old.get("physics", {}):
+                print(f"{name:8} {r['substeps_per_second'] / old['physics'][name]['substeps_per_second']:6.2f}x substeps/s  {r['frames_per_second'] / old['physics'][name]['frames_per_second']:6.2f}x frames/s")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
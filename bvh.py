@@ -0,0 +1,306 @@
+"""
+Scene queries against the rectangles of a World: raycasts, and point, box and circle
+overlap, for gameplay (line of sight) and tools (the rectangle under the mouse).
+
+SceneBVH is a bounding volume hierarchy over the rows of the world's RectangleStore.
+The leaves are the rectangles' bounding boxes, sorted along a Morton curve through their
+centres, so rectangles close in the world are close in the tree. The tree is implicit and
+perfectly balanced: node k has children 2k and 2k + 1, node 1 is the root and the leaves
+fill the last level, padded with empty (NaN) boxes up to a power of two. Building it is a
+sort and one pass per level, all NumPy.
+
+The tree follows the store by itself: when rectangles are added or removed it is rebuilt
+before the next query, and when they only moved (DynamicRectangles) the boxes of the moved
+leaves and of the nodes above them are refit, keeping the same tree. The rows that moved
+come from RectangleStore.movedSince; when they are not known every box is refit.
+
+Every query comes in a batched form taking arrays, one query per element. These walk the
+tree one level at a time for all queries at once, keeping the (query, node) pairs whose
+boxes still match, so a query costs the depth of the tree, log2 of the number of
+rectangles, times the number of branches it follows, and not the size of the map.
+"""
+from numpy import (arange, asarray, empty, full, nan, inf, fmin, fmax, minimum, maximum, clip, where, sqrt, argsort, lexsort,
+                   flatnonzero, repeat, diff, errstate, intp, uint64, zeros, ones, unique)
+
+
+def _spread(v):
+    # Puts a zero bit between every bit of 16-bit integers, for Morton codes
+    v = (v | (v << 8)) & 0x00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F
+    v = (v | (v << 2)) & 0x33333333
+    return (v | (v << 1)) & 0x55555555
+
+def _slab(origin, direction, low, high, enter, leave):
+    # Narrows [enter, leave] to the part of origin + t * direction between low and high, along one axis
+    with errstate(divide="ignore", invalid="ignore"):
+        t1 = (low - origin) / direction
+        t2 = (high - origin) / direction
+    parallel = direction == 0
+    outside = ~((origin >= low) & (origin <= high)) #Outside a NaN padding box too
+    enter = maximum(enter, where(parallel, where(outside, inf, -inf), minimum(t1, t2)))
+    leave = minimum(leave, where(parallel, where(outside, -inf, inf), maximum(t1, t2)))
+    return enter, leave
+
+class SceneBVH:
+    """
+    Bounding volume hierarchy over the rectangles of a world, for queries. See the module
+    docstring.
+
+    Single queries return Rectangles; batched ones return store rows, which
+    rectangles() turns into Rectangles.
+
+    Args:
+        world (World): The world whose rectangles (static and moving) are queried.
+    """
+    def __init__(self, world):
+        self.store = world.store
+        self._layout = None
+        self._version = None
+        self._size = 1
+        self._leafRows = full(1, -1, intp)
+        self._leafOf = arange(0) #Store row -> leaf
+        self._low = full((2, 2), nan)
+        self._high = full((2, 2), nan)
+
+    def _sync(self):
+        # Rebuilds or refits the tree if the store changed since the last query
+        store = self.store
+        if store.layout != self._layout:
+            self.build()
+        elif store.version != self._version:
+            self.refit(store.movedSince(self._version))
+
+    def _leafBoxes(self, rows):
+        corners = self.store._edges[rows, :2]
+        return corners.min(axis=2), corners.max(axis=2)
+
+    def build(self):
+        """
+        Builds the tree from scratch over the current store rows.
+        """
+        store = self.store
+        n = len(store)
+        size = 1
+        while size < n:
+            size *= 2
+        order = arange(0)
+        if n:
+            low, high = self._leafBoxes(arange(n))
+            centre = (low + high) / 2
+            extent = centre.max(axis=0) - centre.min(axis=0)
+            grid = ((centre - centre.min(axis=0)) / where(extent > 0, extent, 1) * 65535).astype(uint64)
+            order = argsort(_spread(grid[:, 0]) | _spread(grid[:, 1]) << uint64(1), kind="stable")
+        self._size = size
+        self._leafRows = full(size, -1, intp)
+        self._leafRows[:n] = order
+        self._leafOf = empty(n, intp)
+        self._leafOf[order] = arange(n)
+        self._low = full((2 * size, 2), nan)
+        self._high = full((2 * size, 2), nan)
+        self._layout = store.layout
+        self.refit()
+
+    def refit(self, rows=None):
+        """
+        Recomputes the boxes of the tree from the current geometry, keeping its shape.
+
+        Args:
+            rows (array, optional): Store rows that moved; only their leaves and the nodes
+            above them are recomputed. By default every box is.
+        """
+        size = self._size
+        n = len(self.store)
+        low, high = self._low, self._high
+        if rows is not None and len(rows) < n // 4:
+            #Only the paths from the moved leaves up to the root, one level at a time
+            nodes = self._leafOf[rows] + size
+            low[nodes], high[nodes] = self._leafBoxes(rows)
+            nodes = unique(nodes // 2)
+            while len(nodes) and nodes[0]:
+                low[nodes] = fmin(low[2 * nodes], low[2 * nodes + 1])
+                high[nodes] = fmax(high[2 * nodes], high[2 * nodes + 1])
+                nodes = unique(nodes // 2)
+            self._version = self.store.version
+            return
+        if n:
+            low[size:size + n], high[size:size + n] = self._leafBoxes(self._leafRows[:n])
+        #Parents from their children, one level at a time; padding boxes are NaN and ignored
+        level = size // 2
+        while level:
+            low[level:2 * level] = fmin(low[2 * level:4 * level:2], low[2 * level + 1:4 * level:2])
+            high[level:2 * level] = fmax(high[2 * level:4 * level:2], high[2 * level + 1:4 * level:2])
+            level //= 2
+        self._version = self.store.version
+
+    def _traverse(self, count, overlaps):
+        # (query, store row) pairs of the leaves whose boxes pass overlaps(queries, low, high)
+        self._sync()
+        if not len(self.store):
+            return arange(0), arange(0)
+        queries = arange(count)
+        nodes = full(count, 1, intp)
+        size = self._size
+        while True:
+            keep = flatnonzero(overlaps(queries, self._low[nodes], self._high[nodes]))
+            queries, nodes = queries[keep], nodes[keep]
+            if nodes.size == 0 or nodes[0] >= size:
+                break
+            queries = repeat(queries, 2)
+            nodes = (nodes[:, None] * 2 + (0, 1)).reshape(-1)
+        rows = self._leafRows[nodes - size]
+        keep = rows >= 0
+        return queries[keep], rows[keep]
+
+    def _frames(self, rows):
+        # Corner polygon1 and the edge vectors u (to polygon2) and v (to polygon4) with their squared lengths
+        edges = self.store._edges[rows]
+        return edges[:, 0, 0], edges[:, 1, 0], edges[:, 2, 0], edges[:, 3, 0], edges[:, 4, 0], edges[:, 2, 1], edges[:, 3, 1], edges[:, 4, 1]
+
+    @staticmethod
+    def _sorted(queries, rows, keep):
+        order = lexsort((rows[keep], queries[keep]))
+        return queries[keep][order], rows[keep][order]
+
+    def rectangles(self, rows):
+        # The Rectangles of store rows
+        return [self.store._rects[i] for i in asarray(rows).tolist()]
+
+    def pointMany(self, x, y):
+        """
+        The rectangles containing each point.
+
+        Args:
+            x, y (numpy.ndarray): The points.
+
+        Returns:
+            tuple: (points, rows) arrays, one entry per point and store row containing it,
+            sorted by point then row.
+        """
+        x = asarray(x, dtype=float).reshape(-1)
+        y = asarray(y, dtype=float).reshape(-1)
+        queries, rows = self._traverse(len(x), lambda q, low, high: (low[:, 0] <= x[q]) & (x[q] <= high[:, 0]) & (low[:, 1] <= y[q]) & (y[q] <= high[:, 1]))
+        x1, y1, uX, uY, uu, vX, vY, vv = self._frames(rows)
+        offsetX = x[queries] - x1
+        offsetY = y[queries] - y1
+        s = (offsetX * uX + offsetY * uY) / uu
+        t = (offsetX * vX + offsetY * vY) / vv
+        return self._sorted(queries, rows, (s >= 0) & (s <= 1) & (t >= 0) & (t <= 1))
+
+    def boxMany(self, minX, minY, maxX, maxY):
+        """
+        The rectangles overlapping each axis-aligned box, by separating axes.
+
+        Returns:
+            tuple: (boxes, rows) arrays, sorted by box then row.
+        """
+        minX, minY, maxX, maxY = (asarray(i, dtype=float).reshape(-1) for i in (minX, minY, maxX, maxY))
+        queries, rows = self._traverse(len(minX), lambda q, low, high: (low[:, 0] <= maxX[q]) & (minX[q] <= high[:, 0]) & (low[:, 1] <= maxY[q]) & (minY[q] <= high[:, 1]))
+        #The leaf boxes settled the x and y axes; the rectangle's own two axes are left
+        x1, y1, uX, uY, uu, vX, vY, vv = self._frames(rows)
+        keep = ones(len(rows), bool)
+        for axisX, axisY, length in ((uX, uY, uu), (vX, vY, vv)):
+            start = x1 * axisX + y1 * axisY
+            #Projections of the box corners onto the axis
+            low = minimum(minX[queries] * axisX, maxX[queries] * axisX) + minimum(minY[queries] * axisY, maxY[queries] * axisY)
+            high = maximum(minX[queries] * axisX, maxX[queries] * axisX) + maximum(minY[queries] * axisY, maxY[queries] * axisY)
+            keep &= (low <= start + length) & (high >= start)
+        return self._sorted(queries, rows, keep)
+
+    def circleMany(self, x, y, radius):
+        """
+        The rectangles overlapping each circle.
+
+        Returns:
+            tuple: (circles, rows) arrays, sorted by circle then row.
+        """
+        x, y, radius = (asarray(i, dtype=float).reshape(-1) for i in (x, y, radius))
+        def overlaps(q, low, high):
+            dx = maximum(maximum(low[:, 0] - x[q], x[q] - high[:, 0]), 0)
+            dy = maximum(maximum(low[:, 1] - y[q], y[q] - high[:, 1]), 0)
+            return dx * dx + dy * dy <= radius[q] * radius[q]
+        queries, rows = self._traverse(len(x), overlaps)
+        #Closest point of the rectangle to the centre
+        x1, y1, uX, uY, uu, vX, vY, vv = self._frames(rows)
+        offsetX = x[queries] - x1
+        offsetY = y[queries] - y1
+        s = clip((offsetX * uX + offsetY * uY) / uu, 0, 1)
+        t = clip((offsetX * vX + offsetY * vY) / vv, 0, 1)
+        dx = offsetX - s * uX - t * vX
+        dy = offsetY - s * uY - t * vY
+        r = radius[queries]
+        return self._sorted(queries, rows, dx * dx + dy * dy <= r * r)
+
+    def raycastMany(self, x, y, dx, dy):
+        """
+        First rectangle hit by each segment from (x, y) to (x + dx, y + dy). A segment
+        starting inside a rectangle hits it at t = 0, with a zero normal.
+
+        Returns:
+            tuple: (rows, t, normalX, normalY) arrays, one entry per segment: the store row
+            hit (-1 for a miss), the fraction of the segment travelled before the hit and
+            the outward normal of the edge hit.
+        """
+        x, y, dx, dy = (asarray(i, dtype=float).reshape(-1) for i in (x, y, dx, dy))
+        def overlaps(q, low, high):
+            enter, leave = _slab(x[q], dx[q], low[:, 0], high[:, 0], 0, 1)
+            enter, leave = _slab(y[q], dy[q], low[:, 1], high[:, 1], enter, leave)
+            return enter <= leave
+        queries, rows = self._traverse(len(x), overlaps)
+        #Same slab test in each rectangle's own frame, where it is the unit square
+        x1, y1, uX, uY, uu, vX, vY, vv = self._frames(rows)
+        offsetX = x[queries] - x1
+        offsetY = y[queries] - y1
+        s0 = (offsetX * uX + offsetY * uY) / uu
+        t0 = (offsetX * vX + offsetY * vY) / vv
+        ds = (dx[queries] * uX + dy[queries] * uY) / uu
+        dt = (dx[queries] * vX + dy[queries] * vY) / vv
+        enterS, leave = _slab(s0, ds, 0, 1, 0, 1)
+        enterT, leave = _slab(t0, dt, 0, 1, 0, leave)
+        enter = maximum(enterS, enterT)
+        hit = flatnonzero(enter <= leave)
+        queries, rows, enter, enterS, enterT = queries[hit], rows[hit], enter[hit], enterS[hit], enterT[hit]
+        #Entered through the side of the slab the segment came from; starting inside there is no side
+        inside = enter <= 0
+        alongU = enterS >= enterT
+        sign = where(alongU, where(ds[hit] > 0, -1, 1), where(dt[hit] > 0, -1, 1))
+        length = sqrt(where(alongU, uu[hit], vv[hit]))
+        normalX = where(inside, 0, sign * where(alongU, uX[hit], vX[hit]) / length)
+        normalY = where(inside, 0, sign * where(alongU, uY[hit], vY[hit]) / length)
+        #Nearest hit of each segment, lowest row on ties
+        order = lexsort((rows, enter, queries))
+        first = order[flatnonzero(diff(queries[order], prepend=-1))]
+        hitRows = full(len(x), -1, intp)
+        hitT = full(len(x), nan)
+        hitNormalX = zeros(len(x))
+        hitNormalY = zeros(len(x))
+        q = queries[first]
+        hitRows[q] = rows[first]
+        hitT[q] = maximum(enter[first], 0)
+        hitNormalX[q] = normalX[first]
+        hitNormalY[q] = normalY[first]
+        return hitRows, hitT, hitNormalX, hitNormalY
+
+    def raycast(self, x, y, dx, dy):
+        """
+        First rectangle hit by the segment from (x, y) to (x + dx, y + dy).
+
+        Returns:
+            tuple: (rect, t, hitX, hitY, normalX, normalY), or None if nothing is hit.
+        """
+        rows, t, normalX, normalY = self.raycastMany(x, y, dx, dy)
+        if rows[0] < 0:
+            return None
+        t = float(t[0])
+        return self.store._rects[rows[0]], t, x + t * dx, y + t * dy, float(normalX[0]), float(normalY[0])
+
+    def rectanglesAt(self, x, y):
+        # Rectangles containing the point (x, y)
+        return self.rectangles(self.pointMany(x, y)[1])
+
+    def rectanglesInBox(self, minX, minY, maxX, maxY):
+        # Rectangles overlapping the axis-aligned box
+        return self.rectangles(self.boxMany(minX, minY, maxX, maxY)[1])
+
+    def rectanglesInCircle(self, x, y, radius):
+        # Rectangles overlapping the circle
+        return self.rectangles(self.circleMany(x, y, radius)[1])
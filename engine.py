@@ -0,0 +1,1619 @@
+from numpy import sin, cos, pi, sqrt, log, array, asarray, empty, zeros, fromiter, intp, int64, clip, flatnonzero, minimum, maximum, where, stack, frombuffer
+from numpy import floor, median, arange, repeat, tile, cumsum, concatenate, argsort, lexsort, unique, bincount, broadcast_to, diff
+import math
+from math import hypot
+from array import array as flat_array
+from time import perf_counter
+from collections import deque
+
+
+# Default constants
+FRAME_RATE = 60
+GRAVITY = -9.81
+GROUND_SPEED = 0.1
+SUBSTEPS = 20
+SKIN = 0.1 #Fraction of a ball's radius it may sink into geometry before continuous collision stops it
+CONTACT_SLOP = 0.05 #Fraction of a ball's radius it may drift away from an edge it rests against and still follow it
+SLEEP_SPEED = 0.05 #Balls slower than this (units per frame)...
+SLEEP_FORCE = 0.001 #...that get no more exerted acceleration than this...
+SLEEP_TIME = 0.5 #...for this many seconds fall asleep
+GROUND_ANGLES = (0, 3*pi/2, pi, pi/2) #Rectangle angle at which its top, right, bottom or left edge is flat ground
+BALL_BOUNCINESS = 0.5 #Coefficient of restitution between two balls
+CONTACT_STIFFNESS = 3 #Angular frequency of the spring between two touching balls, in radians per frame
+CONTACT_SUBSTEPS = 6 #Fewest substeps per frame while balls touch, so those springs stay stable
+PAIR_MARGIN = 2 #Ball pairs are listed this much further apart than touching, so the list lasts a few substeps
+GROUND_NORMAL = 0.7 #Particles resting on an edge whose normal points up more than this are on the ground
+
+# Helpful functions
+def split_string_to_list(input_string):
+    """
+    Splits a string at colons (:), then further splits each resulting part at commas (,),
+    returning a list of lists.
+
+    Args:
+        input_string (str): The string to be split.
+
+    Returns:
+        list: A list of lists after splitting by colons and commas.
+    """
+    # Split the string by colons
+    colon_parts = input_string.split(":")
+    
+    # Split each colon-separated part by commas and build the list of lists
+    result = [part.split(",") for part in colon_parts]
+
+    return result
+def normalize_angle(angle):
+    # Use modulo to bring the angle within the range -2π to 2π
+    angle = angle % (2 * pi)
+    # If the angle is negative, shift it to the range 0 to 2π
+    if angle < 0:
+        angle += 2 * pi
+    return angle
+
+def circleOnLine(x1, y1, x2, y2, xB, yB, r):
+    # Vector from point 1 to point 2
+    dx, dy = x2 - x1, y2 - y1
+    # Vector from point 1 to the circle's center
+    fx, fy = xB - x1, yB - y1
+
+    # Project the circle center onto the line segment, clamping to [0, 1]
+    t = max(0, min(1, (fx * dx + fy * dy) / (dx * dx + dy * dy)))
+
+    # Closest point on the line segment to the circle's center
+    cx, cy = x1 + t * dx, y1 + t * dy
+
+    # Squared distance from the circle's center to the closest point
+    dist_sq = (cx - xB) ** 2 + (cy - yB) ** 2
+
+    # Compare with squared radius to avoid unnecessary sqrt
+    return dist_sq <= r * r
+
+def sweptCircleTOI(xB, yB, dx, dy, r, rect):
+    """
+    Time of impact of a circle moving from (xB, yB) by (dx, dy) against the edges and
+    corners of a Rectangle.
+
+    Args:
+        xB, yB: Centre of the circle at the start of the move.
+        dx, dy: Displacement over the move.
+        r: Radius of the circle.
+        rect (Rectangle): The rectangle to test against.
+
+    Returns:
+        float: The fraction t in [0, 1] of the move at which the circle first touches the
+        rectangle, or None if it does not. Features the circle already overlaps at t = 0
+        are ignored, the discrete collision check handles those.
+    """
+    first = None
+    g = rect._geometry
+    a = dx * dx + dy * dy
+    for c in range(4):
+        x1, y1 = g[2 * c], g[2 * c + 1]
+        x2, y2 = g[(2 * c + 2) % 8], g[(2 * c + 3) % 8]
+        ex, ey = x2 - x1, y2 - y1
+        length = g[LENGTHS + c]
+        # Edge: distance to the line drops to r while the contact lies within the segment
+        nx, ny = g[NORMALS + 2 * c], g[NORMALS + 2 * c + 1]
+        side = (xB - x1) * nx + (yB - y1) * ny
+        if side < 0:
+            nx, ny, side = -nx, -ny, -side
+        approach = dx * nx + dy * ny
+        if side > r and approach < 0:
+            t = (side - r) / -approach
+            if t <= 1 and (first is None or t < first):
+                u = ((xB + t * dx - x1) * ex + (yB + t * dy - y1) * ey) / (length * length)
+                if 0 <= u <= 1:
+                    first = t
+        # Corner: distance to the point drops to r
+        fx, fy = xB - x1, yB - y1
+        cc = fx * fx + fy * fy - r * r
+        if cc > 0 and a > 0:
+            b = 2 * (dx * fx + dy * fy)
+            disc = b * b - 4 * a * cc
+            if disc >= 0 and b < 0:
+                t = (-b - math.sqrt(disc)) / (2 * a)
+                if t <= 1 and (first is None or t < first):
+                    first = t
+    return first
+
+# Classes
+def rectangle_corners(x, y, width, height, angle):
+    """
+    Corner polygons (polygon1 to polygon4) of many rectangles at once, as ((x1, y1), ..., (x4, y4)) arrays.
+    """
+    c, s = cos(angle), sin(angle)
+    return ((x, y),
+            (x + width * c, y - width * s),
+            (x - height * s + width * c, y - height * c - width * s),
+            (x - height * s, y - height * c))
+
+#Layout of Rectangle._geometry: offsets of each part in the flat array
+POLYGON = 0 #Corners polygon1 to polygon4: x1, y1, x2, y2, x3, y3, x4, y4
+CENTER = 8 #x, y
+AABB = 10 #minX, minY, maxX, maxY
+MAXLENGTH = 14 #Radius of the bounding circle
+NORMALS = 15 #Outward unit normal x, y of the top, right, bottom and left edges
+LENGTHS = 23 #Length of the top, right, bottom and left edges
+CORNER_NORMALS = 27 #Outward unit normal x, y of the top-right, bottom-right, bottom-left and top-left corners
+GEOMETRY_SIZE = 35
+EDGE_LINES = ((0, 2), (2, 4), (6, 4), (0, 6)) #Per edge, the corners whose difference is the vector a speed is mirrored over
+
+def rectangle_geometry(x, y, width, height, angle):
+    """
+    Computes the collision and rendering geometry of many rectangles at once.
+
+    Args:
+        x, y, width, height (numpy.ndarray): Position of the first corner and size of each rectangle.
+        angle (numpy.ndarray): Angle of each rectangle, in radians within [0, 2π).
+
+    Returns:
+        numpy.ndarray: (rectangles, GEOMETRY_SIZE) array, one Rectangle._geometry per row.
+    """
+    (p1x, p1y), (p2x, p2y), (p3x, p3y), (p4x, p4y) = rectangle_corners(x, y, width, height, angle)
+    geometry = empty((len(x), GEOMETRY_SIZE))
+    geometry[:, POLYGON:POLYGON + 8] = stack((p1x, p1y, p2x, p2y, p3x, p3y, p4x, p4y), axis=1)
+    centerX, centerY = (p1x + p2x + p3x + p4x) / 4, (p1y + p2y + p3y + p4y) / 4
+    geometry[:, CENTER] = centerX
+    geometry[:, CENTER + 1] = centerY
+    #Axis-aligned bounding box
+    geometry[:, AABB] = minimum(minimum(p1x, p2x), minimum(p3x, p4x))
+    geometry[:, AABB + 1] = minimum(minimum(p1y, p2y), minimum(p3y, p4y))
+    geometry[:, AABB + 2] = maximum(maximum(p1x, p2x), maximum(p3x, p4x))
+    geometry[:, AABB + 3] = maximum(maximum(p1y, p2y), maximum(p3y, p4y))
+    geometry[:, MAXLENGTH] = sqrt((width / 2)**2 + (height / 2)**2)
+    corners = ((p1x, p1y), (p2x, p2y), (p3x, p3y), (p4x, p4y))
+    #Per edge (top, right, bottom, left): outward unit normal and length
+    normals = []
+    for e in range(4):
+        (sx, sy), (ex, ey) = corners[e], corners[(e + 1) % 4]
+        dx, dy = ex - sx, ey - sy
+        length = sqrt(dx * dx + dy * dy)
+        nx, ny = dy / length, -dx / length
+        flip = (centerX - sx) * nx + (centerY - sy) * ny > 0
+        normals.append((where(flip, -nx, nx), where(flip, -ny, ny)))
+        geometry[:, NORMALS + 2 * e] = normals[e][0]
+        geometry[:, NORMALS + 2 * e + 1] = normals[e][1]
+        geometry[:, LENGTHS + e] = length
+    #Per corner (top-right, bottom-right, bottom-left, top-left): outward unit normal, halfway between its two edges'
+    for c, (a, b) in enumerate(((0, 1), (2, 1), (2, 3), (0, 3))):
+        geometry[:, CORNER_NORMALS + 2 * c] = (normals[a][0] + normals[b][0]) / sqrt(2)
+        geometry[:, CORNER_NORMALS + 2 * c + 1] = (normals[a][1] + normals[b][1]) / sqrt(2)
+    return geometry
+
+def geometry_view(offset, count=1, pairs=False):
+    """
+    Property reading count values of Rectangle._geometry from offset on: one float, a
+    tuple of them, or with pairs a tuple of count (x, y) pairs. Setting it writes them
+    back in place.
+    """
+    def get(self):
+        g = self._geometry
+        if pairs:
+            return tuple((g[offset + 2 * k], g[offset + 2 * k + 1]) for k in range(count)) if count > 1 else (g[offset], g[offset + 1])
+        return tuple(g[offset:offset + count]) if count > 1 else g[offset]
+    def set(self, value):
+        if pairs and count > 1:
+            value = [v for pair in value for v in pair]
+        self._geometry[offset:offset + len(value)] = flat_array("d", value)
+    return property(get, set)
+
+class Rectangle:
+    """
+    Static level geometry. Everything collisions need is computed once, by
+    rectangle_geometry, and kept in one flat float64 array, _geometry (see POLYGON and
+    the offsets after it): the corners (polygon1 to polygon4), the bounding circle and
+    box, for the top, right, bottom and left edges (in that order) the outward unit
+    normal and the length, and for the top-right, bottom-right, bottom-left and top-left
+    corners the outward unit normal. _polygon1, _center, _normals and the like read and
+    write it as tuples; the collision code indexes it directly.
+
+    Rectangles that move are DynamicRectangles.
+    """
+    __slots__ = ("_x", "_y", "_width", "_height", "_color", "_angle", "_bounciness", "_geometry", "_storeIndex")
+
+    _polygon1 = geometry_view(POLYGON, pairs=True)
+    _polygon2 = geometry_view(POLYGON + 2, pairs=True)
+    _polygon3 = geometry_view(POLYGON + 4, pairs=True)
+    _polygon4 = geometry_view(POLYGON + 6, pairs=True)
+    _center = geometry_view(CENTER, pairs=True)
+    _aabb = geometry_view(AABB, 4)
+    _maxlength = geometry_view(MAXLENGTH)
+    _normals = geometry_view(NORMALS, 4, pairs=True)
+    _lengths = geometry_view(LENGTHS, 4)
+    _cornerNormals = geometry_view(CORNER_NORMALS, 4, pairs=True)
+
+    def __init__(self, x, y, width, height, angle, color="black",bounciness=0.5):
+        self._x = x
+        self._y = y
+        self._width = width
+        self._height = height
+        self._color = color
+        self._angle = float(normalize_angle(angle * (pi / 180))) #Make radians
+        self._bounciness = bounciness
+        self._storeIndex = None
+        self._computeGeometry()
+
+    def _computeGeometry(self):
+        #Define corner polygons for rendering and collision (no recalculation necessary)
+        self._geometry = flat_array("d", rectangle_geometry(array([self._x]), array([self._y]), array([self._width]), array([self._height]), array([self._angle])).tobytes())
+
+def build_rectangles(x, y, width, height, angle, colors, bounciness, cls=None):
+    """
+    Builds many Rectangles at once, with their geometry computed in bulk.
+
+    Args:
+        x, y, width, height, bounciness (sequence): Per rectangle values.
+        angle (sequence): Per rectangle angle, in radians (unlike the Rectangle constructor).
+        colors (list): Per rectangle colour.
+        cls (type): Rectangle or a subclass that accepts the same arguments. Defaults to Rectangle.
+
+    Returns:
+        list: The new Rectangles.
+    """
+    cls = cls or Rectangle
+    x, y, width, height = (asarray(i, dtype=float) for i in (x, y, width, height))
+    angle = asarray(angle, dtype=float) % (2 * pi)
+    geometry = rectangle_geometry(x, y, width, height, angle).tobytes()
+    size = GEOMETRY_SIZE * 8
+    rects = []
+    for k, (xs, ys, ws, hs, a, color, b) in enumerate(zip(x.tolist(), y.tolist(), width.tolist(), height.tolist(), angle.tolist(), colors, asarray(bounciness, dtype=float).tolist())):
+        rect = cls.__new__(cls)
+        rect._x, rect._y, rect._width, rect._height, rect._angle, rect._color, rect._bounciness, rect._storeIndex = xs, ys, ws, hs, a, color, b, None
+        rect._geometry = flat_array("d", geometry[k * size:(k + 1) * size])
+        if cls is not Rectangle:
+            cls._initDynamics(rect)
+        rects.append(rect)
+    return rects
+
+class DynamicRectangle(Rectangle):
+    """
+    A Rectangle with velocity and acceleration, updated every substep like a Ball. For
+    kinematic or scripted motion only: nothing pushes it and it is not resolved against
+    the other rectangles, so it has no gravity. Drive it by setting _vX, _vY, _aX and _aY.
+
+    Moving only translates it, so its geometry follows by shifting the corners, centre
+    and bounding box in _geometry (translate()); the normals, lengths and corner
+    normals stay as they are and nothing is recomputed with trigonometry. _moveX and _moveY hold the last
+    substep's move, which World.step uses to update just the moved rows of the
+    collision structures and balls standing on the rectangle use to ride along.
+    """
+    __slots__ = ("_aX", "_aY", "_vX", "_vY", "_asleep", "_moveX", "_moveY")
+    STATE = ("_x", "_y", "_aX", "_aY", "_vX", "_vY", "_asleep", "_moveX", "_moveY",
+             "_polygon1", "_polygon2", "_polygon3", "_polygon4", "_center", "_aabb") #Fields that change while simulating
+
+    def __init__(self, x, y, width, height, angle, color="black",bounciness=0.5):
+        super().__init__(x, y, width, height, angle, color, bounciness)
+        self._initDynamics()
+
+    def _initDynamics(self):
+        self._aX = 0
+        self._aY = 0
+        self._vX = 0
+        self._vY = 0
+        self._asleep = False
+        self._moveX = 0
+        self._moveY = 0
+
+    def translate(self, dx, dy):
+        self._x += dx
+        self._y += dy
+        g = self._geometry
+        #Corners, centre and both corners of the bounding box, in place
+        for k in (POLYGON, POLYGON + 2, POLYGON + 4, POLYGON + 6, CENTER, AABB, AABB + 2):
+            g[k] += dx
+            g[k + 1] += dy
+
+    def update(self, world):
+        # Returns whether the rectangle moved
+        # Apply acceleration
+        self._vY += self._aY
+        self._vX += self._aX
+        # Apply speed
+        self._moveX = self._vX / world.substeps
+        self._moveY = self._vY / world.substeps
+        if self._moveX or self._moveY:
+            self.translate(self._moveX, self._moveY)
+            return True
+        return False
+
+class MovingPlatform(DynamicRectangle):
+    """
+    A kinematic rectangle going back and forth between where it starts and (toX, toY)
+    at a constant speed. Nothing pushes it and gravity does not pull it.
+
+    Args:
+        x, y, width, height, angle, color, bounciness: As for Rectangle.
+        toX, toY (float): The other end of its path, for its first corner.
+        speed (float): Distance covered per frame.
+    """
+    __slots__ = ("_startX", "_startY", "_toX", "_toY", "_length", "_speed", "_progress", "_direction")
+    STATE = DynamicRectangle.STATE + ("_progress", "_direction")
+
+    def __init__(self, x, y, width, height, angle, toX, toY, speed=1, color="black",bounciness=0.5):
+        super().__init__(x, y, width, height, angle, color, bounciness)
+        self._startX = x
+        self._startY = y
+        self._toX = toX
+        self._toY = toY
+        self._length = float(sqrt((toX - x)**2 + (toY - y)**2))
+        self._speed = speed
+        self._progress = 0 #Distance from the start along the path
+        self._direction = 1
+
+    def update(self, world):
+        length = self._length
+        if not length:
+            self._moveX = self._moveY = 0
+            return False
+        progress = self._progress + self._direction * self._speed / world.substeps
+        if progress >= length or progress <= 0:
+            progress = min(max(progress, 0), length)
+            self._direction = -self._direction
+        self._progress = progress
+        #Move to the exact spot on the path, so rounding does not add up over time
+        self._moveX = self._startX + (self._toX - self._startX) * progress / length - self._x
+        self._moveY = self._startY + (self._toY - self._startY) * progress / length - self._y
+        self._vX = self._moveX * world.substeps
+        self._vY = self._moveY * world.substeps
+        self.translate(self._moveX, self._moveY)
+        return True
+
+class Ball:
+    STATE = ("_x", "_y", "_aX", "_aY", "_vX", "_vY", "_eaX", "_eaY", "_gravity", "_onGround", "_ground", "_lastCollision", "_asleep", "_sleepTime", "_contacts") #Fields that change while simulating
+
+    def __init__(self, x, y, radius, mass=1, color="black", gravity=True):
+        self._x = x
+        self._y = y
+        self._radius = radius
+        self._color = color
+        self._gravity = gravity
+        self._aX = 0
+        self._aY = 0
+        self._vX = 0
+        self._vY = 0
+        self._eaX = 0
+        self._eaY = 0
+        self._mass = mass
+        self._onGround = False
+        self._ground = None
+        self._lastCollision = None
+        self._asleep = False
+        self._sleepTime = 0
+        self._contacts = () #(rectangle, edge) the ball rests or slides against, see followContacts
+    def update(self, world):
+        self._aX = 0
+        self._aY = 0
+        #Ride along with a moving ground
+        riding = isinstance(self._ground,DynamicRectangle)
+        if riding:
+            self._x += self._ground._moveX
+            self._y += self._ground._moveY
+        #Check if still on ground
+        if self._onGround:
+            g = self._ground._geometry
+            angle = self._ground._angle
+            if angle == 0: #GROUND = TOP
+                if not circleOnLine(g[0],g[1],g[2],g[3],self._x,self._y,self._radius):
+                    self._onGround = False
+                    self._ground = None
+            elif angle == pi/2: #GROUND = LEFT
+                if not circleOnLine(g[0],g[1],g[6],g[7],self._x,self._y,self._radius):
+                    self._onGround = False
+                    self._ground = None
+            elif angle == pi: #GROUND = BOTTOM
+                if not circleOnLine(g[6],g[7],g[4],g[5],self._x,self._y,self._radius):
+                    self._onGround = False
+                    self._ground = None
+            elif angle == 3*pi/2: #GROUND = RIGHT
+                if not circleOnLine(g[2],g[3],g[4],g[5],self._x,self._y,self._radius):
+                    self._onGround = False
+                    self._ground = None
+        #Apply gravity
+        if self._gravity and not self._onGround and not world.fly:
+            self._aY += world.gravity / (world.frameRate * world.substeps)
+        #Apply exerted acceleration, if any, and reset
+        pushed = self._eaX**2 + self._eaY**2 > SLEEP_FORCE**2
+        self._aX += self._eaX
+        self._aY += self._eaY
+        self._eaX = 0
+        self._eaY = 0
+        #If on ground, no downward acceleration
+        if self._onGround and self._aY < 0:
+            self._aY = 0
+        if self._onGround and self._aY > 0:
+            self._onGround = False
+            self._ground = None
+        # Apply acceleration
+        self._vY += self._aY
+        self._vX += self._aX
+        #Slide along the edges the ball rests against instead of sinking into them and bouncing off again
+        for other, e in self._contacts:
+            g = other._geometry
+            normalX, normalY = g[NORMALS + 2 * e], g[NORMALS + 2 * e + 1]
+            gap = (self._x - g[2 * e]) * normalX + (self._y - g[2 * e + 1]) * normalY - self._radius
+            speed = self._vX * normalX + self._vY * normalY
+            closing = -max(gap, 0) * world.substeps #Normal speed that just closes the gap this substep
+            #The edge takes the acceleration of this substep; only speed the ball already had can make it bounce
+            impact = speed - (self._aX * normalX + self._aY * normalY)
+            if speed < closing and -impact * other._bounciness < world.groundSpeed:
+                self._vX += (closing - speed) * normalX
+                self._vY += (closing - speed) * normalY
+        # Apply speed
+        dx = self._vX / world.substeps
+        dy = self._vY / world.substeps
+        if world.adaptive and dx * dx + dy * dy > (SKIN * self._radius)**2:
+            #Fast enough to pass through thin geometry: stop at the first impact, the next substep resolves it
+            t = world.timeOfImpact(self, dx, dy)
+            if t is not None:
+                dx *= t
+                dy *= t
+        self._x += dx
+        self._y += dy
+        #Fall asleep after resting long enough; World skips sleeping balls until woken
+        if not pushed and not riding and self._vX**2 + self._vY**2 < SLEEP_SPEED**2:
+            self._sleepTime += 1 / (world.frameRate * world.substeps)
+            if self._sleepTime >= SLEEP_TIME:
+                self._asleep = True
+        else:
+            self._sleepTime = 0
+    
+    def checkCollision(self, other, world):
+        # Find out which types
+        x1, y1, x2, y2, x3, y3, x4, y4 = other._geometry[:8]
+
+        top = circleOnLine(x1,y1,x2,y2,self._x,self._y,self._radius)
+        right = circleOnLine(x2,y2,x3,y3,self._x,self._y,self._radius)
+        bottom = circleOnLine(x3,y3,x4,y4,self._x,self._y,self._radius)
+        left = circleOnLine(x4,y4,x1,y1,self._x,self._y,self._radius)
+
+        return self.resolveCollision(other, top, right, bottom, left, world)
+
+    def resolveCollision(self, other, top, right, bottom, left, world):
+        # Which edges are touched decides the branch: one edge bounces off that edge, two adjacent edges off the corner
+        # Returns the kind of contact ("edge", "corner" or "other" when no branch applies), or None without contact
+        self._lastCollision = other
+        touched = int(top) + int(right) + int(bottom) + int(left)
+        if touched == 1:
+            # ONLY TOP, RIGHT, BOTTOM or LEFT
+            e = 0 if top else 1 if right else 2 if bottom else 3
+            g = other._geometry
+            #Mirror the speed vector over the line vector using projections
+            a, b = EDGE_LINES[e]
+            lineX, lineY = g[a] - g[b], g[a + 1] - g[b + 1]
+            lineSq = lineX * lineX + lineY * lineY
+            dot = self._vX * lineX + self._vY * lineY
+            mirroredVector = (2 * lineX * dot / lineSq - self._vX, 2 * lineY * dot / lineSq - self._vY)
+            #Update speeds accordingly
+            self._vX = other._bounciness * mirroredVector[0]
+            self._vY = other._bounciness * mirroredVector[1]
+            #Snap to edge: project the centre onto the edge line and move it out to one radius along the normal
+            normalX, normalY = g[NORMALS + 2 * e], g[NORMALS + 2 * e + 1]
+            distance = (self._x - g[2 * e]) * normalX + (self._y - g[2 * e + 1]) * normalY
+            side = self._radius if distance >= 0 else -self._radius
+            self._x += (side - distance) * normalX
+            self._y += (side - distance) * normalY
+            #Ground check
+            if other._angle == GROUND_ANGLES[e] and self._vY < world.groundSpeed:
+                self._vY = 0
+                self._onGround = True
+                self._ground = other
+            elif side > 0 and abs(self._vX * normalX + self._vY * normalY) < world.groundSpeed and not isinstance(other,DynamicRectangle):
+                #Came to rest against a wall or slope: follow it from now on
+                if (other, e) not in self._contacts:
+                    self._contacts += ((other, e),)
+            return "edge"
+        if touched == 2 and top != bottom:
+            # TOP-RIGHT, BOTTOM-RIGHT, BOTTOM-LEFT or TOP-LEFT CORNER
+            c = (0 if right else 3) if top else (1 if right else 2)
+            #The contact normal points from the corner to the centre; with the centre past the corner, inside the rectangle, the corner's own normal
+            g = other._geometry
+            cornerX, cornerY = g[(2 * c + 2) % 8], g[(2 * c + 3) % 8]
+            normalX = self._x - cornerX
+            normalY = self._y - cornerY
+            distance = hypot(normalX, normalY)
+            outwardX, outwardY = g[CORNER_NORMALS + 2 * c], g[CORNER_NORMALS + 2 * c + 1]
+            if distance > 0 and normalX * outwardX + normalY * outwardY > 0:
+                normalX /= distance
+                normalY /= distance
+            else:
+                normalX, normalY = outwardX, outwardY
+            #Mirror the speed over the tangent at the contact, if it goes into the corner
+            vX = self._vX
+            vY = self._vY
+            speed = vX * normalX + vY * normalY
+            if speed < 0:
+                bounciness = other._bounciness
+                self._vX = bounciness * (vX - 2 * speed * normalX)
+                self._vY = bounciness * (vY - 2 * speed * normalY)
+            #Snap to one radius from the corner
+            self._x = cornerX + normalX * self._radius
+            self._y = cornerY + normalY * self._radius
+            return "corner"
+        return "other" if touched else None
+
+    def followContacts(self, world):
+        """
+        Incremental check of the cached contacts: a ball still lying along the edge it
+        rested against is snapped back onto it with the cached normal, without testing
+        the rectangle's four edges again. Contacts the ball left (past an end of the edge,
+        moving or drifted away) are dropped, and a hard hit bounces like a new contact.
+
+        Returns:
+            list: The rectangles handled, which detect_collisions skips.
+        """
+        contacts = self._contacts
+        self._contacts = ()
+        handled = []
+        for other, e in contacts:
+            if other._storeIndex is None:
+                continue
+            g = other._geometry
+            startX, startY = g[2 * e], g[2 * e + 1]
+            endX, endY = g[(2 * e + 2) % 8], g[(2 * e + 3) % 8]
+            lineX = endX - startX
+            lineY = endY - startY
+            along = ((self._x - startX) * lineX + (self._y - startY) * lineY) / (lineX * lineX + lineY * lineY)
+            normalX, normalY = g[NORMALS + 2 * e], g[NORMALS + 2 * e + 1]
+            distance = (self._x - startX) * normalX + (self._y - startY) * normalY
+            speed = self._vX * normalX + self._vY * normalY
+            if not (0 <= along <= 1 and 0 < distance <= self._radius * (1 + CONTACT_SLOP)) or speed > world.groundSpeed:
+                continue
+            handled.append(other)
+            if -speed * other._bounciness >= world.groundSpeed:
+                self.resolveCollision(other, e == 0, e == 1, e == 2, e == 3, world)
+                continue
+            if distance < self._radius:
+                self._x += (self._radius - distance) * normalX
+                self._y += (self._radius - distance) * normalY
+                self._lastCollision = other
+            if speed < 0:
+                self._vX -= speed * normalX
+                self._vY -= speed * normalY
+            if (other, e) not in self._contacts:
+                self._contacts += ((other, e),)
+        return handled
+
+    def exertForce(self,forceX,forceY):
+        self._eaX += forceX / self._mass
+        self._eaY += forceY / self._mass
+        if self._eaX**2 + self._eaY**2 > SLEEP_FORCE**2:
+            self.wake()
+
+    def wake(self):
+        self._asleep = False
+        self._sleepTime = 0
+
+
+class SpatialHash:
+    """
+    Uniform grid over the bounding circles (_center, _maxlength) of Rectangles, used as
+    the broadphase for collision detection.
+
+    Every rectangle is stored in each cell its bounding square overlaps. Rectangles that
+    would cover more than MAX_CELLS cells (like the ground of the default map) are kept in
+    a separate list that is checked every query instead.
+
+    Args:
+        cellSize (float): Width and height of a grid cell in world units.
+    """
+    MAX_CELLS = 64
+
+    def __init__(self, cellSize=128):
+        self._cellSize = cellSize
+        self._cells = {}
+        self._large = []
+        self._keys = {}
+        self._order = {}
+        self._count = 0
+
+    def _cellRange(self, x, y, r):
+        size = self._cellSize
+        return int((x - r) // size), int((x + r) // size), int((y - r) // size), int((y + r) // size)
+
+    def insert(self, rect):
+        g = rect._geometry
+        minX, maxX, minY, maxY = self._cellRange(g[CENTER], g[CENTER + 1], g[MAXLENGTH])
+        self._order[rect] = self._count
+        self._count += 1
+        if (maxX - minX + 1) * (maxY - minY + 1) > self.MAX_CELLS:
+            self._large.append(rect)
+            self._keys[rect] = None
+            return
+        keys = [(cx, cy) for cx in range(minX, maxX + 1) for cy in range(minY, maxY + 1)]
+        for key in keys:
+            self._cells.setdefault(key, []).append(rect)
+        self._keys[rect] = keys
+
+    def remove(self, rect):
+        keys = self._keys.pop(rect, False)
+        if keys is False:
+            return
+        del self._order[rect]
+        if keys is None:
+            self._large.remove(rect)
+            return
+        for key in keys:
+            cell = self._cells[key]
+            cell.remove(rect)
+            if not cell:
+                del self._cells[key]
+
+    def move(self, rect):
+        """
+        Updates the cells of a rectangle that moved. Its place in the query order stays
+        the same, and nothing happens while it stays within the same cells.
+        """
+        keys = self._keys.get(rect, False)
+        if keys is False:
+            return
+        g = rect._geometry
+        x, y, r = g[CENTER], g[CENTER + 1], g[MAXLENGTH]
+        size = self._cellSize
+        minX, minY = int((x - r) // size), int((y - r) // size)
+        maxX, maxY = int((x + r) // size), int((y + r) // size)
+        if keys is None:
+            if (maxX - minX + 1) * (maxY - minY + 1) > self.MAX_CELLS:
+                return
+        elif keys[0] == (minX, minY) and keys[-1] == (maxX, maxY):
+            return
+        order = self._order[rect]
+        self.remove(rect)
+        self.insert(rect)
+        self._order[rect] = order
+        self._count -= 1
+
+    def rebuild(self, objects):
+        self._cells = {}
+        self._large = []
+        self._keys = {}
+        self._order = {}
+        self._count = 0
+        for i in objects:
+            if isinstance(i,Rectangle):
+                self.insert(i)
+
+    def query(self, x, y, r):
+        """
+        Returns the rectangles whose cells overlap the square around (x, y) with half-size r,
+        in the order they were inserted so results stay deterministic.
+        """
+        return self.queryBox(x - r, y - r, x + r, y + r)
+
+    def queryBox(self, minX, minY, maxX, maxY):
+        """
+        Same as query, for the axis-aligned box from (minX, minY) to (maxX, maxY).
+        """
+        size = self._cellSize
+        cellMinX, cellMaxX = int(minX // size), int(maxX // size)
+        cellMinY, cellMaxY = int(minY // size), int(maxY // size)
+        if (cellMaxX - cellMinX + 1) * (cellMaxY - cellMinY + 1) > len(self._cells):
+            #Box covers more cells than are in use (zoomed far out), just look at the used ones
+            found = set(self._large)
+            for (cx, cy), cell in self._cells.items():
+                if cellMinX <= cx <= cellMaxX and cellMinY <= cy <= cellMaxY:
+                    found.update(cell)
+            return sorted(found, key=self._order.__getitem__)
+        cells = self._cells
+        found = set(self._large)
+        for cx in range(cellMinX, cellMaxX + 1):
+            for cy in range(cellMinY, cellMaxY + 1):
+                cell = cells.get((cx, cy))
+                if cell:
+                    found.update(cell)
+        return sorted(found, key=self._order.__getitem__)
+
+    def __len__(self):
+        return len(self._keys)
+
+class RectangleStore:
+    """
+    Struct-of-arrays copy of the static Rectangle geometry, used by the vectorized
+    narrowphase. Row k of the store describes one rectangle:
+    - _bounds[k]: centre x, centre y and _maxlength (the bounding circle)
+    - _edges[k]: start x, start y, vector x, vector y and squared length of the top,
+      right, bottom and left edges, in the order checkCollision tests them. The edge
+      starts are the corners polygon1 to polygon4.
+    - _bounciness[k]: coefficient of restitution
+
+    Each stored Rectangle remembers its row in _storeIndex. Removing a rectangle moves
+    the last row into the freed slot. version goes up on every change, for callers that
+    keep rows around, and layout only when rows are added, removed or moved to another slot.
+    The rows changed in place since a version are known from movedSince().
+    """
+    MOVED_LOG = 256 #Changes in place remembered for movedSince
+
+    def __init__(self, capacity=64):
+        self._rects = []
+        self.version = 0
+        self.layout = 0
+        self._moved = deque(maxlen=self.MOVED_LOG) #(version, rows) of the changes in place since the last layout change
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        size = len(self._rects)
+        bounds = empty((capacity, 3))
+        edges = empty((capacity, 5, 4))
+        bounciness = empty(capacity)
+        if size:
+            bounds[:size] = self._bounds[:size]
+            edges[:size] = self._edges[:size]
+            bounciness[:size] = self._bounciness[:size]
+        self._bounds = bounds
+        self._edges = edges
+        self._bounciness = bounciness
+
+    def add(self, rect):
+        k = len(self._rects)
+        self.layout += 1
+        self._moved.clear()
+        if k == len(self._bounciness):
+            self._allocate(2 * k)
+        rect._storeIndex = k
+        self._rects.append(rect)
+        self.update(rect)
+
+    def update(self, rect):
+        # Rewrites the row of a rectangle whose geometry changed
+        k = rect._storeIndex
+        self.version += 1
+        self._moved.append((self.version, array([k])))
+        g = rect._geometry
+        for c in range(4):
+            startX, startY = g[2 * c], g[2 * c + 1]
+            dx, dy = g[(2 * c + 2) % 8] - startX, g[(2 * c + 3) % 8] - startY
+            self._edges[k, :, c] = (startX, startY, dx, dy, dx * dx + dy * dy)
+        self._bounds[k] = (g[CENTER], g[CENTER + 1], g[MAXLENGTH])
+        self._bounciness[k] = rect._bounciness
+
+    def translate(self, rects):
+        """
+        Shifts the rows of DynamicRectangles by their last move (_moveX, _moveY), the same
+        way DynamicRectangle.translate shifts the rectangles themselves. Only these rows are
+        touched.
+        """
+        rows = self.indices(rects)
+        self.version += 1
+        self._moved.append((self.version, rows))
+        dx = fromiter((i._moveX for i in rects), float, len(rects))
+        dy = fromiter((i._moveY for i in rects), float, len(rects))
+        edges = self._edges[rows]
+        edges[:, 0] += dx[:, None]
+        edges[:, 1] += dy[:, None]
+        #Edge vectors from the shifted corners, like extend() does, so they match the polygons to the last bit
+        edges[:, 2] = edges[:, 0, [1, 2, 3, 0]] - edges[:, 0]
+        edges[:, 3] = edges[:, 1, [1, 2, 3, 0]] - edges[:, 1]
+        edges[:, 4] = edges[:, 2] * edges[:, 2] + edges[:, 3] * edges[:, 3]
+        self._edges[rows] = edges
+        self._bounds[rows, 0] += dx
+        self._bounds[rows, 1] += dy
+
+    def remove(self, rect):
+        k = rect._storeIndex
+        last = len(self._rects) - 1
+        self.version += 1
+        self.layout += 1
+        self._moved.clear()
+        if k != last:
+            moved = self._rects[last]
+            self._rects[k] = moved
+            moved._storeIndex = k
+            self._bounds[k] = self._bounds[last]
+            self._edges[k] = self._edges[last]
+            self._bounciness[k] = self._bounciness[last]
+        self._rects.pop()
+        rect._storeIndex = None
+
+    def rebuild(self, objects):
+        rects = [i for i in objects if isinstance(i,Rectangle)]
+        self._rects = []
+        self.version += 1
+        self.layout += 1
+        self._moved.clear()
+        self._allocate(max(64, len(rects)))
+        self.extend(rects)
+
+    def extend(self, rects):
+        # Bulk add
+        k = len(self._rects)
+        n = len(rects)
+        if not n:
+            return
+        self.version += 1
+        self.layout += 1
+        self._moved.clear()
+        if k + n > len(self._bounciness):
+            self._allocate(max(2 * len(self._bounciness), k + n))
+        geometry = frombuffer(b"".join(i._geometry for i in rects)).reshape(n, GEOMETRY_SIZE)
+        corners = geometry[:, POLYGON:POLYGON + 8].reshape(n, 4, 2)
+        edges = corners[:, [1, 2, 3, 0]] - corners
+        rows = slice(k, k + n)
+        self._edges[rows, 0] = corners[:, :, 0]
+        self._edges[rows, 1] = corners[:, :, 1]
+        self._edges[rows, 2] = edges[:, :, 0]
+        self._edges[rows, 3] = edges[:, :, 1]
+        self._edges[rows, 4] = edges[:, :, 0] * edges[:, :, 0] + edges[:, :, 1] * edges[:, :, 1]
+        self._bounds[rows] = geometry[:, [CENTER, CENTER + 1, MAXLENGTH]]
+        self._bounciness[rows] = [i._bounciness for i in rects]
+        for j, i in enumerate(rects, k):
+            i._storeIndex = j
+        self._rects.extend(rects)
+
+    def indices(self, rects):
+        return fromiter((j._storeIndex for j in rects), intp, len(rects))
+
+    def movedSince(self, version):
+        """
+        The rows changed in place (update, translate) after the given version, sorted and
+        each once. None when they are not all known: rows were added or removed since, or
+        more than MOVED_LOG changes were made.
+        """
+        if version == self.version:
+            return arange(0)
+        moved = self._moved
+        if not moved or moved[0][0] > version + 1 or version > self.version:
+            return None
+        return unique(concatenate([rows for v, rows in moved if v > version]))
+
+    def near(self, rows, xB, yB, r):
+        """
+        Bounding-circle test of a ball against the given rows, like detect_collisions does it.
+        """
+        bounds = self._bounds[rows]
+        reach = bounds[:, 2] + r
+        return (bounds[:, 1] - yB)**2 + (bounds[:, 0] - xB)**2 < reach * reach
+
+    def edgeHits(self, rows, xB, yB, r):
+        """
+        Batched version of circleOnLine over all four edges of the given rows.
+
+        Args:
+            rows (numpy.ndarray): Store rows of the candidate rectangles.
+            xB, yB, r: Centre and radius of the ball.
+
+        Returns:
+            numpy.ndarray: Boolean array of shape (len(rows), 4) holding the top, right,
+            bottom and left circleOnLine results of each row.
+        """
+        x1, y1, dx, dy, lengthSq = self._edges[rows].transpose(1, 0, 2)
+        # Same operations as circleOnLine, so the results are bit-for-bit identical
+        t = clip(((xB - x1) * dx + (yB - y1) * dy) / lengthSq, 0, 1)
+        return (x1 + t * dx - xB)**2 + (y1 + t * dy - yB)**2 <= r * r
+
+    def __len__(self):
+        return len(self._rects)
+
+def ball_pairs(x, y, radius, margin=0):
+    """
+    Finds the overlapping pairs among many circles. Like SpatialHash, every circle is
+    entered in each cell of a uniform grid its bounding square overlaps, and only circles
+    sharing a cell are compared, so the cost grows with the number of circles and not with
+    its square. Cells are sized for the median circle; larger circles take more cells.
+
+    Args:
+        x, y, radius (numpy.ndarray): Centres and radii.
+        margin (float): Also finds the pairs less than this far apart.
+
+    Returns:
+        tuple: Index arrays i < j of the pairs, each pair once, sorted by i then j.
+    """
+    n = len(x)
+    size = 2 * median(radius) + margin
+    reach = radius + margin / 2
+    lowX = floor((x - reach) / size).astype(int64)
+    lowY = floor((y - reach) / size).astype(int64)
+    spanX = floor((x + reach) / size).astype(int64) - lowX + 1
+    spanY = floor((y + reach) / size).astype(int64) - lowY + 1
+    counts = spanX * spanY
+    total = int(counts.sum())
+    #One entry per circle and cell it overlaps
+    owners = repeat(arange(n), counts)
+    offset = arange(total) - repeat(cumsum(counts) - counts, counts)
+    rowSpan = repeat(spanY, counts)
+    cellX = repeat(lowX, counts) + offset // rowSpan
+    cellY = repeat(lowY, counts) + offset % rowSpan
+    baseX = cellX.min()
+    baseY = cellY.min()
+    cellX -= baseX
+    cellY -= baseY
+    keys = cellX * (cellY.max() + 1) + cellY
+    order = argsort(keys, kind="stable")
+    keys = keys[order]
+    owners = owners[order]
+    #Every entry is paired with the ones after it in the same cell
+    starts = flatnonzero(diff(keys, prepend=-1))
+    sizes = diff(concatenate((starts, [total])))
+    after = repeat(starts + sizes, sizes) - arange(total) - 1
+    pairCount = int(after.sum())
+    if not pairCount:
+        return arange(0), arange(0)
+    first = repeat(arange(total), after)
+    second = repeat(arange(1, total + 1) - (cumsum(after) - after), after) + arange(pairCount)
+    i = owners[first]
+    j = owners[second]
+    #Circles sharing several cells meet in each of them: keep the meeting in the lowest cell of both
+    home = (cellX[order[first]] == maximum(lowX[i], lowX[j]) - baseX) & (cellY[order[first]] == maximum(lowY[i], lowY[j]) - baseY)
+    i, j = minimum(i[home], j[home]), maximum(i[home], j[home])
+    dx = x[j] - x[i]
+    dy = y[j] - y[i]
+    reach = radius[i] + radius[j] + margin
+    touching = flatnonzero(dx * dx + dy * dy < reach * reach)
+    touching = touching[lexsort((j[touching], i[touching]))]
+    return i[touching], j[touching]
+
+def ball_contact_impulses(x, y, vX, vY, radius, mass, i, j, dt, stiffness=CONTACT_STIFFNESS, bounciness=BALL_BOUNCINESS):
+    """
+    Soft contacts between touching balls, the way discrete element simulations of
+    granular matter do them: every pair pushes apart like a damped spring along the line
+    between the centres. The spring is stiff enough that overlaps stay small, and damped
+    so that a collision keeps the given bounciness of the speed it hit with. Forces of all
+    pairs are summed, so piles hold up however many balls they have.
+
+    Args:
+        x, y, vX, vY, radius, mass (numpy.ndarray): State of every ball.
+        i, j (numpy.ndarray): The pairs, as returned by ball_pairs.
+        dt (float): Length of the step, in frames.
+        stiffness (float): Angular frequency of a contact, in radians per frame.
+        bounciness (float): Coefficient of restitution.
+
+    Returns:
+        tuple: Changes to vX and vY.
+    """
+    n = len(x)
+    dx = x[j] - x[i]
+    dy = y[j] - y[i]
+    distance = sqrt(dx * dx + dy * dy)
+    apart = distance > 0
+    safe = where(apart, distance, 1)
+    normalX = where(apart, dx / safe, 1) #Balls exactly on top of each other are split sideways
+    normalY = where(apart, dy / safe, 0)
+    inverseI = 1 / mass[i]
+    inverseJ = 1 / mass[j]
+    reduced = 1 / (inverseI + inverseJ)
+    damping = -log(bounciness) / sqrt(pi**2 + log(bounciness)**2) #Damping ratio that gives the bounciness
+    approach = (vX[j] - vX[i]) * normalX + (vY[j] - vY[i]) * normalY
+    #Spring plus dashpot, never pulling
+    force = reduced * (stiffness**2 * (radius[i] + radius[j] - distance) - 2 * damping * stiffness * approach)
+    impulse = maximum(force, 0) * dt
+    changeX = bincount(j, impulse * normalX * inverseJ, n) - bincount(i, impulse * normalX * inverseI, n)
+    changeY = bincount(j, impulse * normalY * inverseJ, n) - bincount(i, impulse * normalY * inverseI, n)
+    return changeX, changeY
+
+def push_out_of_walls(x, y, vX, vY, walls, bounceSpeed=GROUND_SPEED, incoming=None):
+    """
+    Keeps balls out of walls that cannot move, such as the edges of rectangles. Each ball
+    is moved along the wall's normal until normal . centre >= plane. A ball touching the
+    wall that moves into it bounces off with the wall's bounciness, or stops when it would
+    bounce back slower than bounceSpeed.
+
+    Args:
+        x, y, vX, vY (numpy.ndarray): Centres and speeds, changed in place.
+        walls (tuple): (k, normalX, normalY, plane, bounciness) arrays, one entry per
+            ball k touching a wall.
+        bounceSpeed (float): Slowest bounce.
+        incoming (tuple): (vX, vY) the bounces are decided on, if not the speeds as they
+            are. Balls at the bottom of a pile are pressed into the ground by the ones
+            above them, which must not make them bounce.
+    """
+    k, normalX, normalY, plane, bounciness = walls
+    depth = plane - (x[k] * normalX + y[k] * normalY)
+    touching = depth >= 0
+    push = where(touching, depth, 0)
+    x[k] += push * normalX
+    y[k] += push * normalY
+    approach = vX[k] * normalX + vY[k] * normalY
+    if incoming is not None:
+        bounce = -(incoming[0][k] * normalX + incoming[1][k] * normalY) * bounciness
+    else:
+        bounce = -approach * bounciness
+    target = where(bounce >= bounceSpeed, bounce, 0)
+    change = where(touching & (approach < 0), target - approach, 0)
+    vX[k] += change * normalX
+    vY[k] += change * normalY
+
+class Particles:
+    """
+    Many balls stored as arrays and simulated together, for granular scenes with thousands
+    of balls. Row k holds one particle:
+    - _pos[k], _vel[k]: centre and speed, in the same units as Ball._x and Ball._vX
+    - _accel[k]: exerted acceleration, applied by the next update like Ball._eaX and _eaY
+    - _radius[k], _mass[k]
+    - _onGround[k]: whether it rested on an upward-facing edge in the last substep
+    and _colors[k] its colour.
+
+    Particles fall, bounce off every rectangle of the world, static or moving, and off
+    each other and the Balls, in a fixed number of NumPy operations per substep: see
+    World.collideBalls. Unlike Balls they do not sleep and have no continuous collision;
+    World picks enough substeps for their speed instead.
+
+    The rectangles near each particle are looked up once per frame, within the distance
+    it can travel in a frame, and only narrowed down every substep.
+    """
+    STATE = ("_pos", "_vel", "_accel", "_radius", "_mass", "_onGround") #Arrays a replay needs, besides the colours
+
+    def __init__(self, capacity=64):
+        self._count = 0
+        self._colors = []
+        self._candidates = None #(key, particles, store rows) of the rectangles near each particle
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        n = self._count
+        arrays = {}
+        for name in self.STATE:
+            shape = (capacity, 2) if name in ("_pos", "_vel", "_accel") else capacity
+            arrays[name] = zeros(shape, dtype=bool if name == "_onGround" else float)
+            if n:
+                arrays[name][:n] = getattr(self, name)[:n]
+        for name, value in arrays.items():
+            setattr(self, name, value)
+
+    def add(self, x, y, radius, mass=1, color="black"):
+        """
+        Adds particles at rest. x and y are numbers or arrays, radius and mass numbers or
+        arrays of the same length.
+
+        Returns:
+            range: Rows of the new particles.
+        """
+        x = asarray(x, dtype=float).reshape(-1)
+        y = asarray(y, dtype=float).reshape(-1)
+        n = len(x)
+        k = self._count
+        if k + n > len(self._radius):
+            self._allocate(max(2 * len(self._radius), k + n))
+        rows = slice(k, k + n)
+        self._pos[rows, 0] = x
+        self._pos[rows, 1] = y
+        self._vel[rows] = 0
+        self._accel[rows] = 0
+        self._radius[rows] = broadcast_to(radius, n)
+        self._mass[rows] = broadcast_to(mass, n)
+        self._onGround[rows] = False
+        self._colors.extend([color] * n)
+        self._count = k + n
+        self._candidates = None
+        return range(k, k + n)
+
+    def clear(self):
+        self._count = 0
+        self._colors = []
+        self._candidates = None
+
+    def exertForce(self, forceX, forceY):
+        # Exerts the same force on every particle, like Ball.exertForce does on one ball
+        n = self._count
+        self._accel[:n, 0] += forceX / self._mass[:n]
+        self._accel[:n, 1] += forceY / self._mass[:n]
+
+    def substepsNeeded(self, gravity):
+        # Substeps a frame needs so that no particle moves more than its radius per substep
+        n = self._count
+        if not n:
+            return 1
+        moves = self._vel[:n] + self._accel[:n]
+        speed = sqrt(moves[:, 0]**2 + moves[:, 1]**2) + gravity
+        return int((speed // self._radius[:n]).max()) + 1
+
+    def _rectanglePairs(self, world):
+        # (particle, store row) pairs of the rectangles within a frame's travel of each particle
+        grid = world.grid
+        store = world.store
+        n = self._count
+        pos = self._pos[:n]
+        moves = self._vel[:n] + self._accel[:n]
+        #Like ChunkStreamer._ballReach: twice the distance it can cover in a frame
+        reach = (self._radius[:n] + 2 * (sqrt(moves[:, 0]**2 + moves[:, 1]**2) + abs(world.gravity) / world.frameRate))[:, None]
+        size = grid._cellSize
+        low = floor((pos - reach) / size).astype(int64)
+        high = floor((pos + reach) / size).astype(int64)
+        span = int((high - low).max())
+        owners = []
+        cells = []
+        for offsetX in range(span + 1):
+            for offsetY in range(span + 1):
+                cell = low + (offsetX, offsetY)
+                covered = flatnonzero((cell <= high).all(axis=1))
+                owners.append(covered)
+                cells.append(cell[covered])
+        owners = concatenate(owners)
+        cells = concatenate(cells)
+        #Look every occupied cell up once, whatever the number of particles in it
+        minX, minY = cells.min(axis=0).tolist()
+        height = int(cells[:, 1].max()) - minY + 1
+        keys = (cells[:, 0] - minX) * height + (cells[:, 1] - minY)
+        order = argsort(keys, kind="stable")
+        keys = keys[order]
+        owners = owners[order]
+        starts = flatnonzero(diff(keys, prepend=-1))
+        ends = concatenate((starts[1:], [len(keys)]))
+        particles = []
+        rows = []
+        gridCells = grid._cells
+        for key, start, end in zip(keys[starts].tolist(), starts.tolist(), ends.tolist()):
+            cell = gridCells.get((key // height + minX, key % height + minY))
+            if cell:
+                members = owners[start:end]
+                particles.append(repeat(members, len(cell)))
+                rows.append(tile(store.indices(cell), len(members)))
+        if grid._large:
+            particles.append(repeat(arange(n), len(grid._large)))
+            rows.append(tile(store.indices(grid._large), n))
+        if not particles:
+            return arange(0), arange(0)
+        #A rectangle in several cells around a particle comes up once per cell
+        pairs = unique(concatenate(particles) * len(store) + concatenate(rows))
+        p, rows = pairs // len(store), pairs % len(store)
+        #Bounding boxes of the rectangles from their corners; long thin walls have far too big bounding circles
+        corners = store._edges[rows, :2]
+        x = pos[p, 0]
+        y = pos[p, 1]
+        reach = reach[p, 0]
+        near = (x + reach >= corners[:, 0].min(axis=1)) & (x - reach <= corners[:, 0].max(axis=1)) & (y + reach >= corners[:, 1].min(axis=1)) & (y - reach <= corners[:, 1].max(axis=1))
+        return p[near], rows[near]
+
+    def rectangleContacts(self, world):
+        """
+        The rectangle each particle overlaps most, as walls for push_out_of_walls. The normal is the true contact normal, from the closest
+        point of the outline to the centre, so corners are round; the plane keeps the
+        particle one radius out. Also updates _onGround.
+
+        Returns:
+            tuple: (particles, normalX, normalY, plane, bounciness) arrays, or None.
+        """
+        n = self._count
+        self._onGround[:n] = False
+        store = world.store
+        if not n or not len(store):
+            return None
+        #The pairs stay valid for the frame, unless rectangles are added, removed or moved
+        key = (world.frame, store.version, n)
+        if self._candidates is None or self._candidates[0] != key:
+            self._candidates = (key,) + self._rectanglePairs(world)
+        _, p, rows = self._candidates
+        if not len(p):
+            return None
+        pos = self._pos[:n]
+        #Closest point on each of the four edges, as in RectangleStore.edgeHits
+        x1, y1, edgeX, edgeY, lengthSq = store._edges[rows].transpose(1, 0, 2)
+        px = pos[p, 0][:, None]
+        py = pos[p, 1][:, None]
+        t = clip(((px - x1) * edgeX + (py - y1) * edgeY) / lengthSq, 0, 1)
+        offsetX = px - (x1 + t * edgeX)
+        offsetY = py - (y1 + t * edgeY)
+        distanceSq = offsetX * offsetX + offsetY * offsetY
+        e = distanceSq.argmin(axis=1)
+        k = arange(len(p))
+        cross = edgeX * (py - y1) - edgeY * (px - x1)
+        inside = (cross <= 0).all(axis=1) | (cross >= 0).all(axis=1)
+        distance = sqrt(distanceSq[k, e])
+        r = self._radius[p]
+        contact = flatnonzero(inside | (distance <= r))
+        if not len(contact):
+            return None
+        #Outward normal of the closest edge, for centres inside the rectangle or right on its outline
+        bounds = store._bounds[rows]
+        length = sqrt(lengthSq[k, e])
+        normalX = edgeY[k, e] / length
+        normalY = -edgeX[k, e] / length
+        outward = where(normalX * (x1[k, e] - bounds[:, 0]) + normalY * (y1[k, e] - bounds[:, 1]) < 0, -1, 1)
+        free = ~inside & (distance > 0)
+        safe = where(free, distance, 1)
+        normalX = where(free, offsetX[k, e] / safe, normalX * outward)[contact]
+        normalY = where(free, offsetY[k, e] / safe, normalY * outward)[contact]
+        depth = where(inside, r + distance, r - distance)[contact]
+        p, rows = p[contact], rows[contact]
+        #Deepest contact of each particle; the next substep handles the others
+        order = lexsort((-depth, p))
+        first = order[flatnonzero(diff(p[order], prepend=-1))]
+        p, normalX, normalY, depth = p[first], normalX[first], normalY[first], depth[first]
+        self._onGround[p[(normalY > GROUND_NORMAL) & (depth >= 0)]] = True
+        plane = pos[p, 0] * normalX + pos[p, 1] * normalY + depth
+        return p, normalX, normalY, plane, store._bounciness[rows[first]]
+
+    def update(self, world):
+        # One substep of movement: exerted acceleration, gravity, then speed
+        n = self._count
+        if not n:
+            return
+        vel = self._vel[:n]
+        vel += self._accel[:n]
+        self._accel[:n] = 0
+        if not world.fly:
+            vel[:, 1] += world.gravity / (world.frameRate * world.substeps)
+        self._pos[:n] += vel / world.substeps
+
+    def __len__(self):
+        return self._count
+
+BATCH_MIN = 24 #Below this many candidates the scalar checks beat the NumPy call overhead
+
+def detect_collisions(world):
+    grid = world.grid
+    store = world.store
+    profiler = world.profiler
+    for i in world.balls:
+        if i._asleep:
+            continue
+        followed = i.followContacts(world) if i._contacts else ()
+        if profiler is not None and followed:
+            profiler.count("cached", len(followed))
+        if profiler is not None:
+            t = perf_counter()
+        candidates = grid.query(i._x, i._y, i._radius)
+        world.collisionChecks += len(candidates)
+        if profiler is not None:
+            profiler.time("broadphase", perf_counter() - t)
+            profiler.count("candidates", len(candidates))
+        if len(candidates) < BATCH_MIN:
+            for j in candidates:
+                g = j._geometry
+                reach = g[MAXLENGTH] + i._radius
+                if (g[CENTER + 1]- i._y)**2 + (g[CENTER] - i._x)**2 < reach * reach and j != i._ground and j not in followed:
+                    kind = i.checkCollision(j, world)
+                    if profiler is not None and kind is not None:
+                        profiler.count("hits")
+                        profiler.count(kind)
+            continue
+        rows = store.indices(candidates)
+        start = 0
+        # Test every remaining candidate at once; after a hit moves the ball, retest the ones after it
+        while start < len(rows):
+            remaining = rows[start:]
+            near = store.near(remaining, i._x, i._y, i._radius)
+            if i._ground is not None and i._ground._storeIndex is not None:
+                near &= remaining != i._ground._storeIndex
+            for j in followed:
+                near &= remaining != j._storeIndex
+            nearIndex = flatnonzero(near)
+            if not len(nearIndex):
+                break
+            hits = store.edgeHits(remaining[nearIndex], i._x, i._y, i._radius)
+            touching = flatnonzero(hits.any(axis=1))
+            if not len(touching):
+                break
+            k = nearIndex[touching[0]]
+            top, right, bottom, left = hits[touching[0]].tolist()
+            kind = i.resolveCollision(candidates[start + k], top, right, bottom, left, world)
+            if profiler is not None:
+                profiler.count("hits")
+                profiler.count(kind)
+            start += k + 1
+    return
+
+DEFAULT_LEVEL = "-99999.0,0.0,199998.0,50.0,0.0,black,0.85:102.50000000000279,-4.155677000013611,197,20,5.883185307179586,black,0.85:280.5000000000028,70.854432299998639,197,20,5.6831853071795875,black,0.85:443.5000000000028,182.8443229999864,197,20,6.0663706143591805,black,0.85:633.9999999999812,224.84432299998457,197,20,5.766370614359181,black,0.85:803.9999999999812,321.84432299998457,197,20,5.9495559215387885,black,0.85:989.5000000000158,386.844322999965,197,20,0.24955592153876438,black,0.85:1176.500000000016,339.844322999965,197,20,1.215926535897772,black,0.85:1244.0000000000823,158.84432299996433,197,20,0.9159265358977677,black,0.85:1314.499999999965,507.84432299999503,197,20,5.8991118430773355,black,0.85:1063.499999999965,741.844322999995,197,20,0.39911184307725733,black,0.85:1340.9803470314178,796.3675158350004,197,20,5.782297150256831,black,0.85:1079.9803470314178,873.3675158350004,197,20,3.5822971502567995,black,0.85:1466.480347031334,1007.8675158349417,197,20,2.982297150256791,black,0.85:1721.480347031334,1130.3675158351402,197,20,2.982297150256791,black,0.85:993.4803470313341,1191.867515835202,197,20,0.48229715025675546,black,0.85:759.4803470313341,1313.3675158352357,197,20,0.48229715025675546,black,0.85:539.9803470312804,1424.3675158352357,197,20,0.48229715025675546,black,0.85:338.98034703127473,1610.3675158354395,455,20,0.48229715025675546,black,0.85:101.5978819145273,1222.8475614197498,455,20,5.26548245743632,black,0.85:180.5978819145273,1197.8475614197498,344,20,5.26548245743632,black,0.85:365.5978819145273,1506.8475614197498,218,20,0.4486677646157489,black,0.85:-174.40211808547065,1314.8475614196707,374,20,0.6318530717952484,black,0.85:-170.40211808547065,1449.8475614196707,374,20,0.6318530717952484,black,0.85:191.59788191452935,1216.8475614196707,374,20,0.615038378975065,black,0.85:-417.40211808547065,1170.85475614196707,374,20,5.398223686154736,black,0.85:-410.40211808547065,1022.8475614196707,374,20,5.398223686154736,black,0.85:-109.90211808546633,803.8475614197871,374,20,5.398223686154736,black,0.85:-382.9021180854663,877.8475614197871,374,20,5.398223686154736,black,0.85:-289.9021180854663,816.8475614197871,374,20,5.398223686154736,black,0.85:-53.90211808546633,1080.8547561419787,128,20,3.881408993334766,black,0.85:230.09788191453367,1025.847561419787,368,20,2.1814089933348626,black,0.85:495.0978819145337,1001.8475614197871,368,20,2.1814089933348626,black,0.85:-393.9021180854663,1167.847561419787,368,20,2.1814089933348626,black,0.85:-611.9021180854663,891.8475614197871,368,20,0.6814089933349479,black,0.85:-387.9021180854663,1027.847561419787,164,20,1.447779607694791,black,0.85:-88.90211808546678,806.8475614197871,164,20,1.447779607694791,black,0.85:-331.9021180854668,663.8475614197871,260,20,0.6477796076948366,black,0.85:156.09788191453322,732.8475614197871,260,20,2.7309649148746615,black,0.85:284.0978819145332,705.8475614197871,260,20,1.930964914874707,black,0.85:-38.90211808546678,600.85475614197871,260,20,0.23096491487480367,black,0.85:-131.90211808546678,509.8475614197871,260,20,0.23096491487480367,black,0.85:200.09788191453322,989.8475614197871,134,20,0.6141502220547252,black,0.85:225.09788191453322,880.85475614197871,134,20,0.6141502220547252,black,0.85:106.09788191453322,864.8475614197871,134,20,0.6141502220547252,black,0.85:106.09788191453322,1043.847561419787,29,20,0.6973355292346639,black,0.85:132.09788191453322,965.8475614197871,29,20,0.6973355292346639,black,0.85:73.09788191453322,951.8475614197871,29,20,0.6973355292346639,black,0.85:4.097881914533218,930.85475614197871,29,20,0.6973355292346639,black,0.85:6.097881914533218,862.8475614197871,29,20,0.6973355292346639,black,0.85:23.097881914533218,806.8475614197871,29,20,0.6973355292346639,black,0.85:54.09788191453322,895.8475614197871,29,20,0.6973355292346639,black,0.85:-68.90211808546678,828.8475614197871,29,20,0.6973355292346639,black,0.85:-42.90211808546678,760.85475614197871,29,20,0.6973355292346639,black,0.85:-37.90211808546678,699.8475614197871,29,20,0.6973355292346639,black,0.85"
+
+def load_level(code):
+    """
+    Builds the Rectangles described by a save code (as printed by the editor).
+
+    Args:
+        code (str): Save code, one "x,y,width,height,angle,color,bounciness" record per
+            rectangle, separated by colons. The angle is in radians.
+
+    Returns:
+        list: The Rectangles of the level, in save code order.
+    """
+    if not code:
+        return []
+    elements = split_string_to_list(code)
+    numbers = array([i[:5] + i[6:7] for i in elements], dtype=float)
+    return build_rectangles(numbers[:, 0], numbers[:, 1], numbers[:, 2], numbers[:, 3], numbers[:, 4], [i[5] for i in elements], numbers[:, 5])
+
+def save_code(rects):
+    """
+    Inverse of load_level: returns the save code of the given Rectangles.
+    """
+    return ":".join(f"{i._x},{i._y},{i._width},{i._height},{i._angle},{i._color},{i._bounciness}" for i in rects)
+
+class World:
+    """
+    A headless simulation: owns the scene, the collision structures and the physics
+    constants. Nothing in here needs pygame or a display, and nothing throttles the
+    simulation, so run() goes as fast as the machine allows.
+
+    Args:
+        loadCode (str): Save code of the level to load, or None for an empty world.
+        frameRate (int): Frames per simulated second; accelerations are scaled by it.
+        substeps (int): Physics steps per frame, or the most per frame when adaptive.
+        gravity (float): Gravitational acceleration.
+        groundSpeed (float): Vertical speed under which a ball lands on a flat ground.
+        adaptive (bool): Pick the number of substeps per frame from ball speed and nearby
+            geometry, and stop fast balls at their swept time of impact so they cannot
+            tunnel through thin rectangles. Off by default: every frame runs all substeps,
+            as it always did, so existing trajectories and save codes play out the same.
+        ballCollisions (bool): Let balls and particles collide with each other.
+    """
+    def __init__(self, loadCode=None, frameRate=FRAME_RATE, substeps=SUBSTEPS, gravity=GRAVITY, groundSpeed=GROUND_SPEED, adaptive=False, ballCollisions=True):
+        self.frameRate = frameRate
+        self.maxSubsteps = substeps
+        self.substeps = substeps
+        self.adaptive = adaptive
+        self.gravity = gravity
+        self.groundSpeed = groundSpeed
+        self.ballCollisions = ballCollisions
+        self._fly = False
+        self.frame = 0
+        self.collisionChecks = 0 #Broadphase candidates tested so far
+        self.profiler = None #Profiler that step() reports its phases to, if any
+        self.scene = []
+        self.balls = []
+        self.bodies = [] #Everything that moves: balls and DynamicRectangles
+        self.particles = Particles() #Balls too many for objects, simulated as arrays
+        self.ballContacts = 0 #Pairs of balls and particles touching in the last substep
+        self._pairCandidates = None #(i, j, x, y, radius) for _ballPairs
+        self.grid = SpatialHash()
+        self.store = RectangleStore()
+        self.loadLevel(loadCode)
+
+    def loadLevel(self, loadCode):
+        self.loadRectangles(load_level(loadCode))
+
+    def loadRectangles(self, rects):
+        # Replaces all rectangles, keeps the balls
+        self.scene = self.balls + list(rects)
+        self.bodies = self.balls + [i for i in rects if isinstance(i,DynamicRectangle)]
+        self.grid.rebuild(self.scene)
+        self.store.rebuild(self.scene)
+        for i in self.balls:
+            i._onGround = False
+            i._ground = None
+            i._contacts = ()
+            i.wake()
+
+    def shareLevel(self, world):
+        """
+        Replaces all rectangles with those of another world, and uses that world's
+        collision structures instead of building its own, so many worlds on the same
+        level cost little more than their balls. Only for levels without
+        DynamicRectangles, and neither world may add or remove rectangles afterwards.
+        """
+        rects = [i for i in world.scene if isinstance(i,Rectangle)]
+        if any(isinstance(i,DynamicRectangle) for i in rects):
+            raise ValueError("only levels without moving rectangles can be shared")
+        self.scene = self.balls + rects
+        self.bodies = list(self.balls)
+        self.grid = world.grid
+        self.store = world.store
+        for i in self.balls:
+            i._onGround = False
+            i._ground = None
+            i._contacts = ()
+            i.wake()
+
+    def addBall(self, ball):
+        self.scene.append(ball)
+        self.balls.append(ball)
+        self.bodies.append(ball)
+        return ball
+
+    def addParticles(self, x, y, radius, mass=1, color="black"):
+        # See Particles.add
+        return self.particles.add(x, y, radius, mass, color)
+
+    def exertForce(self, forceX, forceY):
+        # Exerts a force on every ball and particle
+        for i in self.balls:
+            i.exertForce(forceX, forceY)
+        self.particles.exertForce(forceX, forceY)
+
+    @property
+    def fly(self):
+        return self._fly
+
+    @fly.setter
+    def fly(self, fly):
+        # Toggling gravity changes what every ball rests on
+        self._fly = fly
+        for i in self.balls:
+            i.wake()
+
+    def wakeNear(self, rect):
+        # Wakes the balls that could touch the rectangle
+        for i in self.balls:
+            g = rect._geometry
+            reach = g[MAXLENGTH] + i._radius + SLEEP_SPEED
+            if (g[CENTER] - i._x)**2 + (g[CENTER + 1] - i._y)**2 < reach * reach:
+                i.wake()
+
+    def addRectangle(self, rect):
+        self.scene.append(rect)
+        if isinstance(rect,DynamicRectangle):
+            self.bodies.append(rect)
+        self.grid.insert(rect)
+        self.store.add(rect)
+        self.wakeNear(rect)
+        return rect
+
+    def removeRectangle(self, rect):
+        self.scene.remove(rect)
+        if isinstance(rect,DynamicRectangle):
+            self.bodies.remove(rect)
+        self.grid.remove(rect)
+        self.store.remove(rect)
+        self.wakeNear(rect)
+        for i in self.balls:
+            if i._ground is rect:
+                i._onGround = False
+                i._ground = None
+            i._contacts = tuple(c for c in i._contacts if c[0] is not rect)
+
+    def addRectangles(self, rects):
+        # Bulk addRectangle, for loading parts of a level
+        rects = list(rects)
+        self.scene.extend(rects)
+        self.bodies.extend(i for i in rects if isinstance(i,DynamicRectangle))
+        for i in rects:
+            self.grid.insert(i)
+        self.store.extend(rects)
+        for i in rects:
+            self.wakeNear(i)
+        return rects
+
+    def removeRectangles(self, rects):
+        # Bulk removeRectangle; rectangles that are no longer in the world are skipped
+        rects = [i for i in rects if i._storeIndex is not None]
+        gone = set(rects)
+        self.scene = [i for i in self.scene if i not in gone]
+        self.bodies = [i for i in self.bodies if i not in gone]
+        for i in rects:
+            self.grid.remove(i)
+            self.store.remove(i)
+            self.wakeNear(i)
+        for i in self.balls:
+            if i._ground in gone:
+                i._onGround = False
+                i._ground = None
+            i._contacts = tuple(c for c in i._contacts if c[0] not in gone)
+
+    def moveRectangles(self, rects):
+        # Brings the collision structures up to date with DynamicRectangles that moved by (_moveX, _moveY), and only them
+        grid = self.grid
+        for i in rects:
+            grid.move(i)
+        self.store.translate(rects)
+        if any(i._asleep for i in self.balls):
+            for i in rects:
+                self.wakeNear(i)
+
+    def updateRectangle(self, rect):
+        # Same for a rectangle whose geometry changed some other way, like a rotation followed by _computeGeometry()
+        self.grid.move(rect)
+        self.store.update(rect)
+        self.wakeNear(rect)
+
+    def rectangles(self):
+        return [i for i in self.scene if isinstance(i,Rectangle)]
+
+    def saveCode(self):
+        return save_code(self.rectangles())
+
+    def timeOfImpact(self, ball, dx, dy):
+        """
+        Earliest sweptCircleTOI of the ball against the rectangles around its move, using
+        a radius shrunk by SKIN so the ball ends up overlapping what it hits.
+        """
+        r = ball._radius
+        reach = hypot(dx, dy) / 2 + r
+        first = None
+        for j in self.grid.query(ball._x + dx / 2, ball._y + dy / 2, reach):
+            t = sweptCircleTOI(ball._x, ball._y, dx, dy, (1 - SKIN) * r, j)
+            if t is not None and (first is None or t < first):
+                first = t
+        return first
+
+    def chooseSubsteps(self):
+        """
+        Number of substeps the next frame needs: enough that no ball moves more than its
+        radius per substep while geometry is within reach, and one otherwise.
+        """
+        substeps = 1
+        gravity = abs(self.gravity) / self.frameRate
+        for i in self.balls:
+            if i._asleep:
+                continue
+            speed = hypot(i._vX + i._eaX, i._vY + i._eaY) + gravity
+            reach = speed + i._radius
+            for j in self.grid.query(i._x, i._y, reach):
+                g = j._geometry
+                if g[AABB] <= i._x + reach and g[AABB + 2] >= i._x - reach and g[AABB + 1] <= i._y + reach and g[AABB + 3] >= i._y - reach:
+                    substeps = max(substeps, int(speed // i._radius) + 1)
+                    break
+        if len(self.particles):
+            substeps = max(substeps, self.particles.substepsNeeded(gravity))
+        if self.ballContacts or self.ballCollisions and len(self.particles) > 1:
+            substeps = max(substeps, CONTACT_SUBSTEPS) #Particles come into contact without warning
+        return min(substeps, self.maxSubsteps)
+
+    def _ballPairs(self, x, y, radius):
+        # The touching pairs, from a list of the pairs within PAIR_MARGIN kept until something moves half of it
+        cached = self._pairCandidates
+        if cached is None or len(cached[2]) != len(x) or (cached[4] != radius).any() or ((x - cached[2])**2 + (y - cached[3])**2).max() > (PAIR_MARGIN / 2)**2:
+            cached = self._pairCandidates = ball_pairs(x, y, radius, PAIR_MARGIN) + (x.copy(), y.copy(), radius)
+        i, j = cached[:2]
+        dx = x[j] - x[i]
+        dy = y[j] - y[i]
+        reach = radius[i] + radius[j]
+        touching = dx * dx + dy * dy < reach * reach
+        return i[touching], j[touching]
+
+    def collideBalls(self):
+        """
+        Collisions between balls, between balls and particles (see ball_contact_impulses),
+        and between particles and rectangles (see push_out_of_walls), for all of them at
+        once. A Ball on the ground is not pushed down into it; the rest of its collisions
+        with rectangles are left to detect_collisions. A sleeping Ball that gets hit wakes up.
+        """
+        balls = self.balls
+        particles = self.particles
+        count = len(balls)
+        n = len(particles)
+        self.ballContacts = 0
+        if count + n < 2 or not n and (not self.ballCollisions or all(i._asleep for i in balls)):
+            return
+        objects = array([(i._x, i._y, i._vX, i._vY, i._radius, i._mass) for i in balls], dtype=float).reshape(-1, 6)
+        x = concatenate((objects[:, 0], particles._pos[:n, 0]))
+        y = concatenate((objects[:, 1], particles._pos[:n, 1]))
+        vX = concatenate((objects[:, 2], particles._vel[:n, 0]))
+        vY = concatenate((objects[:, 3], particles._vel[:n, 1]))
+        incoming = (vX.copy(), vY.copy())
+        if self.ballCollisions:
+            radius = concatenate((objects[:, 4], particles._radius[:n]))
+            i, j = self._ballPairs(x, y, radius)
+            if count:
+                #Balls asleep against each other stay as they are
+                asleep = fromiter((k._asleep for k in balls), bool, count)
+                awake = flatnonzero(~((i < count) & (j < count) & asleep[minimum(i, count - 1)] & asleep[minimum(j, count - 1)]))
+                i, j = i[awake], j[awake]
+            self.ballContacts = len(i)
+            if len(i):
+                changeX, changeY = ball_contact_impulses(x, y, vX, vY, radius, concatenate((objects[:, 5], particles._mass[:n])), i, j, 1 / self.substeps)
+                if count:
+                    grounded = fromiter((k._onGround for k in balls), bool, count)
+                    changeY[:count] = where(grounded & (changeY[:count] < 0), 0, changeY[:count])
+                vX += changeX
+                vY += changeY
+        walls = particles.rectangleContacts(self)
+        if walls is not None:
+            push_out_of_walls(x, y, vX, vY, (walls[0] + count,) + walls[1:], self.groundSpeed, incoming)
+        if count:
+            changed = flatnonzero((vX[:count] != objects[:, 2]) | (vY[:count] != objects[:, 3]))
+            for k in changed.tolist():
+                ball = balls[k]
+                if ball._asleep:
+                    #Only a push that would wake it moves a sleeping ball
+                    if (vX[k] - objects[k, 2])**2 + (vY[k] - objects[k, 3])**2 <= SLEEP_SPEED**2:
+                        continue
+                    ball.wake()
+                ball._vX, ball._vY = vX[k].item(), vY[k].item()
+        particles._pos[:n, 0] = x[count:]
+        particles._pos[:n, 1] = y[count:]
+        particles._vel[:n, 0] = vX[count:]
+        particles._vel[:n, 1] = vY[count:]
+
+    def step(self):
+        # One substep: collisions, then movement
+        profiler = self.profiler
+        if profiler is not None:
+            start = perf_counter()
+            broadphase = profiler.times.get("broadphase", 0)
+        detect_collisions(self)
+        self.collideBalls()
+        if profiler is not None:
+            collided = perf_counter()
+            profiler.time("narrowphase", collided - start - (profiler.times.get("broadphase", 0) - broadphase))
+        moved = [i for i in self.bodies if not i._asleep and i.update(self)]
+        if moved:
+            self.moveRectangles(moved)
+        self.particles.update(self)
+        if profiler is not None:
+            profiler.time("update", perf_counter() - collided)
+            profiler.count("substeps")
+
+    def run(self, nFrames=1):
+        for _ in range(nFrames):
+            if self.adaptive:
+                self.substeps = self.chooseSubsteps()
+            for _ in range(self.substeps):
+                self.step()
+            self.frame += 1
@@ -0,0 +1,197 @@
+"""
+Offscreen export of a simulation to image sequences or raw video, without a display.
+
+Frames are drawn with draw_world onto an offscreen Surface, the same drawing as the live
+window, and handed to a FrameExporter as raw RGB bytes. A worker thread (or process)
+takes them from a bounded queue and writes them to disk, so the simulation and the
+drawing never wait on the disk: they only wait when the queue is full, that is when
+the writer cannot keep up at all. Nothing throttles the loop, so export runs as fast as
+the machine simulates and draws.
+
+Formats:
+    raw                  one file of raw RGB24 frames, one after the other
+    png, bmp, tga, jpg   one image per frame, frame_00000.png and so on, in a directory
+
+A raw file becomes a video with, for example:
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s 1280x720 -r 60 -i out.rgb out.mp4
+
+Usage:
+    python export.py frames --format png                      # the default map, 600 frames
+    python export.py out.rgb --format raw --recording recording.npz
+    python export.py thumbs --format jpg --scenario pile --every 60
+"""
+import argparse
+import os
+import queue
+import time
+import multiprocessing
+from threading import Thread
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from engine import World, Ball, DEFAULT_LEVEL
+from render import draw_world, TileCache
+from levels import load_level_file, rectangles_from_records
+
+
+IMAGE_FORMATS = ("png", "bmp", "tga", "jpg")
+
+def _write_frames(frames, path, size, format):
+    # Writer loop, in the worker thread or process: (index, bytes) until None
+    raw = open(path, "wb") if format == "raw" else None
+    try:
+        while True:
+            item = frames.get()
+            if item is None:
+                return
+            index, data = item
+            if raw is not None:
+                raw.write(data)
+            else:
+                pygame.image.save(pygame.image.frombytes(data, size, "RGB"), os.path.join(path, f"frame_{index:05d}.{format}"))
+    finally:
+        if raw is not None:
+            raw.close()
+
+class FrameExporter:
+    """
+    Writes frames to disk in the background.
+
+    put() copies a Surface into raw RGB bytes and queues them. At most queueSize frames
+    wait in the queue; put() only blocks when it is full, and waited adds up the time it
+    spent blocked. close() waits for the writer to finish.
+
+    Args:
+        path (str): The raw file, or the directory of the images (created if missing).
+        size (tuple): (width, height) of the frames in pixels.
+        format (str): "raw" or one of IMAGE_FORMATS.
+        queueSize (int): Frames that can wait to be written.
+        process (bool): Write from a separate process instead of a thread, so encoding
+            images does not compete with the simulation for the interpreter.
+    """
+    def __init__(self, path, size, format="png", queueSize=8, process=False):
+        if format != "raw" and format not in IMAGE_FORMATS:
+            raise ValueError(f"unknown export format {format!r}")
+        if format != "raw":
+            os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.size = tuple(size)
+        self.format = format
+        self.frames = 0
+        self.waited = 0
+        if process:
+            self._queue = multiprocessing.Queue(queueSize)
+            self._worker = multiprocessing.Process(target=_write_frames, args=(self._queue, path, self.size, format), daemon=True)
+        else:
+            self._queue = queue.Queue(queueSize)
+            self._worker = Thread(target=_write_frames, args=(self._queue, path, self.size, format), daemon=True)
+        self._worker.start()
+
+    def put(self, surface):
+        if surface.get_size() != self.size:
+            raise ValueError(f"frame is {surface.get_size()}, the export is {self.size}")
+        data = pygame.image.tobytes(surface, "RGB")
+        start = time.perf_counter()
+        self._queue.put((self.frames, data))
+        self.waited += time.perf_counter() - start
+        self.frames += 1
+
+    def close(self):
+        self._queue.put(None)
+        self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def export_frames(world, exporter, frames, step, every=1, camZoom=1, tiles=True):
+    """
+    Simulates and exports a world headless.
+
+    Args:
+        world (World): The world to run.
+        exporter (FrameExporter): Where the frames go; its size is the size drawn.
+        frames (int): Frames to simulate.
+        step (callable): step(world, frame) advances the world by one frame.
+        every (int): Export every this many frames, for thumbnails or a lower frame rate.
+        camZoom (float): Pixels per world unit. The camera follows the first ball.
+        tiles (bool): Draw the static rectangles from a TileCache.
+
+    Returns:
+        dict: Frames simulated and exported, seconds spent simulating, drawing and in
+        total, and seconds blocked on a full queue.
+    """
+    screen = pygame.Surface(exporter.size)
+    cache = TileCache() if tiles else None
+    simulating = drawing = 0
+    start = time.perf_counter()
+    for frame in range(frames):
+        t = time.perf_counter()
+        step(world, frame)
+        simulating += time.perf_counter() - t
+        if frame % every:
+            continue
+        t = time.perf_counter()
+        camX, camY = (world.balls[0]._x, world.balls[0]._y) if world.balls else (0, 0)
+        draw_world(screen, world, camX, camY, camZoom, cache)
+        drawing += time.perf_counter() - t
+        exporter.put(screen)
+    return {"frames": frames, "exported": exporter.frames, "simulating": simulating, "drawing": drawing,
+            "seconds": time.perf_counter() - start, "waited": exporter.waited}
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a simulation offscreen to images or raw video")
+    parser.add_argument("out", help="raw video file, or directory for the images")
+    parser.add_argument("--format", default="png", choices=("raw",) + IMAGE_FORMATS)
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--recording", help="replay a session saved by physics.py (F6)")
+    source.add_argument("--scenario", help="a bench.py scenario")
+    source.add_argument("--level", help="binary level file, with one ball at (0, 200) (default: the default map)")
+    parser.add_argument("--frames", type=int, help="frames to simulate (default: the whole recording, or 600)")
+    parser.add_argument("--every", type=int, default=1, help="export every this many frames")
+    parser.add_argument("--size", default="1280x720", help="frame size, WIDTHxHEIGHT")
+    parser.add_argument("--zoom", type=float, default=1, help="pixels per world unit")
+    parser.add_argument("--queue", type=int, default=8, help="frames that can wait to be written")
+    parser.add_argument("--process", action="store_true", help="write from a separate process instead of a thread")
+    args = parser.parse_args()
+
+    frames = args.frames
+    if args.recording:
+        from replay import Recording
+        recording = Recording.load(args.recording)
+        world = recording.seek(0)
+        frames = min(frames or recording.frame, recording.frame)
+        step = lambda world, frame: recording.simulate(world, frame, frame + 1)
+    elif args.scenario:
+        from bench import SCENARIOS
+        world, script = SCENARIOS[args.scenario]()
+        def step(world, frame):
+            # Script first, like bench.py, so the frames show the benchmarked run
+            script(world, frame)
+            world.run(1)
+    else:
+        world = World(adaptive=True)
+        world.addBall(Ball(0, 200, 10, 2, "red"))
+        if args.level:
+            world.loadRectangles(rectangles_from_records(*load_level_file(args.level)))
+        else:
+            world.loadLevel(DEFAULT_LEVEL)
+        step = lambda world, frame: world.run(1)
+    frames = frames or 600
+
+    size = tuple(int(i) for i in args.size.lower().split("x"))
+    start = time.perf_counter()
+    with FrameExporter(args.out, size, args.format, args.queue, args.process) as exporter:
+        stats = export_frames(world, exporter, frames, step, args.every, args.zoom)
+    seconds = time.perf_counter() - start #Until the last frame is on disk
+    print(f"{stats['frames']} frames simulated, {stats['exported']} exported to {args.out} in {seconds:.2f} s "
+          f"({stats['frames'] / seconds:.0f} frames/s, {stats['frames'] / seconds / world.frameRate:.1f}x real time)")
+    print(f"simulating {stats['simulating']:.2f} s, drawing {stats['drawing']:.2f} s, waiting for the writer {stats['waited']:.2f} s")
+    if args.format == "raw":
+        print(f"ffmpeg -f rawvideo -pix_fmt rgb24 -s {size[0]}x{size[1]} -r {world.frameRate / args.every:g} -i {args.out} out.mp4")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+Binary level files.
+
+A level file is a small header followed by one fixed-width record per rectangle:
+
+    magic       4 bytes   b"CPLV"
+    version     uint32    LEVEL_VERSION
+    count       uint64    number of records
+    palette     uint32    byte length of the colour palette, then the palette itself:
+                          colour names in UTF-8, separated by newlines
+    padding     zero bytes up to a multiple of 8
+    records     count * LEVEL_DTYPE
+
+All numbers are little-endian. Angles are stored in radians, as in save codes, and
+colours as an index into the palette. Records can be memory-mapped, so opening a huge
+level does not read it all up front.
+
+A chunked level file is laid out the same way, with magic b"CPCK", a chunk count and the
+chunk size after the record count, and the chunk index (one CHUNK_DTYPE row per chunk)
+between the palette and the records. Records are sorted by chunk, so each chunk is one
+contiguous run that can be read on its own. A rectangle belongs to the chunk that contains
+the centre of its bounding box, and each index row stores the bounding box of its whole
+chunk, so chunks can be picked by what they cover.
+
+Levels built click by click are mostly small rectangles side by side. optimize_records
+merges rectangles that line up into bigger ones and drops the ones hidden inside others,
+without changing the shape of the level.
+
+Usage:
+    python levels.py to-binary level.txt level.lvl            # save code file -> binary level
+    python levels.py to-code level.lvl level.txt              # binary level -> save code file
+    python levels.py to-chunks level.txt level.lvc [size]     # save code file or binary level -> chunked level
+    python levels.py optimize level.txt optimized.txt         # merge rectangles, in the same format
+"""
+import sys
+
+from numpy import array, dtype, empty, frombuffer, memmap, fromfile, floor, lexsort, flatnonzero, concatenate, diff, minimum, maximum, sin, cos, pi
+
+from engine import build_rectangles, rectangle_corners
+
+
+LEVEL_MAGIC = b"CPLV"
+LEVEL_VERSION = 1
+LEVEL_DTYPE = dtype([
+    ("x", "<f8"),
+    ("y", "<f8"),
+    ("width", "<f8"),
+    ("height", "<f8"),
+    ("angle", "<f8"),
+    ("bounciness", "<f8"),
+    ("color", "<u4"),
+    ("flags", "<u4"), #Reserved, always 0
+])
+HEADER_DTYPE = dtype([("magic", "S4"), ("version", "<u4"), ("count", "<u8"), ("paletteSize", "<u4")])
+
+CHUNK_MAGIC = b"CPCK"
+CHUNK_SIZE = 2048 #Default chunk width and height in world units
+CHUNK_HEADER_DTYPE = dtype([("magic", "S4"), ("version", "<u4"), ("count", "<u8"), ("chunks", "<u8"), ("chunkSize", "<f8"), ("paletteSize", "<u4")])
+CHUNK_DTYPE = dtype([
+    ("cx", "<i4"), #Chunk coordinates
+    ("cy", "<i4"),
+    ("start", "<u8"), #First record of the chunk
+    ("count", "<u8"),
+    ("minX", "<f8"), #Bounding box of the chunk's rectangles
+    ("minY", "<f8"),
+    ("maxX", "<f8"),
+    ("maxY", "<f8"),
+])
+
+def records_from_code(code):
+    """
+    Converts a save code into level records.
+
+    Returns:
+        tuple: (records, palette) with records a LEVEL_DTYPE array and palette the list of colour names.
+    """
+    if not code:
+        return empty(0, LEVEL_DTYPE), []
+    fields = code.replace(":", ",").split(",")
+    if len(fields) % 7:
+        raise ValueError("save code does not consist of 7-field records")
+    numbers = array(fields[0::7] + fields[1::7] + fields[2::7] + fields[3::7] + fields[4::7] + fields[6::7], dtype=float).reshape(6, -1)
+    palette = []
+    indices = {}
+    colors = []
+    for name in fields[5::7]:
+        if name not in indices:
+            indices[name] = len(palette)
+            palette.append(name)
+        colors.append(indices[name])
+    records = empty(numbers.shape[1], LEVEL_DTYPE)
+    for k, field in enumerate(("x", "y", "width", "height", "angle", "bounciness")):
+        records[field] = numbers[k]
+    records["color"] = colors
+    records["flags"] = 0
+    return records, palette
+
+def code_from_records(records, palette):
+    """
+    Converts level records back into a save code.
+    """
+    columns = [records[field].tolist() for field in ("x", "y", "width", "height", "angle")]
+    colors = [palette[i] for i in records["color"].tolist()]
+    bounciness = records["bounciness"].tolist()
+    return ":".join(f"{x},{y},{w},{h},{a},{c},{b}" for x, y, w, h, a, c, b in zip(*columns, colors, bounciness))
+
+def _headerSize(paletteBytes, headerDtype=HEADER_DTYPE):
+    size = headerDtype.itemsize + len(paletteBytes)
+    return size + (-size) % 8
+
+def _writeHeader(f, header, paletteBytes):
+    f.write(header.tobytes())
+    f.write(paletteBytes)
+    f.write(b"\0" * (_headerSize(paletteBytes, header.dtype) - header.dtype.itemsize - len(paletteBytes)))
+
+def save_level_file(path, records, palette):
+    paletteBytes = "\n".join(palette).encode("utf-8")
+    header = array([(LEVEL_MAGIC, LEVEL_VERSION, len(records), len(paletteBytes))], HEADER_DTYPE)
+    with open(path, "wb") as f:
+        _writeHeader(f, header, paletteBytes)
+        f.write(array(records, LEVEL_DTYPE).tobytes())
+
+def load_level_file(path, mmap=True):
+    """
+    Opens a binary level file.
+
+    Args:
+        path (str): The file.
+        mmap (bool): Memory-map the records instead of reading them into memory.
+
+    Returns:
+        tuple: (records, palette) as returned by records_from_code.
+    """
+    with open(path, "rb") as f:
+        header = frombuffer(f.read(HEADER_DTYPE.itemsize), HEADER_DTYPE)[0]
+        if header["magic"] != LEVEL_MAGIC:
+            raise ValueError(f"{path} is not a level file")
+        if header["version"] != LEVEL_VERSION:
+            raise ValueError(f"{path} has level format version {header['version']}, expected {LEVEL_VERSION}")
+        paletteBytes = f.read(int(header["paletteSize"]))
+        palette = paletteBytes.decode("utf-8").split("\n") if paletteBytes else []
+        offset = _headerSize(paletteBytes)
+        count = int(header["count"])
+        if not mmap:
+            f.seek(offset)
+            return fromfile(f, LEVEL_DTYPE, count), palette
+    if not count:
+        return empty(0, LEVEL_DTYPE), palette
+    return memmap(path, LEVEL_DTYPE, "r", offset, (count,)), palette
+
+def rectangles_from_records(records, palette):
+    """
+    Builds the Rectangles of a level in bulk, ready for World.loadRectangles.
+    """
+    return build_rectangles(records["x"], records["y"], records["width"], records["height"], records["angle"], [palette[i] for i in records["color"].tolist()], records["bounciness"])
+
+def record_aabbs(records):
+    """
+    Axis-aligned bounding boxes of level records, as (minX, minY, maxX, maxY) arrays.
+    """
+    (x1, y1), (x2, y2), (x3, y3), (x4, y4) = rectangle_corners(records["x"], records["y"], records["width"], records["height"], records["angle"])
+    return (minimum(minimum(x1, x2), minimum(x3, x4)), minimum(minimum(y1, y2), minimum(y3, y4)),
+            maximum(maximum(x1, x2), maximum(x3, x4)), maximum(maximum(y1, y2), maximum(y3, y4)))
+
+MERGE_TOLERANCE = 1e-6 #Edges closer than this, in world units, count as lined up
+
+def _mergeRuns(boxes, low, high, keyLow, keyHigh):
+    # Boxes with the same [keyLow, keyHigh] extent that touch or overlap along [low, high] become one
+    def q(value):
+        return round(value / MERGE_TOLERANCE)
+    boxes.sort(key=lambda b: (q(b[keyLow]), q(b[keyHigh]), b[low]))
+    merged = []
+    for box in boxes:
+        last = merged[-1] if merged else None
+        if last is not None and q(last[keyLow]) == q(box[keyLow]) and q(last[keyHigh]) == q(box[keyHigh]) and box[low] <= last[high] + MERGE_TOLERANCE:
+            last[high] = max(last[high], box[high])
+            last[4] = min(last[4], box[4])
+            last[5] = True
+        else:
+            merged.append(box)
+    return merged
+
+def _dropCovered(boxes):
+    # Boxes inside another box; of identical boxes the first is kept
+    size = sorted(max(b[1] - b[0], b[3] - b[2]) for b in boxes)[len(boxes) // 2] or 1
+    cells = {}
+    large = [] #Boxes over too many cells, checked against every box like SpatialHash._large
+    for k, b in enumerate(boxes):
+        lowX, highX = int(b[0] // size), int(b[1] // size)
+        lowY, highY = int(b[2] // size), int(b[3] // size)
+        if (highX - lowX + 1) * (highY - lowY + 1) > 64:
+            large.append(k)
+            continue
+        for cx in range(lowX, highX + 1):
+            for cy in range(lowY, highY + 1):
+                cells.setdefault((cx, cy), []).append(k)
+    kept = []
+    tolerance = MERGE_TOLERANCE
+    for k, b in enumerate(boxes):
+        area = (b[1] - b[0]) * (b[3] - b[2])
+        centre = (int((b[0] + b[1]) / 2 // size), int((b[2] + b[3]) / 2 // size))
+        for j in cells.get(centre, []) + large:
+            c = boxes[j]
+            if j != k and c[0] <= b[0] + tolerance and c[1] >= b[1] - tolerance and c[2] <= b[2] + tolerance and c[3] >= b[3] - tolerance:
+                if (c[1] - c[0]) * (c[3] - c[2]) > area or j < k:
+                    break
+        else:
+            kept.append(b)
+    return kept
+
+def optimize_records(records, palette):
+    """
+    Merges the rectangles of a level that share an angle (up to a quarter turn), a colour
+    and a bounciness, wherever two of them line up side by side or overlap into one
+    rectangle, and drops those lying entirely inside another. The union of the rectangles
+    stays the same, so balls meet the same outline, without the seams between pieces.
+
+    Rectangles left as they were keep their records unchanged. A merged rectangle takes
+    the place, in drawing order, of the first rectangle it replaces.
+
+    Returns:
+        numpy.ndarray: The new LEVEL_DTYPE records, for the same palette.
+    """
+    records = array(records, LEVEL_DTYPE)
+    if not len(records):
+        return records
+    #Angle of the frame in which each rectangle is axis-aligned
+    frame = records["angle"] % (pi / 2)
+    frame[pi / 2 - frame < 1e-9] = 0
+    corners = rectangle_corners(records["x"], records["y"], records["width"], records["height"], records["angle"])
+    groups = {}
+    for k, key in enumerate(zip((frame * 1e9).round().tolist(), records["color"].tolist(), records["bounciness"].tolist())):
+        groups.setdefault(key, []).append(k)
+    output = []
+    for members in groups.values():
+        angle = float(frame[members[0]])
+        c, s = cos(angle), sin(angle)
+        #Box [u0, u1, v0, v1, first record, merged] along the width (c, -s) and height (-s, -c) directions
+        boxes = []
+        for k in members:
+            u = [float(x * c - y * s) for x, y in ((corners[i][0][k], corners[i][1][k]) for i in range(4))]
+            v = [float(-x * s - y * c) for x, y in ((corners[i][0][k], corners[i][1][k]) for i in range(4))]
+            boxes.append([min(u), max(u), min(v), max(v), k, False])
+        count = None
+        while count != len(boxes):
+            count = len(boxes)
+            boxes = _dropCovered(_mergeRuns(_mergeRuns(boxes, 0, 1, 2, 3), 2, 3, 0, 1))
+        for u0, u1, v0, v1, first, merged in boxes:
+            if merged:
+                record = records[first].copy()
+                record["x"] = u0 * c - v0 * s + 0.0
+                record["y"] = -u0 * s - v0 * c + 0.0
+                record["width"] = u1 - u0
+                record["height"] = v1 - v0
+                record["angle"] = angle
+                output.append((first, record))
+            else:
+                output.append((first, records[first]))
+    output.sort(key=lambda i: i[0])
+    return array([i[1] for i in output], LEVEL_DTYPE)
+
+def save_chunked_level_file(path, records, palette, chunkSize=CHUNK_SIZE):
+    """
+    Writes level records as a chunked level file, for streaming with ChunkedLevel.
+
+    Args:
+        path (str): The file.
+        records (numpy.ndarray): LEVEL_DTYPE records.
+        palette (list): Colour names the records' color fields index.
+        chunkSize (float): Width and height of a chunk in world units.
+    """
+    records = array(records, LEVEL_DTYPE)
+    minX, minY, maxX, maxY = record_aabbs(records)
+    cx = floor((minX + maxX) / 2 / chunkSize).astype("i4")
+    cy = floor((minY + maxY) / 2 / chunkSize).astype("i4")
+    order = lexsort((cy, cx))
+    records, cx, cy = records[order], cx[order], cy[order]
+    minX, minY, maxX, maxY = minX[order], minY[order], maxX[order], maxY[order]
+    starts = concatenate(([0], flatnonzero((diff(cx) != 0) | (diff(cy) != 0)) + 1)) if len(records) else empty(0, int)
+    index = empty(len(starts), CHUNK_DTYPE)
+    if len(starts):
+        index["cx"], index["cy"] = cx[starts], cy[starts]
+        index["start"] = starts
+        index["count"] = diff(concatenate((starts, [len(records)])))
+        index["minX"], index["minY"] = minimum.reduceat(minX, starts), minimum.reduceat(minY, starts)
+        index["maxX"], index["maxY"] = maximum.reduceat(maxX, starts), maximum.reduceat(maxY, starts)
+    paletteBytes = "\n".join(palette).encode("utf-8")
+    header = array([(CHUNK_MAGIC, LEVEL_VERSION, len(records), len(index), chunkSize, len(paletteBytes))], CHUNK_HEADER_DTYPE)
+    with open(path, "wb") as f:
+        _writeHeader(f, header, paletteBytes)
+        f.write(index.tobytes())
+        f.write(records.tobytes())
+
+def is_chunked_level_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(CHUNK_MAGIC)) == CHUNK_MAGIC
+
+class ChunkedLevel:
+    """
+    A chunked level file opened for streaming. Only the header, the palette and the chunk
+    index are read up front; the records stay on disk (memory-mapped) until their chunk
+    is loaded. Chunks are identified by their row in the index.
+
+    Args:
+        path (str): The file, as written by save_chunked_level_file.
+    """
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            header = frombuffer(f.read(CHUNK_HEADER_DTYPE.itemsize), CHUNK_HEADER_DTYPE)[0]
+            if header["magic"] != CHUNK_MAGIC:
+                raise ValueError(f"{path} is not a chunked level file")
+            if header["version"] != LEVEL_VERSION:
+                raise ValueError(f"{path} has level format version {header['version']}, expected {LEVEL_VERSION}")
+            paletteBytes = f.read(int(header["paletteSize"]))
+            offset = _headerSize(paletteBytes, CHUNK_HEADER_DTYPE)
+            f.seek(offset)
+            self.index = fromfile(f, CHUNK_DTYPE, int(header["chunks"]))
+        self.path = path
+        self.chunkSize = float(header["chunkSize"])
+        self.palette = paletteBytes.decode("utf-8").split("\n") if paletteBytes else []
+        count = int(header["count"])
+        offset += self.index.nbytes
+        self.records = memmap(path, LEVEL_DTYPE, "r", offset, (count,)) if count else empty(0, LEVEL_DTYPE)
+        self._minX, self._minY = self.index["minX"].copy(), self.index["minY"].copy()
+        self._maxX, self._maxY = self.index["maxX"].copy(), self.index["maxY"].copy()
+
+    def chunksIn(self, minX, minY, maxX, maxY):
+        """
+        Returns the chunks whose rectangles may overlap the box from (minX, minY) to (maxX, maxY).
+        """
+        return flatnonzero((self._minX <= maxX) & (self._maxX >= minX) & (self._minY <= maxY) & (self._maxY >= minY)).tolist()
+
+    def bounds(self, chunk):
+        return (float(self._minX[chunk]), float(self._minY[chunk]), float(self._maxX[chunk]), float(self._maxY[chunk]))
+
+    def load(self, chunk):
+        """
+        Reads the records of a chunk and builds its Rectangles.
+        """
+        row = self.index[chunk]
+        start = int(row["start"])
+        return rectangles_from_records(self.records[start:start + int(row["count"])], self.palette)
+
+    def __len__(self):
+        return len(self.index)
+
+def is_level_file(path):
+    with open(path, "rb") as f:
+        return f.read(len(LEVEL_MAGIC)) == LEVEL_MAGIC
+
+def read_level_records(path, mmap=False):
+    """
+    Reads a save code file or a binary level file, whichever path is.
+
+    Args:
+        path (str): The file.
+        mmap (bool): Memory-map the records of a binary level file.
+
+    Returns:
+        tuple: (records, palette) as returned by records_from_code.
+    """
+    if is_level_file(path):
+        return load_level_file(path, mmap)
+    with open(path) as f:
+        return records_from_code(f.read().strip())
+
+def main(argv):
+    if not (len(argv) == 4 or (len(argv) == 5 and argv[1] == "to-chunks")) or argv[1] not in ("to-binary", "to-code", "to-chunks", "optimize"):
+        print(__doc__)
+        return 1
+    if argv[1] == "optimize":
+        records, palette = read_level_records(argv[2])
+        optimized = optimize_records(records, palette)
+        if is_level_file(argv[2]):
+            save_level_file(argv[3], optimized, palette)
+        else:
+            with open(argv[3], "w") as f:
+                f.write(code_from_records(optimized, palette))
+        print(f"{len(records)} rectangles -> {len(optimized)} ({100 - 100 * len(optimized) / max(len(records), 1):.0f}% fewer)")
+    elif argv[1] == "to-chunks":
+        save_chunked_level_file(argv[3], *read_level_records(argv[2]), float(argv[4]) if len(argv) == 5 else CHUNK_SIZE)
+    elif argv[1] == "to-binary":
+        with open(argv[2]) as f:
+            save_level_file(argv[3], *records_from_code(f.read().strip()))
+    else:
+        with open(argv[3], "w") as f:
+            f.write(code_from_records(*load_level_file(argv[2])))
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
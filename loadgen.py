@@ -0,0 +1,167 @@
+"""
+Load generator for server.py: many simulated clients in one process.
+
+Every client joins a map, changes its held keys at random every so often (seeded, so runs
+are repeatable) and decodes every STATE it gets into its own copy of the balls. The
+input latency of a client is the time from sending an INPUT to receiving the first STATE
+that has applied it. Slow clients read with a small receive buffer and a pause before
+every read, to exercise the server's backpressure.
+
+Usage:
+    python loadgen.py --clients 200 --seconds 10
+    python loadgen.py --clients 50 --slow 10 --unix /tmp/physics.sock
+"""
+import argparse
+import asyncio
+import random
+import socket
+import time
+
+from server import (read_message, message, percentile, PORT, JOIN, INPUT, WELCOME, STATE, BALL, ERROR,
+                    JOIN_TYPE, INPUT_TYPE, WELCOME_TYPE, STATE_TYPE, ERROR_TYPE)
+
+
+class Client:
+    """
+    A client of server.py, decoding the state deltas it receives.
+
+    Attributes:
+        balls (dict): Ball index -> (x, y, vX, vY) as last received.
+        camera (tuple): Camera position as last received.
+        frame (int): World frame of the last STATE.
+        latencies (list): Input latency of every acknowledged INPUT, in seconds.
+    """
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.balls = {}
+        self.camera = (0, 0)
+        self.frame = 0
+        self.tickRate = None
+        self.id = None
+        self.messages = 0
+        self.bytes = 0
+        self.latencies = []
+        self.dropped = False #Closed by the server
+        self._sequence = 0
+        self._sent = {} #Sequence number -> when the INPUT was sent
+
+    @classmethod
+    async def connect(cls, mapName="default", host="127.0.0.1", port=PORT, unix=None, receiveBuffer=None):
+        # receiveBuffer limits the bytes buffered on this side, kernel and reader, to about three times it
+        limit = receiveBuffer or 2**16
+        if unix is not None:
+            reader, writer = await asyncio.open_unix_connection(unix, limit=limit)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, limit=limit)
+        if receiveBuffer is not None:
+            writer.get_extra_info("socket").setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receiveBuffer)
+        client = cls(reader, writer)
+        writer.write(message(JOIN.pack(JOIN_TYPE), mapName.encode()))
+        await client.receive()
+        return client
+
+    def send(self, keys):
+        self._sequence = (self._sequence + 1) % 65536
+        self._sent[self._sequence] = time.perf_counter()
+        self.writer.write(message(INPUT.pack(INPUT_TYPE, keys, self._sequence)))
+
+    async def receive(self):
+        """
+        Reads and applies one message from the server.
+        """
+        data = await read_message(self.reader)
+        self.messages += 1
+        self.bytes += len(data) + 2
+        kind = data[0]
+        if kind == STATE_TYPE:
+            _, self.frame, ack, cameraX, cameraY, count = STATE.unpack_from(data)
+            self.camera = (cameraX, cameraY)
+            for k in range(count):
+                index, *state = BALL.unpack_from(data, STATE.size + k * BALL.size)
+                self.balls[index] = tuple(state)
+            sent = self._sent.pop(ack, None)
+            if sent is not None:
+                now = time.perf_counter()
+                self.latencies.append(now - sent)
+                #Inputs before the acknowledged one were overtaken by it
+                for i in [i for i in self._sent if self._sent[i] <= sent]:
+                    del self._sent[i]
+        elif kind == WELCOME_TYPE:
+            _, self.tickRate, balls, self.id = WELCOME.unpack(data)
+        elif kind == ERROR_TYPE:
+            raise ConnectionError(data[ERROR.size:].decode())
+
+    def close(self):
+        self.writer.close()
+
+async def simulate_client(seed, seconds, mapName, address, slow, inputInterval=0.25, readDelay=0.5):
+    # One client for the given seconds; returns it with its counters
+    rng = random.Random(seed)
+    client = await Client.connect(mapName, *address, receiveBuffer=1024 if slow else None)
+    stop = time.perf_counter() + seconds
+
+    async def inputs():
+        while time.perf_counter() < stop:
+            client.send(rng.randrange(16))
+            await asyncio.sleep(inputInterval * rng.uniform(0.5, 1.5))
+
+    sending = asyncio.ensure_future(inputs())
+    try:
+        while time.perf_counter() < stop:
+            if slow:
+                await asyncio.sleep(readDelay)
+            try:
+                await asyncio.wait_for(client.receive(), max(stop - time.perf_counter(), 0.001))
+            except asyncio.TimeoutError:
+                break
+    except (asyncio.IncompleteReadError, ConnectionError):
+        client.dropped = True
+    finally:
+        sending.cancel()
+        client.close()
+    return client
+
+async def run_load(clients, seconds, mapName="default", host="127.0.0.1", port=PORT, unix=None, slow=0, seed=0):
+    """
+    Runs clients simulated clients for seconds against a running server, the first slow
+    of them slow readers.
+
+    Returns:
+        dict: Clients, messages and bytes received, received messages per second per
+        fast client, and input latency percentiles in milliseconds.
+    """
+    address = (host, port, unix)
+    results = await asyncio.gather(*(simulate_client(seed + k, seconds, mapName, address, k < slow) for k in range(clients)))
+    fast = results[slow:]
+    latencies = [i for c in fast for i in c.latencies]
+    return {
+        "clients": clients,
+        "dropped": sum(c.dropped for c in results),
+        "messages": sum(c.messages for c in results),
+        "bytes": sum(c.bytes for c in results),
+        "messages_per_second": sum(c.messages for c in fast) / max(len(fast), 1) / seconds,
+        "slow_messages_per_second": sum(c.messages for c in results[:slow]) / max(slow, 1) / seconds,
+        "latency_ms_p50": percentile(latencies, 50) * 1000,
+        "latency_ms_p99": percentile(latencies, 99) * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running server.py")
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--slow", type=int, default=0, help="how many of the clients read slowly")
+    parser.add_argument("--map", default="default")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", help="connect to this Unix socket instead of TCP")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    r = asyncio.run(run_load(args.clients, args.seconds, args.map, args.host, args.port, args.unix, args.slow, args.seed))
+    print(f"{r['clients']} clients ({r['dropped']} dropped): {r['messages']} messages, {r['bytes'] / 1024:.0f} KB"
+          f"  {r['messages_per_second']:.1f} messages/s per client ({r['slow_messages_per_second']:.1f} for slow ones)"
+          f"  input latency p50 {r['latency_ms_p50']:.1f} ms p99 {r['latency_ms_p99']:.1f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+from collections import deque
+
+
+class Profiler:
+    """
+    Per-frame timers and counters for the phases of the main loop and of World.step().
+
+    Code being profiled adds durations with time(phase, seconds) and events with
+    count(name, n). endFrame() closes the frame: its totals go into a timeline of the
+    last maxFrames frames, which export() writes as CSV, one row per frame.
+
+    When enabled is False, time, count and endFrame do nothing. A World only calls into
+    its profiler when it has one, so a World without a profiler pays nothing.
+
+    Args:
+        enabled (bool): Start recording straight away.
+        maxFrames (int): Number of frames kept in the timeline.
+    """
+    def __init__(self, enabled=True, maxFrames=36000):
+        self.enabled = enabled
+        self.frame = 0
+        self.times = {}
+        self.counts = {}
+        self.timeline = deque(maxlen=maxFrames)
+
+    def time(self, phase, seconds):
+        if self.enabled:
+            self.times[phase] = self.times.get(phase, 0) + seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counts[name] = self.counts.get(name, 0) + n
+
+    def endFrame(self):
+        if self.enabled:
+            self.timeline.append((self.frame, self.times, self.counts))
+            self.times = {}
+            self.counts = {}
+        self.frame += 1
+
+    def average(self, frames=30):
+        """
+        Average times (in seconds) and counts per frame over the last frames frames.
+        """
+        recent = list(self.timeline)[-frames:]
+        times = {}
+        counts = {}
+        for _, t, c in recent:
+            for k, v in t.items():
+                times[k] = times.get(k, 0) + v / len(recent)
+            for k, v in c.items():
+                counts[k] = counts.get(k, 0) + v / len(recent)
+        return times, counts
+
+    def export(self, path):
+        """
+        Writes the timeline as CSV: a frame column, one column per phase (in
+        milliseconds) and one per counter. Missing values are 0.
+        """
+        phases = sorted({k for _, t, _ in self.timeline for k in t})
+        counters = sorted({k for _, _, c in self.timeline for k in c})
+        with open(path, "w") as f:
+            f.write(",".join(["frame"] + [p + "_ms" for p in phases] + counters) + "\n")
+            for frame, t, c in self.timeline:
+                row = [str(frame)] + [f"{t.get(p, 0) * 1000:.4f}" for p in phases] + [str(c.get(k, 0)) for k in counters]
+                f.write(",".join(row) + "\n")
+
+    def clear(self):
+        self.times = {}
+        self.counts = {}
+        self.timeline.clear()
@@ -0,0 +1,280 @@
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import pygame
+
+from numpy import flatnonzero
+
+from engine import DynamicRectangle
+
+
+# Drawing of engine objects. The camera (camX, camY) is the world point shown at the centre of the screen,
+# camZoom the number of screen pixels per world unit.
+def view_box(screen, camX, camY, camZoom=1):
+    """
+    Returns the part of the world that is visible on screen, as (minX, minY, maxX, maxY).
+    """
+    halfWidth = screen.get_width() / 2 / camZoom
+    halfHeight = screen.get_height() / 2 / camZoom
+    return (camX - halfWidth, camY - halfHeight, camX + halfWidth, camY + halfHeight)
+
+def draw_rectangle(screen, rect, camX, camY, camZoom=1, box=None):
+    if box is None:
+        box = view_box(screen, camX, camY, camZoom)
+    aabb = rect._aabb
+    if aabb[2] < box[0] or aabb[0] > box[2] or aabb[3] < box[1] or aabb[1] > box[3]:
+        return False
+
+    screenPolygon1 = (screen.get_width() / 2 - (camX - rect._polygon1[0]) * camZoom , screen.get_height() / 2 - (rect._polygon1[1] - camY) * camZoom)
+    screenPolygon2 = (screen.get_width() / 2 - (camX - rect._polygon2[0]) * camZoom , screen.get_height() / 2 - (rect._polygon2[1] - camY) * camZoom)
+    screenPolygon3 = (screen.get_width() / 2 - (camX - rect._polygon3[0]) * camZoom , screen.get_height() / 2 - (rect._polygon3[1] - camY) * camZoom)
+    screenPolygon4 = (screen.get_width() / 2 - (camX - rect._polygon4[0]) * camZoom , screen.get_height() / 2 - (rect._polygon4[1] - camY) * camZoom)
+    pygame.draw.polygon(screen,rect._color,[screenPolygon1,screenPolygon2,screenPolygon3,screenPolygon4])
+    return True
+
+def draw_outline(screen, rect, camX, camY, camZoom=1, color="red"):
+    # Outline of a rectangle, to highlight it
+    corners = [(screen.get_width() / 2 - (camX - x) * camZoom, screen.get_height() / 2 - (y - camY) * camZoom) for x, y in (rect._polygon1, rect._polygon2, rect._polygon3, rect._polygon4)]
+    pygame.draw.polygon(screen, color, corners, 2)
+
+def draw_ball(screen, ball, camX, camY, camZoom=1):
+    if ((camX - ball._x - ball._radius) * camZoom > screen.get_width() / 2) or ((ball._x - ball._radius - camX) * camZoom > screen.get_width() / 2) or ((ball._y - ball._radius - camY) * camZoom > screen.get_height() / 2) or ((camY - ball._y - ball._radius) * camZoom > screen.get_height() / 2):
+        return
+    pygame.draw.circle(screen,ball._color,((screen.get_width() / 2) - (camX - ball._x) * camZoom, (screen.get_height() / 2) - (ball._y - camY) * camZoom),ball._radius * camZoom)
+
+def draw_particles(screen, particles, camX, camY, camZoom=1, box=None):
+    """
+    Draws the particles in view. The ones off screen are culled with array operations, so
+    a large pile that is mostly out of view costs little.
+
+    Returns:
+        int: The number of particles drawn.
+    """
+    n = len(particles)
+    if not n:
+        return 0
+    if box is None:
+        box = view_box(screen, camX, camY, camZoom)
+    x = particles._pos[:n, 0]
+    y = particles._pos[:n, 1]
+    radius = particles._radius[:n]
+    visible = flatnonzero((x + radius >= box[0]) & (x - radius <= box[2]) & (y + radius >= box[1]) & (y - radius <= box[3]))
+    screenX = (screen.get_width() / 2 - (camX - x[visible]) * camZoom).tolist()
+    screenY = (screen.get_height() / 2 - (y[visible] - camY) * camZoom).tolist()
+    colors = particles._colors
+    for k, sx, sy, r in zip(visible.tolist(), screenX, screenY, (radius[visible] * camZoom).tolist()):
+        pygame.draw.circle(screen, colors[k], (sx, sy), r)
+    return len(visible)
+
+class TileCache:
+    """
+    Pre-rendered static geometry (DynamicRectangles are left out). The world is cut into square tiles of tileSize screen
+    pixels at the current zoom; each tile is rasterized once into its own Surface and then
+    only blitted, until an edit inside it invalidates it.
+
+    Tiles are kept in least-recently-used order. When more than maxTiles are cached, the
+    oldest tiles that are not on screen are dropped, so memory stays around
+    maxTiles * tileSize**2 * 4 bytes. maxTiles=None never evicts.
+
+    Args:
+        tileSize (int): Width and height of a tile in pixels.
+        maxTiles (int): Number of tiles to keep before evicting.
+    """
+    def __init__(self, tileSize=256, maxTiles=256):
+        self._tileSize = tileSize
+        self._maxTiles = maxTiles
+        self._tiles = OrderedDict()
+        self.rasterized = 0
+
+    def _render(self, world, camZoom, tx, ty, lock=None):
+        size = self._tileSize
+        tile = pygame.Surface((size, size))
+        if pygame.display.get_surface() is not None:
+            tile = tile.convert()
+        tile.fill("white")
+        worldSize = size / camZoom
+        # Camera that puts this tile's top-left corner at the surface origin
+        camX = (tx * size + size / 2) / camZoom
+        camY = ((ty + 1) * size - size / 2) / camZoom
+        box = (tx * worldSize, ty * worldSize, (tx + 1) * worldSize, (ty + 1) * worldSize)
+        with lock or nullcontext():
+            rects = world.grid.queryBox(*box)
+        for i in rects:
+            if not isinstance(i,DynamicRectangle) and draw_rectangle(tile, i, camX, camY, camZoom, box):
+                self.rasterized += 1
+        return tile
+
+    def draw(self, screen, world, camX, camY, camZoom=1, lock=None):
+        """
+        Blits the tiles covering the screen, rasterizing the ones that are missing. lock,
+        if given, is held only while the rectangles of a missing tile are looked up.
+        """
+        size = self._tileSize
+        # Pixel position of the world origin, rounded so tiles line up without seams
+        offsetX = round(screen.get_width() / 2 - camX * camZoom)
+        offsetY = round(screen.get_height() / 2 + camY * camZoom)
+        firstX = (-offsetX) // size
+        lastX = (screen.get_width() - offsetX) // size
+        firstY = (offsetY - screen.get_height()) // size
+        lastY = offsetY // size
+        tiles = self._tiles
+        onScreen = set()
+        for tx in range(firstX, lastX + 1):
+            for ty in range(firstY, lastY + 1):
+                key = (camZoom, tx, ty)
+                tile = tiles.get(key)
+                if tile is None:
+                    tile = self._render(world, camZoom, tx, ty, lock)
+                    tiles[key] = tile
+                else:
+                    tiles.move_to_end(key)
+                onScreen.add(key)
+                screen.blit(tile, (offsetX + tx * size, offsetY - (ty + 1) * size))
+        if self._maxTiles is not None:
+            while len(tiles) > self._maxTiles:
+                oldest = next(iter(tiles))
+                if oldest in onScreen:
+                    break
+                del tiles[oldest]
+
+    def invalidate(self, rect):
+        """
+        Drops every cached tile the rectangle touches, at any zoom.
+        """
+        self.invalidateBox(*rect._aabb)
+
+    def invalidateBox(self, minX, minY, maxX, maxY):
+        """
+        Drops every cached tile that overlaps the world box, at any zoom.
+        """
+        size = self._tileSize
+        for key in [k for k in self._tiles if int(minX * k[0] // size) <= k[1] <= int(maxX * k[0] // size) and int(minY * k[0] // size) <= k[2] <= int(maxY * k[0] // size)]:
+            del self._tiles[key]
+
+    def clear(self):
+        self._tiles.clear()
+
+    def __len__(self):
+        return len(self._tiles)
+
+def draw_world(screen, world, camX, camY, camZoom=1, tiles=None, balls=None):
+    """
+    Draws the balls, particles and rectangles in view. Rectangles are looked up in the world's
+    spatial hash, so the cost depends on what is on screen and not on the level size.
+    With a TileCache, the static rectangles come from its pre-rendered tiles instead and
+    only the moving ones are drawn every frame. balls
+    replaces the world's balls, for example with states played back from a StateRing.
+
+    Returns:
+        int: The number of rectangles drawn.
+    """
+    if tiles is not None:
+        before = tiles.rasterized
+        tiles.draw(screen, world, camX, camY, camZoom)
+        box = view_box(screen, camX, camY, camZoom)
+        drawn = 0
+        for i in world.bodies:
+            if isinstance(i,DynamicRectangle) and draw_rectangle(screen, i, camX, camY, camZoom, box):
+                drawn += 1
+        for i in world.balls if balls is None else balls:
+            draw_ball(screen, i, camX, camY, camZoom)
+        draw_particles(screen, world.particles, camX, camY, camZoom, box)
+        return tiles.rasterized - before + drawn
+    screen.fill("white")
+    for i in world.balls if balls is None else balls:
+        draw_ball(screen, i, camX, camY, camZoom)
+    box = view_box(screen, camX, camY, camZoom)
+    draw_particles(screen, world.particles, camX, camY, camZoom, box)
+    drawn = 0
+    for i in world.grid.queryBox(*box):
+        if draw_rectangle(screen, i, camX, camY, camZoom, box):
+            drawn += 1
+    return drawn
+
+class PerfOverlay:
+    """
+    FPS counter in the top-left corner and, while a Profiler is recording, the average
+    time per phase and the counters per frame.
+
+    The text is refreshed every interval frames. Lines are only re-rendered when their
+    text changes, and the panel Surface is only rebuilt then too; other frames just blit it.
+
+    Args:
+        font (pygame.font.Font): Font to render with.
+        interval (int): Frames between refreshes.
+    """
+    def __init__(self, font, interval=15):
+        self._font = font
+        self._interval = interval
+        self._frame = 0
+        self._lines = []
+        self._rendered = {}
+        self._panel = None
+
+    def _text(self, fps, profiler):
+        lines = [f"{int(fps)} FPS"]
+        if profiler is not None and profiler.enabled and profiler.timeline:
+            times, counts = profiler.average(self._interval)
+            for phase in ("events", "physics", "broadphase", "narrowphase", "update", "draw", "input"):
+                if phase in times:
+                    lines.append(f"{phase} {times[phase] * 1000:.2f} ms")
+            lines.append(" ".join(f"{name} {counts.get(name, 0):.1f}" for name in ("substeps", "candidates", "hits", "edge", "corner", "cached", "drawn")))
+        return lines
+
+    def draw(self, screen, fps, profiler=None):
+        if self._frame % self._interval == 0 or self._panel is None:
+            lines = self._text(fps, profiler)
+            if lines != self._lines:
+                rendered = [self._rendered.get(i) or self._font.render(i, 1, pygame.Color("black")) for i in lines]
+                self._rendered = dict(zip(lines, rendered))
+                width = max(i.get_width() for i in rendered) + 10
+                height = sum(i.get_height() for i in rendered) + 10
+                if self._panel is None or self._panel.get_size() != (width, height):
+                    self._panel = pygame.Surface((width, height))
+                self._panel.fill(pygame.Color("white"))
+                y = 5
+                for i in rendered:
+                    self._panel.blit(i, (5, y))
+                    y += i.get_height()
+                self._lines = lines
+        self._frame += 1
+        screen.blit(self._panel, (0, 0))
+
+def draw_snapshot(screen, world, snapshot, camX, camY, camZoom=1, tiles=None, lock=None):
+    """
+    Like draw_world, with the balls, particles and moving rectangles taken from a stepper
+    Snapshot instead of the world, so they can be drawn in between physics frames. The
+    static rectangles still come from the world (or the TileCache). lock, if given, is
+    held only while they are looked up in the world, so a physics thread holding it
+    while it steps is not kept waiting for the drawing.
+
+    Returns:
+        int: The number of rectangles drawn.
+    """
+    box = view_box(screen, camX, camY, camZoom)
+    if tiles is not None:
+        before = tiles.rasterized
+        tiles.draw(screen, world, camX, camY, camZoom, lock)
+        drawn = tiles.rasterized - before
+    else:
+        screen.fill("white")
+        drawn = 0
+        with lock or nullcontext():
+            rects = world.grid.queryBox(*box)
+        for i in rects:
+            if not isinstance(i,DynamicRectangle) and draw_rectangle(screen, i, camX, camY, camZoom, box):
+                drawn += 1
+    centerX = screen.get_width() / 2
+    centerY = screen.get_height() / 2
+    for corners, color in zip(snapshot.rects.tolist(), snapshot.rectColors):
+        xs = [i[0] for i in corners]
+        ys = [i[1] for i in corners]
+        if max(xs) < box[0] or min(xs) > box[2] or max(ys) < box[1] or min(ys) > box[3]:
+            continue
+        pygame.draw.polygon(screen, color, [(centerX - (camX - x) * camZoom, centerY - (y - camY) * camZoom) for x, y in corners])
+        drawn += 1
+    for (x, y), (radius, color) in zip(snapshot.balls.tolist(), snapshot.ballLooks):
+        if x + radius < box[0] or x - radius > box[2] or y + radius < box[1] or y - radius > box[3]:
+            continue
+        pygame.draw.circle(screen, color, (centerX - (camX - x) * camZoom, centerY - (y - camY) * camZoom), radius * camZoom)
+    return drawn
@@ -0,0 +1,370 @@
+"""
+Input recording, deterministic replay and playback of ball states.
+
+A Recording holds everything needed to re-simulate a session exactly: the level, the
+moving rectangles and the balls it started with, the held movement keys of every frame
+(one byte per frame), the commands given (placing and removing rectangles, toggling
+gravity, stopping the ball, spraying particles), and a keyframe of the exact simulation
+state every keyframeInterval frames. Seeking to a frame restores the keyframe before it
+and only simulates the frames after that.
+
+A StateRing keeps the last few thousand frames of ball positions and speeds in a compact
+array, so they can be played back on screen without running the physics.
+
+Usage:
+    python replay.py recording.npz                # re-simulate the session, check it matches
+    python replay.py recording.npz --frame 5000   # print the ball state at frame 5000
+"""
+import argparse
+import json
+import time
+
+from numpy import arange, ceil, sqrt, dtype, empty, full, frombuffer, load, savez, uint8
+
+from engine import World, Ball, Rectangle, DynamicRectangle, MovingPlatform, load_level, save_code
+
+
+KEY_FORCES = ((0, 1), (0, -1), (-1, 0), (1, 0)) #Force exerted on every ball by each bit of a key mask: Z, S, Q, D
+KEYFRAME_INTERVAL = 300
+BODY_TYPES = {i.__name__: i for i in (DynamicRectangle, MovingPlatform)} #Moving rectangles a Recording can rebuild
+
+def body_arguments(rect):
+    """
+    Constructor arguments of a moving rectangle, with the angle in radians so that
+    build_body() gives it exactly the same geometry. Its state at the time (position,
+    speed, progress along its path) is not included; keyframes hold that.
+    """
+    if type(rect) not in BODY_TYPES.values():
+        raise ValueError(f"cannot record a {type(rect).__name__}")
+    if isinstance(rect,MovingPlatform):
+        return [rect._startX, rect._startY, rect._width, rect._height, rect._angle, rect._toX, rect._toY, rect._speed, rect._color, rect._bounciness]
+    return [rect._x, rect._y, rect._width, rect._height, rect._angle, rect._color, rect._bounciness]
+
+def build_body(name, arguments):
+    # Inverse of body_arguments, for a rectangle of the class with that name
+    x, y, width, height, angle, *rest = arguments
+    if name == "DynamicRectangle":
+        rest = rest[:2] #Older recordings also store a gravity switch, always off
+    rect = BODY_TYPES[name](x, y, width, height, 0, *rest)
+    rect._angle = angle
+    rect._computeGeometry()
+    return rect
+
+def moving_bodies(world):
+    # world.bodies in an order that does not depend on whether the balls or the rectangles were added first
+    return world.balls + [i for i in world.rectangles() if isinstance(i,DynamicRectangle)]
+
+def apply_command(world, command):
+    """
+    Carries out a command given during a session.
+
+    Args:
+        world (World): The world.
+        command (tuple): One of
+            ("place", x, y, width, height, angle_degrees, color, bounciness): add a Rectangle
+            ("remove",): remove the rectangle added last, if the last object is one
+            ("fly", fly): set World.fly
+            ("stop", ball): stop the ball with that index in world.balls
+            ("spray", x, y, count, radius): add count particles in a square block above (x, y)
+
+    Returns:
+        Rectangle: The rectangle added or removed, if any.
+    """
+    kind = command[0]
+    if kind == "place":
+        return world.addRectangle(Rectangle(*command[1:]))
+    if kind == "remove":
+        if world.scene and isinstance(world.scene[-1],Rectangle):
+            rect = world.scene[-1]
+            world.removeRectangle(rect)
+            return rect
+    elif kind == "fly":
+        world.fly = command[1]
+    elif kind == "stop":
+        ball = world.balls[command[1]]
+        ball._vX = 0
+        ball._vY = 0
+    elif kind == "spray":
+        _, x, y, count, radius = command
+        side = int(ceil(sqrt(count)))
+        k = arange(count)
+        spacing = 2.5 * radius
+        world.addParticles(x + (k % side - (side - 1) / 2) * spacing, y + (k // side) * spacing, radius, color="blue")
+    else:
+        raise ValueError(f"unknown command {kind!r}")
+
+def apply_keys(world, mask):
+    # Forces of the held movement keys, in the same order as the main loop always applied them
+    for bit, (forceX, forceY) in enumerate(KEY_FORCES):
+        if mask & (1 << bit):
+            world.exertForce(forceX, forceY)
+
+def capture_state(world):
+    """
+    Exact simulation state of a world: its frame, gravity switch, the STATE fields of
+    every moving body (balls first, then the moving rectangles in level order) and the
+    Particles.STATE arrays. References to rectangles are stored as {"rect": index in
+    world.rectangles()}, tuples (also nested ones) and arrays as lists, so the state
+    survives a trip through JSON.
+    """
+    rows = {}
+    def value(v):
+        if isinstance(v,Rectangle):
+            if not rows:
+                rows.update((j, k) for k, j in enumerate(world.rectangles()))
+            return {"rect": rows[v]}
+        if isinstance(v,tuple):
+            return [value(i) for i in v]
+        return v
+    bodies = [[value(getattr(i, name)) for name in i.STATE] for i in moving_bodies(world)]
+    particles = world.particles
+    n = len(particles)
+    state = [getattr(particles, name)[:n].tolist() for name in particles.STATE]
+    return {"frame": world.frame, "fly": world._fly, "substeps": world.substeps, "ballContacts": world.ballContacts, "bodies": bodies,
+            "particles": state + [list(particles._colors)]}
+
+def restore_state(world, state):
+    """
+    Inverse of capture_state, on a world with the same balls and rectangles.
+    """
+    world.frame = state["frame"]
+    world._fly = state["fly"]
+    world.substeps = state["substeps"]
+    world.ballContacts = state.get("ballContacts", 0)
+    rects = world.rectangles()
+    def value(v):
+        if isinstance(v,dict):
+            return rects[v["rect"]] if "rect" in v else world.scene[v["scene"]] #"scene": recordings from before moving rectangles were rebuilt
+        if isinstance(v,list):
+            return tuple(value(i) for i in v)
+        return v
+    bodies = moving_bodies(world)
+    if len(bodies) != len(state["bodies"]):
+        raise ValueError(f"the state has {len(state['bodies'])} moving bodies, the world {len(bodies)}")
+    for i, values in zip(bodies, state["bodies"]):
+        if isinstance(i,DynamicRectangle) and len(values) == len(i.STATE) + 2:
+            #Recorded when moving rectangles still had _gravity and _onGround, right after _vY
+            values = values[:6] + values[8:]
+        for name, v in zip(i.STATE, values):
+            setattr(i, name, value(v))
+    #Moving rectangles are back where they were, so are their rows in the collision structures
+    for i in world.bodies:
+        if isinstance(i,DynamicRectangle):
+            world.grid.move(i)
+            world.store.update(i)
+    particles = world.particles
+    particles.clear()
+    *arrays, colors = state.get("particles", [[]])
+    if colors:
+        #Added anywhere, then every array overwritten with the stored one
+        particles.add(empty(len(colors)), empty(len(colors)), 1)
+        for name, values in zip(particles.STATE, arrays):
+            getattr(particles, name)[:len(colors)] = values
+        particles._colors = list(colors)
+
+class Recording:
+    """
+    Records a session on a world, from the moment it is created.
+
+    Every frame of the main loop: commands go through command(), the held keys through
+    keys() and endFrame() closes the frame. Commands are applied before World.run() and
+    keys after it, like the main loop always did.
+
+    Args:
+        world (World): The world, with its balls and level in place.
+        keyframeInterval (int): Frames between keyframes.
+    """
+    def __init__(self, world, keyframeInterval=KEYFRAME_INTERVAL):
+        self.settings = {"frameRate": world.frameRate, "substeps": world.maxSubsteps, "gravity": world.gravity, "groundSpeed": world.groundSpeed, "adaptive": world.adaptive,
+                         "ballCollisions": world.ballCollisions}
+        self.balls = [(i._x, i._y, i._radius, i._mass, i._color, i._gravity) for i in world.balls]
+        rects = world.rectangles()
+        self.level = save_code(rects) #Moving rectangles too, as placeholders that keep the order
+        self.bodies = {k: [type(i).__name__, body_arguments(i)] for k, i in enumerate(rects) if isinstance(i,DynamicRectangle)} #Level index -> class name and arguments
+        self.keyframeInterval = keyframeInterval
+        self.frame = 0
+        self.keyMasks = bytearray()
+        self.commands = {} #Frame -> commands given that frame, in order
+        self.keyframes = {0: capture_state(world)}
+
+    def command(self, world, command):
+        self.commands.setdefault(self.frame, []).append(list(command))
+        return apply_command(world, command)
+
+    def keys(self, world, mask):
+        self.keyMasks.append(mask)
+        apply_keys(world, mask)
+
+    def endFrame(self, world):
+        if len(self.keyMasks) == self.frame:
+            self.keyMasks.append(0)
+        self.frame += 1
+        if self.frame % self.keyframeInterval == 0:
+            self.keyframes[self.frame] = capture_state(world)
+
+    def newWorld(self):
+        # The world as it was when recording started, apart from the states of the balls and moving rectangles
+        world = World(**self.settings)
+        for i in self.balls:
+            world.addBall(Ball(*i))
+        rects = load_level(self.level)
+        for k, (name, arguments) in self.bodies.items():
+            rects[k] = build_body(name, arguments)
+        world.loadRectangles(rects)
+        return world
+
+    def simulate(self, world, start, stop):
+        # Re-simulates frames start to stop - 1 on a world that is at frame start
+        keyMasks = self.keyMasks
+        commands = self.commands
+        for frame in range(start, stop):
+            for i in commands.get(frame, ()):
+                apply_command(world, i)
+            world.run(1)
+            apply_keys(world, keyMasks[frame])
+
+    def seek(self, frame):
+        """
+        A new World in the state the recorded one was in at the start of the given frame.
+        Starts from the closest keyframe before it, so the cost is at most keyframeInterval
+        frames of physics plus re-applying the edits made before that keyframe.
+        """
+        if not 0 <= frame <= self.frame:
+            raise ValueError(f"frame {frame} is outside the recording (0 to {self.frame})")
+        start = max(i for i in self.keyframes if i <= frame)
+        world = self.newWorld()
+        for k in sorted(i for i in self.commands if i < start):
+            for i in self.commands[k]:
+                if i[0] in ("place", "remove"):
+                    apply_command(world, i)
+        restore_state(world, self.keyframes[start])
+        self.simulate(world, start, frame)
+        return world
+
+    def replay(self, ring=None):
+        """
+        Re-simulates the whole session from the start, as fast as possible.
+
+        Args:
+            ring (StateRing): Filled with the ball states of every frame, if given.
+
+        Returns:
+            World: The world at the end of the session.
+        """
+        world = self.seek(0)
+        for frame in range(self.frame):
+            self.simulate(world, frame, frame + 1)
+            if ring is not None:
+                ring.push(frame + 1, world.balls)
+        return world
+
+    def save(self, path, world=None):
+        """
+        Writes the recording to an .npz file. With the world, its current state is stored
+        as a final keyframe, so the replay can be checked against it.
+        """
+        keyframes = dict(self.keyframes)
+        if world is not None:
+            keyframes[self.frame] = capture_state(world)
+        header = {"settings": self.settings, "balls": self.balls, "level": self.level, "bodies": {str(k): v for k, v in self.bodies.items()},
+                  "keyframeInterval": self.keyframeInterval, "frames": self.frame,
+                  "commands": {str(k): v for k, v in self.commands.items()}, "keyframes": {str(k): v for k, v in keyframes.items()}}
+        savez(path, header=json.dumps(header), keyMasks=frombuffer(bytes(self.keyMasks), uint8))
+
+    @classmethod
+    def load(cls, path):
+        data = load(path)
+        header = json.loads(str(data["header"]))
+        recording = cls.__new__(cls)
+        recording.settings = header["settings"]
+        recording.balls = [tuple(i) for i in header["balls"]]
+        recording.level = header["level"]
+        recording.bodies = {int(k): v for k, v in header.get("bodies", {}).items()}
+        recording.keyframeInterval = header["keyframeInterval"]
+        recording.frame = header["frames"]
+        recording.keyMasks = bytearray(data["keyMasks"].tobytes())
+        recording.commands = {int(k): v for k, v in header["commands"].items()}
+        recording.keyframes = {int(k): v for k, v in header["keyframes"].items()}
+        return recording
+
+BALL_RECORD_DTYPE = dtype([("x", "<f4"), ("y", "<f4"), ("vX", "<f4"), ("vY", "<f4"), ("flags", "u1")]) #flags: 1 asleep, 2 on ground
+
+class BallState:
+    """
+    A ball as stored in a StateRing, with what draw_ball needs.
+    """
+    __slots__ = ("_x", "_y", "_vX", "_vY", "_asleep", "_onGround", "_radius", "_color")
+
+class StateRing:
+    """
+    The ball states of the last capacity frames, BALL_RECORD_DTYPE per ball (17 bytes).
+    Only the balls a world had when the ring was made are stored.
+
+    Args:
+        capacity (int): Number of frames kept.
+        balls (list): The balls to store.
+    """
+    def __init__(self, capacity, balls):
+        self.states = empty((capacity, len(balls)), BALL_RECORD_DTYPE)
+        self.frames = full(capacity, -1)
+        self._looks = [(i._radius, i._color) for i in balls]
+        self._next = 0
+
+    def push(self, frame, balls):
+        row = self.states[self._next]
+        for k, (i, _) in enumerate(zip(balls, self._looks)):
+            row[k] = (i._x, i._y, i._vX, i._vY, i._asleep | i._onGround << 1)
+        self.frames[self._next] = frame
+        self._next = (self._next + 1) % len(self.frames)
+
+    def oldest(self):
+        frames = self.frames[self.frames >= 0]
+        return int(frames.min()) if len(frames) else None
+
+    def newest(self):
+        frames = self.frames[self.frames >= 0]
+        return int(frames.max()) if len(frames) else None
+
+    def __contains__(self, frame):
+        return bool((self.frames == frame).any())
+
+    def ballsAt(self, frame):
+        """
+        The stored balls of a frame, as BallStates.
+        """
+        row = self.states[int((self.frames == frame).argmax())]
+        balls = []
+        for state, (radius, color) in zip(row.tolist(), self._looks):
+            ball = BallState()
+            ball._x, ball._y, ball._vX, ball._vY, flags = state
+            ball._asleep = bool(flags & 1)
+            ball._onGround = bool(flags & 2)
+            ball._radius = radius
+            ball._color = color
+            balls.append(ball)
+        return balls
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-simulate a recorded session headless")
+    parser.add_argument("recording", help=".npz file saved by Recording.save")
+    parser.add_argument("--frame", type=int, help="only print the ball states at this frame")
+    args = parser.parse_args()
+
+    recording = Recording.load(args.recording)
+    start = time.perf_counter()
+    if args.frame is not None:
+        world = recording.seek(args.frame)
+        print(f"seeked to frame {args.frame} in {time.perf_counter() - start:.3f} s")
+    else:
+        world = recording.replay()
+        elapsed = time.perf_counter() - start
+        print(f"replayed {recording.frame} frames in {elapsed:.2f} s ({recording.frame / max(elapsed, 1e-9):.0f} frames/s)")
+        if recording.frame in recording.keyframes:
+            #The saved final state, through restore_state so recordings with "scene" references compare too
+            final = capture_state(recording.seek(recording.frame))
+            print("matches the recording" if capture_state(world) == final else "DIVERGED from the recording")
+    for k, i in enumerate(world.balls):
+        print(f"ball {k}: x {i._x!r} y {i._y!r} vX {i._vX!r} vY {i._vY!r}{' asleep' if i._asleep else ''}")
+
+if __name__ == "__main__":
+    main()
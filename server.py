@@ -0,0 +1,314 @@
+"""
+Asyncio server hosting many independent sessions on one machine, one World per client.
+
+A client connects over a local socket (TCP or a Unix socket), joins a map by name and then
+sends the ZQSD keys it holds. Every tick, one loop steps all the worlds with their held
+keys, like the main loop of physics.py, and sends each client what changed in its world.
+
+Each map is parsed once, when the first client joins it, into a world without balls. The
+session worlds share its rectangles and collision structures (World.shareLevel), so a
+session costs little more than its ball.
+
+Protocol: every message, both ways, is a LENGTH (uint16, little-endian) followed by that
+many bytes, the first of which is the message type.
+    client JOIN     map name to play, sent once after connecting
+    client INPUT    held keys as a replay.KEY_FORCES bit mask, and a sequence number
+    server WELCOME  tick rate, number of balls and session id, the answer to JOIN
+    server STATE    frame, last input sequence applied, camera, then the balls that
+                    changed (BALL each) since the last STATE sent to this client
+    server ERROR    utf-8 text, then the connection is closed
+Positions and speeds are float32. The camera follows the first ball, like physics.py.
+
+Backpressure: the kernel send buffer of every client is kept small, so a slow client's
+backlog stays in the server. While more than bufferLimit bytes wait for it, its updates
+are held back; the next STATE it gets carries every change since the last one, so
+nothing is lost and nothing piles up. A client held back for longer than maxBehind
+seconds is disconnected. The tick loop never waits for a client.
+
+Usage:
+    python server.py                                 # default map on 127.0.0.1:7777
+    python server.py --map big=level.lvl --stats 5   # also serve "big", print metrics every 5 s
+    python server.py --unix /tmp/physics.sock
+    python loadgen.py --clients 200                  # load test, see loadgen.py
+"""
+import argparse
+import asyncio
+import os
+import socket
+import struct
+import time
+from collections import deque
+
+from engine import World, Ball, DEFAULT_LEVEL, FRAME_RATE, load_level
+from levels import read_level_records, rectangles_from_records
+from replay import apply_keys
+
+
+LENGTH = struct.Struct("<H")
+JOIN = struct.Struct("<B") #JOIN_TYPE, then the map name (utf-8)
+INPUT = struct.Struct("<BBH") #INPUT_TYPE, key mask, sequence number
+WELCOME = struct.Struct("<BHHI") #WELCOME_TYPE, tick rate, balls, session id
+STATE = struct.Struct("<BIHffH") #STATE_TYPE, frame, last input sequence applied, camera x, camera y, balls that follow
+BALL = struct.Struct("<Hffff") #Ball index, x, y, vX, vY
+ERROR = struct.Struct("<B") #ERROR_TYPE, then the text (utf-8)
+JOIN_TYPE, INPUT_TYPE, WELCOME_TYPE, STATE_TYPE, ERROR_TYPE = range(5)
+
+PORT = 7777
+SEND_BUFFER = 4096 #Kernel send buffer per client, in bytes
+MAX_LATE_TICKS = 5 #Ticks the loop may fall behind before the backlog is skipped
+
+async def read_message(reader):
+    # One message, without its length
+    length, = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    return await reader.readexactly(length)
+
+def message(*parts):
+    # Length-prefixed message of the concatenated parts
+    data = b"".join(parts)
+    return LENGTH.pack(len(data)) + data
+
+def percentile(values, p):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] if ordered else 0
+
+class Session:
+    """
+    One client and its world.
+
+    Attributes:
+        keys (int): Held keys, as a replay.KEY_FORCES bit mask.
+        ack (int): Sequence number of the last INPUT received.
+        sent (list): Packed state of each ball in the last STATE sent, None before the first.
+        behindSince (float): When the client started being held back, None while it keeps up.
+    """
+    def __init__(self, id, world, writer):
+        self.id = id
+        self.world = world
+        self.writer = writer
+        self.keys = 0
+        self.ack = 0
+        self.sent = [None] * len(world.balls)
+        self.sentAck = None
+        self.behindSince = None
+
+    def delta(self):
+        """
+        The STATE message with the balls that changed since the last one, or None when
+        nothing did. The changes count as sent from then on.
+        """
+        changed = []
+        for k, i in enumerate(self.world.balls):
+            data = BALL.pack(k, i._x, i._y, i._vX, i._vY)
+            if data != self.sent[k]:
+                self.sent[k] = data
+                changed.append(data)
+        if not changed and self.ack == self.sentAck:
+            return None
+        self.sentAck = self.ack
+        ball = self.world.balls[0]
+        return message(STATE.pack(STATE_TYPE, self.world.frame, self.ack, ball._x, ball._y, len(changed)), *changed)
+
+class SessionServer:
+    """
+    Runs one World per connected client, all stepped by one tick loop.
+
+    Args:
+        maps (dict): Map name -> save code, or path of a save code file or binary level
+            file. Maps with moving rectangles cannot be served.
+        tickRate (int): Physics frames per second.
+        bufferLimit (int): Bytes that may wait for a client before its updates are held back.
+        maxBehind (float): Seconds a client may be held back before it is disconnected.
+        window (int): Ticks the latency metrics are taken over.
+        spawn (tuple): Where each session's ball starts.
+    """
+    def __init__(self, maps=None, tickRate=FRAME_RATE, bufferLimit=65536, maxBehind=10, window=600, spawn=(0, 200)):
+        self.maps = maps or {"default": DEFAULT_LEVEL}
+        self.tickRate = tickRate
+        self.bufferLimit = bufferLimit
+        self.maxBehind = maxBehind
+        self.spawn = spawn
+        self.sessions = {}
+        self._levels = {} #Map name -> task loading its shared world
+        self._nextId = 1
+        #Metrics, in seconds: duration of each tick, its stepping and sending parts, and how late it started
+        self.tickTimes = deque(maxlen=window)
+        self.stepTimes = deque(maxlen=window)
+        self.sendTimes = deque(maxlen=window)
+        self.lateness = deque(maxlen=window)
+        self.ticks = 0
+        self.skippedTicks = 0
+        self.bytesSent = 0
+        self.messagesSent = 0
+        self.heldBack = 0 #Updates not sent to a client because it was behind
+        self.disconnected = 0 #Clients dropped for being behind too long
+
+    def _loadLevel(self, source):
+        if os.path.isfile(source):
+            rects = rectangles_from_records(*read_level_records(source))
+        else:
+            rects = load_level(source)
+        world = World(frameRate=self.tickRate)
+        world.loadRectangles(rects)
+        return world
+
+    async def level(self, name):
+        """
+        The shared world of a map, parsed on a thread the first time so the ticks go on.
+        """
+        if name not in self._levels:
+            if name not in self.maps:
+                raise KeyError(name)
+            self._levels[name] = asyncio.ensure_future(asyncio.to_thread(self._loadLevel, self.maps[name]))
+        return await self._levels[name]
+
+    async def handle(self, reader, writer):
+        # One connection: JOIN, then INPUTs until it closes
+        sock = writer.get_extra_info("socket")
+        if sock is not None:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        session = None
+        try:
+            data = await read_message(reader)
+            if data[:1] != bytes([JOIN_TYPE]):
+                raise ValueError("expected JOIN")
+            name = data[JOIN.size:].decode()
+            try:
+                level = await self.level(name)
+            except KeyError:
+                writer.write(message(ERROR.pack(ERROR_TYPE), f"unknown map {name!r}".encode()))
+                return
+            world = World(frameRate=self.tickRate, adaptive=True)
+            world.addBall(Ball(self.spawn[0], self.spawn[1], 10, 2, "red"))
+            world.shareLevel(level)
+            session = Session(self._nextId, world, writer)
+            self._nextId += 1
+            self.sessions[session.id] = session
+            writer.write(message(WELCOME.pack(WELCOME_TYPE, self.tickRate, len(world.balls), session.id)))
+            while True:
+                data = await read_message(reader)
+                if data[0] == INPUT_TYPE:
+                    _, session.keys, session.ack = INPUT.unpack(data)
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, IndexError, struct.error):
+            pass
+        finally:
+            if session is not None:
+                self.sessions.pop(session.id, None)
+            writer.close()
+
+    def tick(self):
+        """
+        Steps every world one frame and sends every client its changes.
+        """
+        start = time.perf_counter()
+        sessions = list(self.sessions.values())
+        for i in sessions:
+            i.world.run(1)
+            apply_keys(i.world, i.keys)
+        stepped = time.perf_counter()
+        for i in sessions:
+            self._send(i, stepped)
+        end = time.perf_counter()
+        self.ticks += 1
+        self.stepTimes.append(stepped - start)
+        self.sendTimes.append(end - stepped)
+        self.tickTimes.append(end - start)
+
+    def _send(self, session, now):
+        transport = session.writer.transport
+        if transport.is_closing():
+            return
+        if transport.get_write_buffer_size() > self.bufferLimit:
+            #Behind: hold the update back, the next one will carry its changes
+            self.heldBack += 1
+            if session.behindSince is None:
+                session.behindSince = now
+            elif now - session.behindSince > self.maxBehind:
+                self.disconnected += 1
+                transport.abort()
+            return
+        session.behindSince = None
+        data = session.delta()
+        if data is not None:
+            session.writer.write(data)
+            self.bytesSent += len(data)
+            self.messagesSent += 1
+
+    async def run(self):
+        # The tick loop, at tickRate ticks per second of real time
+        loop = asyncio.get_running_loop()
+        interval = 1 / self.tickRate
+        due = loop.time()
+        while True:
+            due += interval
+            wait = due - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            elif wait < -MAX_LATE_TICKS * interval:
+                #Too far behind to catch up: skip the backlog instead of running it
+                behind = int(-wait / interval)
+                self.skippedTicks += behind
+                due += behind * interval
+            self.lateness.append(max(loop.time() - due, 0))
+            self.tick()
+            await asyncio.sleep(0) #Let the connections in between ticks, even when behind
+
+    def metrics(self):
+        """
+        Current load and latency: sessions, loaded maps, ticks run and skipped, traffic
+        and clients held back or dropped, and the 50th and 99th percentiles in
+        milliseconds of the tick, step and send times and of how late ticks started,
+        over the last window ticks.
+        """
+        stats = {"sessions": len(self.sessions), "maps": len(self._levels), "ticks": self.ticks, "skipped_ticks": self.skippedTicks,
+                 "bytes_sent": self.bytesSent, "messages_sent": self.messagesSent, "held_back": self.heldBack, "disconnected": self.disconnected}
+        for name, values in (("tick", self.tickTimes), ("step", self.stepTimes), ("send", self.sendTimes), ("late", self.lateness)):
+            stats[f"{name}_ms_p50"] = percentile(values, 50) * 1000
+            stats[f"{name}_ms_p99"] = percentile(values, 99) * 1000
+        return stats
+
+    async def report(self, interval):
+        # Prints the metrics every interval seconds
+        bytesSent = self.bytesSent
+        while True:
+            await asyncio.sleep(interval)
+            m = self.metrics()
+            print(f"{m['sessions']} sessions  tick p50 {m['tick_ms_p50']:.2f} ms p99 {m['tick_ms_p99']:.2f} ms  (step p99 {m['step_ms_p99']:.2f}, send p99 {m['send_ms_p99']:.2f})"
+                  f"  late p99 {m['late_ms_p99']:.2f} ms  skipped {m['skipped_ticks']}  {(m['bytes_sent'] - bytesSent) / interval / 1024:.1f} KB/s"
+                  f"  held back {m['held_back']}  dropped {m['disconnected']}", flush=True)
+            bytesSent = m["bytes_sent"]
+
+    async def serve(self, host="127.0.0.1", port=PORT, unix=None, stats=None):
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, unix)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        tasks = [asyncio.ensure_future(self.run())]
+        if stats:
+            tasks.append(asyncio.ensure_future(self.report(stats)))
+        async with server:
+            await asyncio.gather(server.serve_forever(), *tasks)
+
+def main():
+    parser = argparse.ArgumentParser(description="Host many physics sessions, one world per client")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of TCP")
+    parser.add_argument("--map", action="append", default=[], help="NAME=PATH of a save code file or binary level file (repeatable); \"default\" is the default map")
+    parser.add_argument("--tick-rate", type=int, default=FRAME_RATE)
+    parser.add_argument("--buffer-limit", type=int, default=65536, help="bytes waiting for a client before its updates are held back")
+    parser.add_argument("--stats", type=float, help="print the metrics every this many seconds")
+    args = parser.parse_args()
+
+    maps = {"default": DEFAULT_LEVEL}
+    for i in args.map:
+        name, _, path = i.partition("=")
+        maps[name] = path
+    server = SessionServer(maps, args.tick_rate, args.buffer_limit)
+    print(f"serving {', '.join(maps)} on {args.unix or f'{args.host}:{args.port}'}", flush=True)
+    try:
+        asyncio.run(server.serve(args.host, args.port, args.unix, args.stats))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
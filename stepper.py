@@ -0,0 +1,169 @@
+"""
+Fixed-timestep physics, decoupled from the rendering frame rate.
+
+A FixedStepper runs a World at world.frameRate physics frames per second of real time.
+Real time is added to an accumulator and every whole frame in it is simulated, however
+fast or slow the screen is drawn. After each physics frame it publishes a Snapshot of
+everything that moves. The renderer reads the last two snapshots and draws a blend of
+them, so motion stays smooth at any rendering frame rate.
+
+The stepper is driven either by the main loop (advance() once per rendered frame) or by
+its own thread (start()).
+"""
+from collections import deque
+from threading import Thread, Lock, Event
+from time import perf_counter
+
+from numpy import array, concatenate
+
+from engine import DynamicRectangle
+
+
+class Snapshot:
+    """
+    Positions of the balls, particles and corners of the DynamicRectangles after a physics
+    frame, copied so the world can carry on while they are drawn.
+
+    Attributes:
+        frame (int): World.frame the snapshot was taken at.
+        balls (numpy.ndarray): (balls + particles, 2) centres, the particles last.
+        ballLooks (list): (radius, color) per ball and particle.
+        rects (numpy.ndarray): (rectangles, 4, 2) corners polygon1 to polygon4.
+        rectColors (list): Colour per rectangle.
+    """
+    __slots__ = ("frame", "balls", "ballLooks", "rects", "rectColors")
+
+    @classmethod
+    def capture(cls, world):
+        snapshot = cls()
+        snapshot.frame = world.frame
+        particles = world.particles
+        n = len(particles)
+        snapshot.balls = concatenate((array([(i._x, i._y) for i in world.balls], dtype=float).reshape(-1, 2), particles._pos[:n]))
+        snapshot.ballLooks = [(i._radius, i._color) for i in world.balls] + list(zip(particles._radius[:n].tolist(), particles._colors))
+        moving = [i for i in world.bodies if isinstance(i,DynamicRectangle)]
+        snapshot.rects = array([(i._polygon1, i._polygon2, i._polygon3, i._polygon4) for i in moving], dtype=float).reshape(-1, 4, 2)
+        snapshot.rectColors = [i._color for i in moving]
+        return snapshot
+
+    def blend(self, other, alpha):
+        """
+        The state alpha of the way from this snapshot to the later other one. When bodies
+        were added or removed in between, other is returned as it is.
+        """
+        if self.balls.shape != other.balls.shape or self.rects.shape != other.rects.shape:
+            return other
+        snapshot = Snapshot()
+        snapshot.frame = other.frame
+        snapshot.balls = self.balls + (other.balls - self.balls) * alpha
+        snapshot.ballLooks = other.ballLooks
+        snapshot.rects = self.rects + (other.rects - self.rects) * alpha
+        snapshot.rectColors = other.rectColors
+        return snapshot
+
+class FixedStepper:
+    """
+    Runs a World on a fixed timestep of 1 / world.frameRate seconds.
+
+    Everything that changes the world from outside goes through submit(), and runs on
+    the physics side just before the next frame. afterFrame(world) is called after each
+    frame, for per-frame input and bookkeeping. lock is held while a frame runs: hold it
+    to read the static geometry (for drawing) or the world from another thread.
+
+    When the simulation falls more than maxFrames behind (the machine is too slow, or
+    drawing stalled for a long time) the backlog is dropped instead of simulated, so it
+    cannot spiral; dropped counts those frames.
+
+    Args:
+        world (World): The world to run.
+        afterFrame (callable): Called with the world after every physics frame.
+        maxFrames (int): Most frames simulated to catch up at once.
+    """
+    def __init__(self, world, afterFrame=None, maxFrames=5):
+        self.world = world
+        self.afterFrame = afterFrame
+        self.maxFrames = maxFrames
+        self.dt = 1 / world.frameRate
+        self.lock = Lock()
+        self.paused = False
+        self.dropped = 0
+        self._queue = deque()
+        self._accumulator = 0
+        self._advancedAt = perf_counter()
+        snapshot = Snapshot.capture(world)
+        self._snapshots = (snapshot, snapshot) #Previous and current, swapped as one
+        self._thread = None
+        self._stopping = Event()
+
+    def submit(self, function):
+        self._queue.append(function)
+
+    def _runQueue(self):
+        while self._queue:
+            self._queue.popleft()()
+
+    def step(self):
+        # One physics frame
+        with self.lock:
+            self._runQueue()
+            self.world.run(1)
+            if self.afterFrame is not None:
+                self.afterFrame(self.world)
+            self._snapshots = (self._snapshots[1], Snapshot.capture(self.world))
+
+    def advance(self, elapsed):
+        """
+        Adds elapsed seconds of real time and runs the physics frames that became due.
+
+        Returns:
+            int: The number of frames run.
+        """
+        self._advancedAt = perf_counter()
+        if self.paused:
+            with self.lock:
+                self._runQueue()
+            return 0
+        self._accumulator += elapsed
+        frames = 0
+        while self._accumulator >= self.dt:
+            if frames == self.maxFrames:
+                behind = int(self._accumulator // self.dt)
+                self.dropped += behind
+                self._accumulator -= behind * self.dt
+                break
+            self.step()
+            self._accumulator -= self.dt
+            frames += 1
+        return frames
+
+    def alpha(self):
+        # How far real time is between the last two physics frames, from 0 to 1
+        return min(max((self._accumulator + perf_counter() - self._advancedAt) / self.dt, 0), 1)
+
+    def snapshot(self):
+        """
+        What to draw now: the last two snapshots blended by alpha(), one physics frame
+        behind real time.
+        """
+        previous, current = self._snapshots
+        return previous.blend(current, self.alpha())
+
+    def start(self):
+        # Runs the physics on its own thread from now on, instead of through advance()
+        self._stopping.clear()
+        self._thread = Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        last = perf_counter()
+        while not self._stopping.is_set():
+            now = perf_counter()
+            self.advance(now - last)
+            last = now
+            self._stopping.wait(max(self.dt - self._accumulator - (perf_counter() - now), 0))
+
+    def stop(self):
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,117 @@
+from queue import Queue, Empty
+from threading import Thread
+
+from numpy import sqrt
+
+
+class ChunkStreamer:
+    """
+    Keeps the chunks of a ChunkedLevel that are near the camera and the balls loaded into
+    a World, so memory and loading time depend on that neighbourhood and not on the size
+    of the level.
+
+    Every update() works out which chunks are wanted: those overlapping the given view
+    boxes or the area around a ball, grown by margin. Missing ones are read and built into
+    Rectangles on a background thread, and added to the world by a later update(). Loaded
+    chunks that are farther than keep from all of those areas are removed again.
+
+    The chunks right around each ball are never left to the thread: when they are not in
+    yet, update() loads them itself, so a ball cannot move through geometry that has not
+    arrived.
+
+    Args:
+        world (World): World to load into. Rectangles it has from elsewhere are left alone.
+        level (ChunkedLevel): The level to stream.
+        margin (float): Distance around the views and the balls to preload, in world units.
+        keep (float): Distance around the views and the balls beyond which loaded chunks
+            are evicted. Never less than margin.
+    """
+    def __init__(self, world, level, margin=512, keep=1024):
+        self.world = world
+        self.level = level
+        self.margin = margin
+        self.keep = max(keep, margin)
+        self.loaded = {} #Chunk -> its rectangles in the world
+        self.loads = 0 #Chunks added so far
+        self.evictions = 0 #Chunks removed so far
+        self._pending = set()
+        self._requests = Queue()
+        self._results = Queue()
+        self._thread = Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            chunk = self._requests.get()
+            if chunk is None:
+                return
+            self._results.put((chunk, self.level.load(chunk)))
+
+    def _chunks(self, boxes, grow, ballReach):
+        # Chunks overlapping the boxes and the balls, grown by grow
+        chunks = set()
+        for minX, minY, maxX, maxY in boxes:
+            chunks.update(self.level.chunksIn(minX - grow, minY - grow, maxX + grow, maxY + grow))
+        for i in self.world.balls:
+            reach = ballReach(i) + grow
+            chunks.update(self.level.chunksIn(i._x - reach, i._y - reach, i._x + reach, i._y + reach))
+        return chunks
+
+    def _ballReach(self, ball):
+        # How far the ball can get before the next update, with room to spare
+        world = self.world
+        return ball._radius + 2 * (sqrt(ball._vX**2 + ball._vY**2) + abs(world.gravity) / world.frameRate)
+
+    def _add(self, chunk, rects):
+        self.loaded[chunk] = self.world.addRectangles(rects)
+        self.loads += 1
+
+    def update(self, boxes=()):
+        """
+        Brings the loaded chunks up to date with the views and the balls.
+
+        Args:
+            boxes: Areas to load around, as (minX, minY, maxX, maxY) world boxes, such as
+                render.view_box of the screen.
+
+        Returns:
+            list: Bounding boxes of the chunks added or removed, for invalidating caches
+            of the static geometry such as a TileCache.
+        """
+        level = self.level
+        required = self._chunks((), 0, self._ballReach)
+        wanted = self._chunks(boxes, self.margin, self._ballReach)
+        keep = self._chunks(boxes, self.keep, self._ballReach)
+        changed = []
+        #Chunks the thread has built since the last update, added in order so runs repeat
+        finished = []
+        while True:
+            try:
+                finished.append(self._results.get_nowait())
+            except Empty:
+                break
+        for chunk, rects in sorted(finished, key=lambda i: i[0]):
+            self._pending.discard(chunk)
+            if chunk in keep and chunk not in self.loaded:
+                self._add(chunk, rects)
+                changed.append(level.bounds(chunk))
+        #The balls' own surroundings are loaded right away
+        for chunk in sorted(required - self.loaded.keys()):
+            self._add(chunk, level.load(chunk))
+            changed.append(level.bounds(chunk))
+        for chunk in sorted(wanted - self.loaded.keys() - self._pending):
+            self._pending.add(chunk)
+            self._requests.put(chunk)
+        for chunk in sorted(self.loaded.keys() - keep):
+            self.world.removeRectangles(self.loaded.pop(chunk))
+            self.evictions += 1
+            changed.append(level.bounds(chunk))
+        return changed
+
+    def close(self):
+        # Stops the background thread
+        self._requests.put(None)
+        self._thread.join()
+
+    def __len__(self):
+        return len(self.loaded)
@@ -0,0 +1,201 @@
+"""
+Headless parameter sweeps: many scenarios on the same level, run in parallel processes.
+
+A scenario is a dict of the SCENARIO_DEFAULTS keys it changes, for example
+{"gravity": -5, "bounciness": 0.6, "balls": [{"x": 100, "vX": 3}]}. Each ball is a dict
+of the BALL_DEFAULTS keys it changes. bounciness, when not None, replaces the bounciness of
+every rectangle of the level.
+
+The level is parsed once. Every worker process receives the parsed records once, when it
+starts, and builds its Rectangles from them. Binary level files are memory-mapped by the
+workers instead, so they share the operating system's copy. Scenarios are independent,
+so throughput grows with the number of workers up to the number of cores.
+
+Usage:
+    python sweep.py level.lvl --gravity -9.81 -5 --bounciness 0.5 0.85 --out sweep.npz
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from numpy import array, empty, diff, hypot, flatnonzero, savez
+
+from engine import World, Ball, DEFAULT_LEVEL, FRAME_RATE, GRAVITY, GROUND_SPEED, SUBSTEPS
+from levels import records_from_code, read_level_records, rectangles_from_records, is_level_file, load_level_file
+
+
+SCENARIO_DEFAULTS = {
+    "frames": 600,
+    "frameRate": FRAME_RATE,
+    "substeps": SUBSTEPS,
+    "adaptive": True,
+    "gravity": GRAVITY,
+    "groundSpeed": GROUND_SPEED,
+    "bounciness": None, #Replaces the bounciness of every rectangle when set
+    "fly": False,
+    "balls": [{}],
+}
+BALL_DEFAULTS = {"x": 0, "y": 200, "vX": 0, "vY": 0, "radius": 10, "mass": 2}
+TRAJECTORY_FIELDS = ("x", "y", "vX", "vY") #Last axis of a trajectory
+
+_level = None #(records, palette) of the level in this process, set by _initWorker
+_rectangles = {} #Rectangles built from _level, per bounciness override
+
+def _initWorker(level):
+    global _level
+    if isinstance(level, str):
+        level = load_level_file(level)
+    _level = level
+    _rectangles.clear()
+
+def _levelRectangles(bounciness):
+    # Rectangles are never changed by a simulation, so scenarios in a process share them
+    if bounciness not in _rectangles:
+        records, palette = _level
+        if bounciness is not None:
+            records = records.copy()
+            records["bounciness"] = bounciness
+        _rectangles[bounciness] = rectangles_from_records(records, palette)
+    return _rectangles[bounciness]
+
+def scenario(**changes):
+    """
+    A complete scenario: SCENARIO_DEFAULTS with the given changes, and every ball filled
+    in from BALL_DEFAULTS.
+    """
+    unknown = changes.keys() - SCENARIO_DEFAULTS.keys()
+    if unknown:
+        raise ValueError(f"unknown scenario settings: {', '.join(sorted(unknown))}")
+    config = dict(SCENARIO_DEFAULTS, **changes)
+    config["balls"] = [dict(BALL_DEFAULTS, **i) for i in config["balls"]]
+    return config
+
+def scenario_grid(**axes):
+    """
+    Every combination of the given values, as scenarios.
+
+    Example:
+        scenario_grid(gravity=[-9.81, -5], bounciness=[0.5, 0.85]) gives four scenarios.
+    """
+    names = list(axes)
+    return [scenario(**dict(zip(names, values))) for values in itertools.product(*(axes[i] for i in names))]
+
+def simulate(config):
+    """
+    Runs one scenario on the level of this process.
+
+    Returns:
+        dict: "config" the complete scenario, "trajectory" an array of shape
+        (frames + 1, balls, 4) with each ball's TRAJECTORY_FIELDS at the start and after
+        every frame, "asleep" the matching (frames + 1, balls) sleep flags, and "stats".
+    """
+    config = scenario(**config)
+    start = time.perf_counter()
+    world = World(frameRate=config["frameRate"], substeps=config["substeps"], gravity=config["gravity"], groundSpeed=config["groundSpeed"], adaptive=config["adaptive"])
+    world.loadRectangles(_levelRectangles(config["bounciness"]))
+    balls = []
+    for i in config["balls"]:
+        ball = world.addBall(Ball(i["x"], i["y"], i["radius"], i["mass"], "red"))
+        ball._vX = i["vX"]
+        ball._vY = i["vY"]
+        balls.append(ball)
+    world.fly = config["fly"]
+    frames = config["frames"]
+    trajectory = empty((frames + 1, len(balls), len(TRAJECTORY_FIELDS)))
+    asleep = empty((frames + 1, len(balls)), dtype=bool)
+    substeps = 0
+    for frame in range(frames + 1):
+        if frame:
+            world.run(1)
+            substeps += world.substeps
+        trajectory[frame] = [(i._x, i._y, i._vX, i._vY) for i in balls]
+        asleep[frame] = [i._asleep for i in balls]
+    return {
+        "config": config,
+        "trajectory": trajectory,
+        "asleep": asleep,
+        "stats": trajectory_stats(trajectory, asleep, substeps=substeps, seconds=time.perf_counter() - start),
+    }
+
+def trajectory_stats(trajectory, asleep, **extra):
+    """
+    Summary of a trajectory, per ball: final position, distance travelled, top speed,
+    lowest point and the frame from which the ball stayed asleep (-1 if it never settled).
+    extra is added as it is.
+    """
+    steps = hypot(*diff(trajectory[:, :, :2], axis=0).transpose(2, 0, 1))
+    restFrames = []
+    for b in range(trajectory.shape[1]):
+        awake = flatnonzero(~asleep[:, b])
+        restFrames.append(-1 if len(awake) and awake[-1] == len(asleep) - 1 else (awake[-1] + 1 if len(awake) else 0))
+    return dict({
+        "final_x": trajectory[-1, :, 0],
+        "final_y": trajectory[-1, :, 1],
+        "distance": steps.sum(axis=0),
+        "max_speed": hypot(trajectory[:, :, 2], trajectory[:, :, 3]).max(axis=0),
+        "min_y": trajectory[:, :, 1].min(axis=0),
+        "rest_frame": array(restFrames),
+    }, **extra)
+
+def run_sweep(level, scenarios, workers=None):
+    """
+    Runs scenarios on a level across a process pool.
+
+    Args:
+        level: Save code, path to a save code file or binary level file, or (records, palette).
+        scenarios (list): Scenario dicts, complete or partial.
+        workers (int): Processes to use; None for one per core. With 1 everything runs in
+            this process.
+
+    Returns:
+        list: The simulate() result of each scenario, in the same order.
+    """
+    if isinstance(level, str) and os.path.isfile(level):
+        shared = level if is_level_file(level) else read_level_records(level)
+    elif isinstance(level, str):
+        shared = records_from_code(level)
+    else:
+        shared = level
+    if workers == 1:
+        _initWorker(shared)
+        return [simulate(i) for i in scenarios]
+    with ProcessPoolExecutor(workers, initializer=_initWorker, initargs=(shared,)) as pool:
+        return list(pool.map(simulate, scenarios))
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every combination of the given settings on a level")
+    parser.add_argument("level", nargs="?", help="save code file or binary level file (default: the default map)")
+    parser.add_argument("--gravity", type=float, nargs="+", default=[GRAVITY])
+    parser.add_argument("--ground-speed", type=float, nargs="+", default=[GROUND_SPEED])
+    parser.add_argument("--bounciness", type=float, nargs="+", default=[None], help="rectangle bounciness override")
+    parser.add_argument("--ball", nargs="+", default=["0,200"], help="starting ball as x,y or x,y,vX,vY (one scenario per ball)")
+    parser.add_argument("--frames", type=int, default=SCENARIO_DEFAULTS["frames"])
+    parser.add_argument("--workers", type=int, help="processes to use (default: one per core)")
+    parser.add_argument("--out", help="write trajectories and stats to this .npz file")
+    args = parser.parse_args()
+
+    balls = [[dict(zip(("x", "y", "vX", "vY"), map(float, i.split(","))))] for i in args.ball]
+    scenarios = scenario_grid(frames=[args.frames], gravity=args.gravity, groundSpeed=args.ground_speed, bounciness=args.bounciness, balls=balls)
+    start = time.perf_counter()
+    results = run_sweep(args.level or DEFAULT_LEVEL, scenarios, args.workers)
+    elapsed = time.perf_counter() - start
+    for k, r in enumerate(results):
+        c, s = r["config"], r["stats"]
+        ball = c["balls"][0]
+        print(f"{k:4}  gravity {c['gravity']:7.2f}  groundSpeed {c['groundSpeed']:5.2f}  bounciness {str(c['bounciness']):5}  ball ({ball['x']:g}, {ball['y']:g})"
+              f"  final ({s['final_x'][0]:9.1f}, {s['final_y'][0]:9.1f})  distance {s['distance'][0]:9.1f}  rest frame {s['rest_frame'][0]:5}")
+    print(f"{len(results)} scenarios in {elapsed:.2f} s")
+    if args.out:
+        arrays = {}
+        for k, r in enumerate(results):
+            arrays[f"trajectory_{k}"] = r["trajectory"]
+            arrays[f"asleep_{k}"] = r["asleep"]
+            for name, value in r["stats"].items():
+                arrays[f"{name}_{k}"] = array(value)
+        savez(args.out, configs=json.dumps([r["config"] for r in results]), **arrays)
+
+if __name__ == "__main__":
+    main()
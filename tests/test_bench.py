@@ -0,0 +1,33 @@
+import json
+import sys
+
+import bench
+
+
+def test_scenarios_are_deterministic():
+    for name in bench.SCENARIOS:
+        first = bench.bench_physics(name, 20)
+        second = bench.bench_physics(name, 20)
+        assert first["final_positions"] == second["final_positions"]
+        assert first["substeps"] == second["substeps"]
+        assert first["checks_per_substep"] == second["checks_per_substep"]
+
+def test_json_output_compares_against_itself(tmp_path, monkeypatch, capsys):
+    out = tmp_path / "out.json"
+    monkeypatch.setattr(sys, "argv", ["bench.py", "--scenario", "default", "--frames", "10", "--json", str(out)])
+    bench.main()
+    results = json.loads(out.read_text())
+    assert results["physics"]["default"]["frames"] == 10
+    monkeypatch.setattr(sys, "argv", ["bench.py", "--scenario", "default", "--frames", "10", "--compare", str(out)])
+    bench.main()
+    assert "x substeps/s" in capsys.readouterr().out
+
+def test_pile_stays_in_the_bowl():
+    world, script = bench.scenario_pile()
+    for frame in range(150):
+        script(world, frame)
+        world.run(1)
+    for i in world.balls:
+        #Above the bottom plate and between the arms, which widen by one unit per unit of height
+        assert i._y > -100
+        assert abs(i._x) < 150 + (i._y + 100) + i._radius
@@ -0,0 +1,64 @@
+import random
+
+import engine
+from engine import World, Ball, SpatialHash, circleOnLine
+from bench import dense_level
+
+
+def dense_world(grid=None):
+    world = World()
+    if grid is not None:
+        world.grid = grid
+    world.loadLevel(dense_level(columns=60, rows=8))
+    for k in range(6):
+        world.addBall(Ball(k * 180.0 - 100, 500, 8, 1, "red"))
+    return world
+
+def trajectory(world, frames=90):
+    positions = []
+    for frame in range(frames):
+        if frame % 3 == 0:
+            for i in world.balls:
+                i.exertForce(1, 0)
+        world.run(1)
+        positions.append([(i._x, i._y, i._vX, i._vY) for i in world.balls])
+    return positions
+
+def test_grid_finds_every_overlapping_rectangle_in_order():
+    rng = random.Random(5)
+    world = dense_world()
+    rects = world.rectangles()
+    for _ in range(300):
+        x, y, r = rng.uniform(-300, 1100), rng.uniform(-50, 500), rng.uniform(1, 60)
+        found = world.grid.query(x, y, r)
+        #Every rectangle whose bounding circle reaches the square, in insertion order
+        for j in rects:
+            (centerX, centerY), reach = j._center, j._maxlength + r
+            if abs(centerX - x) <= reach and abs(centerY - y) <= reach:
+                assert j in found
+        assert found == [j for j in rects if j in found]
+
+def test_grid_gives_the_same_trajectory_as_checking_every_rectangle():
+    # One cell holding the whole map is the all-pairs scan the grid replaced
+    world, allPairs = dense_world(), dense_world(SpatialHash(cellSize=1e9))
+    assert trajectory(world) == trajectory(allPairs)
+    assert world.collisionChecks * 20 < allPairs.collisionChecks
+
+def test_batched_edge_tests_equal_circle_on_line():
+    rng = random.Random(6)
+    world = dense_world()
+    rects = world.rectangles()
+    rows = world.store.indices(rects)
+    for _ in range(200):
+        x, y, r = rng.uniform(-300, 1100), rng.uniform(-50, 500), rng.uniform(1, 40)
+        hits = world.store.edgeHits(rows, x, y, r).tolist()
+        for j, row in zip(rects, hits):
+            g = j._geometry
+            corners = [(g[2 * c], g[2 * c + 1]) for c in (0, 1, 2, 3, 0)]
+            assert row == [circleOnLine(*corners[e], *corners[e + 1], x, y, r) for e in range(4)]
+
+def test_batched_narrowphase_gives_the_same_trajectory(monkeypatch):
+    monkeypatch.setattr(engine, "BATCH_MIN", 10**9)
+    single = trajectory(dense_world())
+    monkeypatch.setattr(engine, "BATCH_MIN", 0)
+    assert trajectory(dense_world()) == single
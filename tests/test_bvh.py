@@ -0,0 +1,143 @@
+import random
+
+from numpy import isnan
+
+from engine import World, Rectangle, MovingPlatform
+from bvh import SceneBVH
+
+
+def random_world(seed=4, count=300):
+    rng = random.Random(seed)
+    world = World("")
+    for k in range(count):
+        x, y = rng.uniform(-1000, 1000), rng.uniform(-1000, 1000)
+        if k % 5:
+            world.addRectangle(Rectangle(x, y, rng.uniform(5, 80), rng.uniform(5, 80), rng.uniform(0, 360)))
+        else:
+            world.addRectangle(MovingPlatform(x, y, 60, 10, rng.uniform(0, 360), x + rng.uniform(-200, 200), y + rng.uniform(-200, 200), rng.uniform(0.5, 3)))
+    return world, rng
+
+def frame(rect):
+    # Corner polygon1 and the edge vectors to polygon2 and polygon4
+    (x1, y1), (x2, y2), (x4, y4) = rect._polygon1, rect._polygon2, rect._polygon4
+    return x1, y1, x2 - x1, y2 - y1, x4 - x1, y4 - y1
+
+def local(rect, x, y):
+    # (s, t) of a point in the rectangle's unit square
+    x1, y1, uX, uY, vX, vY = frame(rect)
+    return ((x - x1) * uX + (y - y1) * uY) / (uX * uX + uY * uY), ((x - x1) * vX + (y - y1) * vY) / (vX * vX + vY * vY)
+
+def brute_point(rects, x, y):
+    return [k for k, r in enumerate(rects) if all(0 <= i <= 1 for i in local(r, x, y))]
+
+def brute_circle(rects, x, y, radius):
+    found = []
+    for k, r in enumerate(rects):
+        x1, y1, uX, uY, vX, vY = frame(r)
+        s, t = (min(max(i, 0), 1) for i in local(r, x, y))
+        dx, dy = x - x1 - s * uX - t * vX, y - y1 - s * uY - t * vY
+        if dx * dx + dy * dy <= radius * radius:
+            found.append(k)
+    return found
+
+def brute_box(rects, minX, minY, maxX, maxY):
+    found = []
+    box = ((minX, minY), (maxX, minY), (maxX, maxY), (minX, maxY))
+    for k, r in enumerate(rects):
+        corners = (r._polygon1, r._polygon2, r._polygon3, r._polygon4)
+        x1, y1, uX, uY, vX, vY = frame(r)
+        #Separating axes: x, y and the rectangle's two edges
+        if all(min(p[0] * aX + p[1] * aY for p in corners) <= max(p[0] * aX + p[1] * aY for p in box)
+               and min(p[0] * aX + p[1] * aY for p in box) <= max(p[0] * aX + p[1] * aY for p in corners)
+               for aX, aY in ((1, 0), (0, 1), (uX, uY), (vX, vY))):
+            found.append(k)
+    return found
+
+def brute_raycast(rects, x, y, dx, dy):
+    # Nearest entry of the segment into any rectangle, in each rectangle's unit square
+    best = (None, None)
+    for k, r in enumerate(rects):
+        s0, t0 = local(r, x, y)
+        s1, t1 = local(r, x + dx, y + dy)
+        enter, leave = 0.0, 1.0
+        for start, end in ((s0, s1), (t0, t1)):
+            d = end - start
+            if d == 0:
+                if not 0 <= start <= 1:
+                    enter, leave = 1, 0
+                continue
+            a, b = -start / d, (1 - start) / d
+            enter, leave = max(enter, min(a, b)), min(leave, max(a, b))
+        if enter <= leave and (best[1] is None or enter < best[1]):
+            best = (k, enter)
+    return best
+
+def check_queries(world, queries, rng, count=60):
+    rects = world.rectangles()
+    rowOf = {id(r): r._storeIndex for r in rects}
+    for _ in range(count):
+        x, y = rng.uniform(-1100, 1100), rng.uniform(-1100, 1100)
+        rows = sorted(rowOf[id(r)] for r in queries.rectanglesAt(x, y))
+        assert rows == sorted(rowOf[id(rects[k])] for k in brute_point(rects, x, y))
+        radius = rng.uniform(1, 150)
+        rows = sorted(rowOf[id(r)] for r in queries.rectanglesInCircle(x, y, radius))
+        assert rows == sorted(rowOf[id(rects[k])] for k in brute_circle(rects, x, y, radius))
+        w, h = rng.uniform(1, 300), rng.uniform(1, 300)
+        rows = sorted(rowOf[id(r)] for r in queries.rectanglesInBox(x, y, x + w, y + h))
+        assert rows == sorted(rowOf[id(rects[k])] for k in brute_box(rects, x, y, x + w, y + h))
+        dx, dy = rng.uniform(-800, 800), rng.uniform(-800, 800)
+        hit = queries.raycast(x, y, dx, dy)
+        k, t = brute_raycast(rects, x, y, dx, dy)
+        if k is None:
+            assert hit is None
+        else:
+            assert hit is not None and abs(hit[1] - max(t, 0)) < 1e-9
+
+def boxes(queries):
+    return queries._low.copy(), queries._high.copy()
+
+def same(a, b):
+    return ((a == b) | (isnan(a) & isnan(b))).all()
+
+def test_queries_match_brute_force():
+    world, rng = random_world()
+    check_queries(world, SceneBVH(world), rng)
+
+def test_moving_rectangles_refit_only_their_paths():
+    world, rng = random_world()
+    queries = SceneBVH(world)
+    check_queries(world, queries, rng, 5)
+    for _ in range(10):
+        version = world.store.version
+        world.run(3)
+        moved = world.store.movedSince(version)
+        assert moved is not None and len(moved) == len(world.bodies)
+        queries._sync()
+        low, high = boxes(queries)
+        queries.refit()
+        fullLow, fullHigh = boxes(queries)
+        assert same(low, fullLow) and same(high, fullHigh)
+        check_queries(world, queries, rng, 10)
+
+def test_edits_rebuild_the_tree():
+    world, rng = random_world(count=40)
+    queries = SceneBVH(world)
+    check_queries(world, queries, rng, 10)
+    rects = world.rectangles()
+    for i in rects[::3]:
+        world.removeRectangle(i)
+    world.addRectangle(Rectangle(0, 0, 500, 20, 10))
+    rect = rects[1]
+    rect._angle += 0.5
+    rect._computeGeometry()
+    world.updateRectangle(rect)
+    assert world.store.movedSince(0) is None
+    check_queries(world, queries, rng, 30)
+
+def test_moved_rows_are_forgotten_after_many_changes():
+    world, rng = random_world(count=20)
+    version = world.store.version
+    for _ in range(world.store.MOVED_LOG + 1):
+        world.moveRectangles(world.bodies[:1])
+    assert world.store.movedSince(version) is None
+    assert list(world.store.movedSince(world.store.version - 1)) == [world.bodies[0]._storeIndex]
@@ -0,0 +1,40 @@
+import random
+from math import hypot, cos, sin, pi
+
+from engine import World, Ball, Rectangle
+
+
+def test_corner_bounces_off_the_contact_normal():
+    rng = random.Random(10)
+    world = World()
+    for _ in range(200):
+        rect = Rectangle(0, 0, rng.uniform(20, 200), rng.uniform(20, 200), rng.uniform(0, 360), bounciness=rng.uniform(0.3, 1))
+        c = rng.randrange(4)
+        corners = (rect._polygon1, rect._polygon2, rect._polygon3, rect._polygon4)
+        cornerX, cornerY = corners[(c + 1) % 4]
+        outwardX, outwardY = rect._cornerNormals[c]
+        #A ball overlapping the corner, its centre off to one side of the corner normal, coming in
+        turn = rng.uniform(-0.6, 0.6)
+        normalX, normalY = outwardX * cos(turn) - outwardY * sin(turn), outwardX * sin(turn) + outwardY * cos(turn)
+        ball = Ball(cornerX + normalX * 8, cornerY + normalY * 8, 10, 1, "red")
+        angle = rng.uniform(-pi / 3, pi / 3)
+        ball._vX, ball._vY = -3 * (normalX * cos(angle) - normalY * sin(angle)), -3 * (normalX * sin(angle) + normalY * cos(angle))
+        hits = ball.checkCollision(rect, world)
+        assert hits == "corner"
+        #One radius out along the line from the corner, normal speed reversed, both scaled by the bounciness
+        assert abs(ball._x - (cornerX + normalX * 10)) < 1e-9 and abs(ball._y - (cornerY + normalY * 10)) < 1e-9
+        speed = -3 * cos(angle)
+        tangent = -3 * sin(angle)
+        assert abs(ball._vX * normalX + ball._vY * normalY + rect._bounciness * speed) < 1e-9
+        assert abs(-ball._vX * normalY + ball._vY * normalX - rect._bounciness * tangent) < 1e-9
+        assert all(type(i) is float for i in (ball._x, ball._y, ball._vX, ball._vY))
+
+def test_corner_moving_away_is_only_snapped():
+    world = World()
+    rect = Rectangle(0, 0, 100, 40, 0)
+    cornerX, cornerY = rect._polygon2
+    ball = Ball(cornerX + 5, cornerY + 5, 10, 1, "red")
+    ball._vX, ball._vY = 2, 1
+    assert ball.checkCollision(rect, world) == "corner"
+    assert (ball._vX, ball._vY) == (2, 1)
+    assert abs(hypot(ball._x - cornerX, ball._y - cornerY) - 10) < 1e-9
@@ -0,0 +1,66 @@
+import sys
+
+import pygame
+import pytest
+
+import bench
+import export
+from engine import World, Ball, DEFAULT_LEVEL
+from render import draw_world, TileCache
+from export import FrameExporter, export_frames
+
+
+SIZE = (160, 90)
+
+def world():
+    world = World(DEFAULT_LEVEL, adaptive=True)
+    world.addBall(Ball(0, 200, 10, 2, "red"))
+    return world
+
+def step(world, frame):
+    world.balls[0].exertForce(0.5, 0)
+    world.run(1)
+
+@pytest.mark.parametrize("process", [False, True])
+def test_raw_export_holds_the_frames_drawn(tmp_path, process):
+    path = tmp_path / "out.rgb"
+    with FrameExporter(str(path), SIZE, "raw", queueSize=2, process=process) as exporter:
+        stats = export_frames(world(), exporter, 30, step, every=3)
+    assert stats["frames"] == 30 and stats["exported"] == 10
+    data = path.read_bytes()
+    frameBytes = SIZE[0] * SIZE[1] * 3
+    assert len(data) == 10 * frameBytes
+    #Frame k is the same drawing of the same simulation
+    expected, screen, tiles = world(), pygame.Surface(SIZE), TileCache()
+    for frame in range(30):
+        step(expected, frame)
+        if frame % 3 == 0:
+            ball = expected.balls[0]
+            draw_world(screen, expected, ball._x, ball._y, 1, tiles)
+            k = frame // 3
+            assert data[k * frameBytes:(k + 1) * frameBytes] == pygame.image.tobytes(screen, "RGB")
+
+def test_image_export_writes_one_file_per_frame(tmp_path):
+    with FrameExporter(str(tmp_path / "frames"), SIZE, "png") as exporter:
+        export_frames(world(), exporter, 5, step)
+    files = sorted(i.name for i in (tmp_path / "frames").iterdir())
+    assert files == [f"frame_{k:05d}.png" for k in range(5)]
+    assert pygame.image.load(str(tmp_path / "frames" / files[-1])).get_size() == SIZE
+
+def test_rejects_bad_formats_and_sizes(tmp_path):
+    with pytest.raises(ValueError):
+        FrameExporter(str(tmp_path / "out.gif"), SIZE, "gif")
+    with FrameExporter(str(tmp_path / "out.rgb"), SIZE, "raw") as exporter:
+        with pytest.raises(ValueError):
+            exporter.put(pygame.Surface((10, 10)))
+
+def test_scenario_export_runs_like_the_benchmark(tmp_path, monkeypatch):
+    #The world main() builds, kept to compare with the benchmark's
+    worlds = []
+    def run(world, exporter, frames, step, *args):
+        worlds.append(world)
+        return export_frames(world, exporter, frames, step, *args)
+    monkeypatch.setattr(export, "export_frames", run)
+    monkeypatch.setattr(sys, "argv", ["export.py", str(tmp_path / "out.rgb"), "--format", "raw", "--scenario", "corners", "--frames", "20", "--size", "160x90"])
+    export.main()
+    assert [[i._x, i._y] for i in worlds[0].balls] == bench.bench_physics("corners", 20)["final_positions"]
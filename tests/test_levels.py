@@ -0,0 +1,104 @@
+import random
+
+import pytest
+from numpy import arange, empty, repeat, tile, cos, sin, pi
+
+from engine import DEFAULT_LEVEL, load_level, rectangle_corners
+from bench import dense_level
+from levels import (records_from_code, code_from_records, save_level_file, load_level_file, rectangles_from_records,
+                    read_level_records, optimize_records, LEVEL_VERSION, LEVEL_DTYPE)
+
+
+@pytest.mark.parametrize("mmap", [True, False])
+def test_binary_level_round_trips(tmp_path, mmap):
+    path = tmp_path / "level.lvl"
+    for code in (DEFAULT_LEVEL, dense_level(columns=50), DEFAULT_LEVEL.replace("black", "blue", 3)):
+        save_level_file(path, *records_from_code(code))
+        records, palette = load_level_file(path, mmap)
+        #Same numbers, written the way the editor writes them
+        assert code_from_records(records, palette) == code_from_records(*records_from_code(code))
+        assert (records == records_from_code(code)[0]).all()
+        rects = rectangles_from_records(records, palette)
+        assert [(i._geometry, i._color, i._bounciness) for i in rects] == [(i._geometry, i._color, i._bounciness) for i in load_level(code)]
+
+def test_empty_level(tmp_path):
+    path = tmp_path / "empty.lvl"
+    save_level_file(path, *records_from_code(""))
+    records, palette = load_level_file(path)
+    assert len(records) == 0 and palette == []
+
+def test_read_level_records_takes_either_format(tmp_path):
+    text, binary = tmp_path / "level.txt", tmp_path / "level.lvl"
+    text.write_text(DEFAULT_LEVEL + "\n")
+    save_level_file(binary, *records_from_code(DEFAULT_LEVEL))
+    assert code_from_records(*read_level_records(text)) == code_from_records(*read_level_records(binary))
+
+def test_rejects_other_files_and_versions(tmp_path):
+    path = tmp_path / "level.lvl"
+    path.write_bytes(b"nope" + bytes(60))
+    with pytest.raises(ValueError):
+        load_level_file(path)
+    save_level_file(path, *records_from_code(DEFAULT_LEVEL))
+    data = bytearray(path.read_bytes())
+    data[4:8] = (LEVEL_VERSION + 1).to_bytes(4, "little")
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        load_level_file(path)
+
+def test_bad_save_code():
+    with pytest.raises(ValueError):
+        records_from_code("1,2,3")
+
+def covered(records, px, py):
+    # Whether each point lies inside any of the rectangles
+    (x1, y1), (x2, y2), _, (x4, y4) = rectangle_corners(records["x"], records["y"], records["width"], records["height"], records["angle"])
+    offsetX, offsetY = px[:, None] - x1, py[:, None] - y1
+    uX, uY, vX, vY = x2 - x1, y2 - y1, x4 - x1, y4 - y1
+    s = (offsetX * uX + offsetY * uY) / (uX * uX + uY * uY)
+    t = (offsetX * vX + offsetY * vY) / (vX * vX + vY * vY)
+    return ((s >= 0) & (s <= 1) & (t >= 0) & (t <= 1)).any(axis=1)
+
+def tiled_level(rng):
+    # Tiles on a grid of 10 units, in a rotated frame, some turned a quarter, overlapping or covering each other
+    angle = rng.choice([0, pi / 6, 1.1])
+    c, s = cos(angle), sin(angle)
+    records = empty(rng.randint(20, 80), LEVEL_DTYPE)
+    for record in records:
+        u0, v0 = rng.randint(0, 15) * 10, rng.randint(0, 15) * 10
+        u1, v1 = u0 + rng.randint(1, 4) * 10, v0 + rng.randint(1, 4) * 10
+        if rng.random() < 0.3:
+            #Same box, turned a quarter: the first corner is then at (u1, v0)
+            record["x"], record["y"] = u1 * c - v0 * s, -u1 * s - v0 * c
+            record["width"], record["height"], record["angle"] = v1 - v0, u1 - u0, angle + pi / 2
+        else:
+            record["x"], record["y"] = u0 * c - v0 * s, -u0 * s - v0 * c
+            record["width"], record["height"], record["angle"] = u1 - u0, v1 - v0, angle
+        record["bounciness"] = rng.choice([0.5, 0.85])
+        record["color"] = rng.randint(0, 1)
+        record["flags"] = 0
+    #Sample points away from the grid lines, in the same frame
+    grid = arange(2, 200, 1.7)
+    u, v = repeat(grid + 0.13, len(grid)), tile(grid + 0.29, len(grid))
+    return records, u * c - v * s, -u * s - v * c
+
+def test_optimizer_keeps_the_outline():
+    rng = random.Random(9)
+    before = after = 0
+    for _ in range(30):
+        records, px, py = tiled_level(rng)
+        optimized = optimize_records(records, ["black", "blue"])
+        assert len(optimized) <= len(records)
+        before, after = before + len(records), after + len(optimized)
+        #Same area covered, and the same for each colour and bounciness on its own
+        for key in ((0, 0.5), (0, 0.85), (1, 0.5), (1, 0.85)):
+            original = records[(records["color"] == key[0]) & (records["bounciness"] == key[1])]
+            merged = optimized[(optimized["color"] == key[0]) & (optimized["bounciness"] == key[1])]
+            assert (covered(original, px, py) == covered(merged, px, py)).all()
+    assert after < before * 0.95
+
+def test_optimizer_merges_a_row_of_tiles():
+    code = ":".join(f"{k * 20.0},0.0,20,20,0.0,black,0.8" for k in range(40))
+    records, palette = records_from_code(code)
+    optimized = optimize_records(records, palette)
+    assert len(optimized) == 1
+    assert (optimized["x"][0], optimized["width"][0], optimized["height"][0]) == (0, 800, 20)
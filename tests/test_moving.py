@@ -0,0 +1,27 @@
+import random
+
+from engine import World, Ball, MovingPlatform, SpatialHash, RectangleStore
+
+
+def test_moving_rectangles_keep_the_collision_structures_current():
+    rng = random.Random(11)
+    world = World("-99999.0,-200.0,199998.0,50.0,0.0,black,0.85")
+    for k in range(60):
+        x, y = rng.uniform(-500, 500), rng.uniform(0, 500)
+        world.addRectangle(MovingPlatform(x, y, 60, 10, rng.uniform(0, 30), x + rng.uniform(-300, 300), y + rng.uniform(-200, 200), rng.uniform(0.5, 4)))
+    rider = world.addRectangle(MovingPlatform(-900, 100, 80, 15, 0, -600, 100, 2))
+    ball = world.addBall(Ball(-860, 111, 10, 2, "red"))
+    world.run(90)
+    #Updated in place, the grid and the store hold what building them again gives
+    fresh = SpatialHash()
+    fresh.rebuild(world.scene)
+    for _ in range(200):
+        x, y, r = rng.uniform(-1000, 1000), rng.uniform(-100, 800), rng.uniform(1, 50)
+        assert set(world.grid.query(x, y, r)) == set(fresh.query(x, y, r))
+    store = RectangleStore()
+    store.extend(world.rectangles())
+    rows = world.store.indices(world.rectangles())
+    assert (world.store._edges[rows] == store._edges[:len(store)]).all()
+    assert (world.store._bounds[rows] == store._bounds[:len(store)]).all()
+    #The ball standing on a platform went along with it, and is still on it
+    assert ball._x > -760 and rider._x <= ball._x <= rider._x + 80 and abs(ball._y - (rider._y + 10)) < 1
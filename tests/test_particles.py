@@ -0,0 +1,45 @@
+from numpy import arange, ones
+from numpy.random import default_rng
+
+from engine import World, Ball, ball_pairs, ball_contact_impulses
+
+
+def brute_pairs(x, y, radius, margin):
+    return sorted((i, j) for i in range(len(x)) for j in range(i + 1, len(x))
+                  if (x[j] - x[i])**2 + (y[j] - y[i])**2 < (radius[i] + radius[j] + margin)**2)
+
+def test_ball_pairs_match_brute_force():
+    rng = default_rng(7)
+    for n, spread, margin in ((300, 200, 0), (300, 200, 3), (200, 60, 0), (2, 5, 0)):
+        x, y = rng.uniform(-spread, spread, n), rng.uniform(-spread, spread, n)
+        radius = rng.uniform(1, 5, n)
+        radius[:3] *= 10 #A few circles much larger than the cells
+        i, j = ball_pairs(x, y, radius, margin)
+        assert list(zip(i.tolist(), j.tolist())) == brute_pairs(x, y, radius, margin)
+
+def test_contact_impulses_conserve_momentum():
+    rng = default_rng(8)
+    x, y = rng.uniform(0, 30, 50), rng.uniform(0, 30, 50)
+    vX, vY = rng.normal(0, 1, 50), rng.normal(0, 1, 50)
+    radius, mass = rng.uniform(2, 4, 50), rng.uniform(0.5, 3, 50)
+    i, j = ball_pairs(x, y, radius)
+    assert len(i)
+    changeX, changeY = ball_contact_impulses(x, y, vX, vY, radius, mass, i, j, 0.05)
+    assert abs((mass * changeX).sum()) < 1e-9 and abs((mass * changeY).sum()) < 1e-9
+    assert (changeX != 0).any()
+
+def test_particles_settle_in_a_box():
+    world = World("-400.0,0.0,800,40,0.0,black,0.6:-440.0,800.0,40,840,0.0,black,0.6:400.0,800.0,40,840,0.0,black,0.6", adaptive=True)
+    k = arange(600)
+    world.addParticles(-380 + (k % 55) * 13.8, 30 + (k // 55) * 9.0, 4)
+    ball = world.addBall(Ball(0, 500, 10, 2, "red"))
+    world.run(300)
+    n = len(world.particles)
+    x, y = world.particles._pos[:n, 0], world.particles._pos[:n, 1]
+    #Nothing escaped the box and the pile is at rest, with the ball on top
+    assert (x > -400).all() and (x < 400).all() and (y > 0).all()
+    assert (abs(world.particles._vel[:n]) < 0.5).all()
+    assert ball._y > y.min() + 10 and -400 < ball._x < 400
+    #Particles do not overlap each other by more than a little
+    i, j = ball_pairs(x, y, ones(n) * 4)
+    assert (((x[j] - x[i])**2 + (y[j] - y[i])**2) > (8 * 0.8)**2).all()
@@ -0,0 +1,39 @@
+import csv
+
+from engine import World, Ball, DEFAULT_LEVEL
+from profiler import Profiler
+
+
+def profiled_run(profiler, frames=60):
+    world = World(DEFAULT_LEVEL)
+    ball = world.addBall(Ball(0, 200, 10, 2, "red"))
+    world.profiler = profiler
+    for _ in range(frames):
+        ball.exertForce(0.3, 0)
+        world.run(1)
+        if profiler is not None:
+            profiler.endFrame()
+    return world, (ball._x, ball._y, ball._vX, ball._vY)
+
+def test_profiling_does_not_change_the_simulation():
+    assert profiled_run(Profiler())[1] == profiled_run(None)[1] == profiled_run(Profiler(enabled=False))[1]
+
+def test_counters_add_up_and_export(tmp_path):
+    profiler = Profiler()
+    world, _ = profiled_run(profiler)
+    assert len(profiler.timeline) == 60
+    assert sum(c.get("candidates", 0) for _, _, c in profiler.timeline) == world.collisionChecks
+    assert all(c["substeps"] == world.substeps for _, _, c in profiler.timeline)
+    times, counts = profiler.average(60)
+    assert times["broadphase"] > 0 and times["narrowphase"] > 0 and counts["hits"] > 0
+    path = tmp_path / "timeline.csv"
+    profiler.export(path)
+    with open(path) as f:
+        rows = list(csv.DictReader(f))
+    assert [int(r["frame"]) for r in rows] == list(range(60))
+    assert sum(int(r["candidates"]) for r in rows) == world.collisionChecks
+
+def test_disabled_profiler_records_nothing():
+    profiler = Profiler(enabled=False)
+    profiled_run(profiler)
+    assert not profiler.timeline and profiler.frame == 60
@@ -0,0 +1,69 @@
+import pygame
+
+from engine import World, Ball, Rectangle, DEFAULT_LEVEL
+from render import draw_world, draw_ball, draw_rectangle, TileCache
+
+pygame.init()
+
+
+def reference(screen, world, camX, camY, camZoom):
+    # Every rectangle drawn, none culled
+    screen.fill("white")
+    for i in world.balls:
+        draw_ball(screen, i, camX, camY, camZoom)
+    for i in world.rectangles():
+        draw_rectangle(screen, i, camX, camY, camZoom, (-1e12, -1e12, 1e12, 1e12))
+
+def pixels(screen):
+    return pygame.image.tobytes(screen, "RGB")
+
+VIEWS = [(0, 200, 1), (600, 600, 0.5), (1200, 900, 2.5), (-300, 1200, 0.2), (5000, 5000, 1)]
+
+def test_culled_drawing_looks_the_same():
+    world = World(DEFAULT_LEVEL)
+    world.addBall(Ball(0, 200, 10, 2, "red"))
+    screen = pygame.Surface((640, 360))
+    expected = pygame.Surface((640, 360))
+    for camX, camY, camZoom in VIEWS:
+        drawn = draw_world(screen, world, camX, camY, camZoom)
+        reference(expected, world, camX, camY, camZoom)
+        assert pixels(screen) == pixels(expected)
+        #Only what is in view was drawn
+        minX, minY, maxX, maxY = camX - 320 / camZoom, camY - 180 / camZoom, camX + 320 / camZoom, camY + 180 / camZoom
+        assert drawn == sum(1 for i in world.rectangles() if i._aabb[0] <= maxX and i._aabb[2] >= minX and i._aabb[1] <= maxY and i._aabb[3] >= minY)
+
+def test_tiles_look_like_direct_drawing_and_are_rasterized_once():
+    world = World(DEFAULT_LEVEL)
+    tiles = TileCache()
+    direct = pygame.Surface((640, 360))
+    tiled = pygame.Surface((640, 360))
+    for camX, camY, camZoom in VIEWS:
+        draw_world(direct, world, camX, camY, camZoom)
+        draw_world(tiled, world, camX, camY, camZoom, tiles)
+        #Polygon edges cut by tile borders can differ by a pixel; nothing else does
+        different = sum(a != b for a, b in zip(pixels(direct), pixels(tiled)))
+        assert different < 640 * 360 * 3 // 1000
+        before = tiles.rasterized
+        draw_world(tiled, world, camX, camY, camZoom, tiles)
+        assert tiles.rasterized == before
+
+def test_edits_invalidate_their_tiles():
+    world = World(DEFAULT_LEVEL)
+    tiles = TileCache()
+    screen = pygame.Surface((640, 360))
+    draw_world(screen, world, 0, 200, 1, tiles)
+    cached = len(tiles)
+    rect = world.addRectangle(Rectangle(-200, 300, 60, 60, 0, "blue"))
+    tiles.invalidate(rect)
+    assert len(tiles) < cached
+    draw_world(screen, world, 0, 200, 1, tiles)
+    #The new rectangle is drawn, at the centre of where it was placed
+    assert screen.get_at((320 - 170, 180 - 70))[:3] == (0, 0, 255)
+
+def test_cache_evicts_tiles_off_screen():
+    world = World(DEFAULT_LEVEL)
+    tiles = TileCache(maxTiles=12)
+    screen = pygame.Surface((640, 360))
+    for k in range(20):
+        draw_world(screen, world, k * 500.0, 200, 1, tiles)
+        assert len(tiles) <= 12
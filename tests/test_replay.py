@@ -0,0 +1,133 @@
+import pytest
+
+from engine import World, Ball, MovingPlatform, DynamicRectangle, DEFAULT_LEVEL
+from replay import Recording, StateRing, capture_state
+
+
+LEVEL = "-500.0,0.0,1000,50,0.0,black,0.5"
+
+def record(world, frames, ring=None, riding=False):
+    recording = Recording(world, keyframeInterval=50)
+    for frame in range(frames):
+        world.run(1)
+        if riding and frame == 30:
+            #Carried up by the platform by then
+            assert isinstance(world.balls[0]._lastCollision, MovingPlatform)
+        recording.keys(world, 8 if frame % 40 < 10 else 1 if frame % 90 == 0 else 0)
+        recording.endFrame(world)
+        if ring is not None:
+            ring.push(world.frame, world.balls)
+    return recording
+
+def front_end_world(level=DEFAULT_LEVEL, x=0, y=200):
+    # The ball first and then the level, like physics.py
+    world = World()
+    world.addBall(Ball(x, y, 10, 2, "red"))
+    world.loadLevel(level)
+    return world
+
+def platform_world():
+    # The level first and the ball after it, then the platform the ball falls onto
+    world = World(LEVEL)
+    world.addBall(Ball(20, 150, 10, 2, "red"))
+    world.addRectangle(MovingPlatform(0, 120, 80, 15, 0, 0, 220, 1))
+    drifting = world.addRectangle(DynamicRectangle(200, 300, 40, 40, 10))
+    drifting._vX = 0.5
+    return world
+
+def test_replay_after_save_and_load(tmp_path):
+    world = front_end_world()
+    recording = record(world, 240)
+    path = tmp_path / "recording.npz"
+    recording.save(path, world)
+    loaded = Recording.load(path)
+    assert sorted(loaded.keyframes) == [0, 50, 100, 150, 200, 240]
+    replayed = loaded.replay()
+    assert capture_state(replayed) == capture_state(world)
+    assert (replayed.balls[0]._x, replayed.balls[0]._y) == (world.balls[0]._x, world.balls[0]._y)
+
+def test_seek_matches_the_ring():
+    world = front_end_world()
+    ring = StateRing(300, world.balls)
+    recording = record(world, 240, ring)
+    for frame in (0, 75, 160, 240):
+        seeked = recording.seek(frame)
+        assert seeked.frame == frame
+        if frame:
+            ball, = ring.ballsAt(frame)
+            #The ring stores float32
+            assert abs(seeked.balls[0]._x - ball._x) < 1e-3 and abs(seeked.balls[0]._y - ball._y) < 1e-3
+    assert capture_state(recording.seek(240)) == capture_state(world)
+    with pytest.raises(ValueError):
+        recording.seek(241)
+
+def test_replay_with_edits():
+    world = front_end_world(LEVEL, 0, 100)
+    recording = Recording(world, keyframeInterval=30)
+    for frame in range(120):
+        if frame == 10:
+            recording.command(world, ("place", 40, 60, 30, 10, 20, "black", 0.5))
+        if frame == 50:
+            recording.command(world, ("place", -60, 40, 30, 10, -20, "black", 0.5))
+        if frame == 70:
+            recording.command(world, ("remove",))
+        world.run(1)
+        recording.keys(world, 8)
+        recording.endFrame(world)
+    assert len(world.rectangles()) == 2
+    assert capture_state(recording.replay()) == capture_state(world)
+    assert capture_state(recording.seek(120)) == capture_state(world)
+    assert len(recording.seek(60).rectangles()) == 3
+
+def test_ring_keeps_the_last_frames():
+    world = World(LEVEL)
+    ball = world.addBall(Ball(0, 10, 10, 2, "red"))
+    ring = StateRing(10, world.balls)
+    for frame in range(1, 26):
+        ball._x = float(frame)
+        ring.push(frame, world.balls)
+    assert (ring.oldest(), ring.newest()) == (16, 25)
+    assert 15 not in ring and 16 in ring
+    stored, = ring.ballsAt(20)
+    assert stored._x == 20 and stored._radius == 10 and stored._color == "red"
+
+def test_replay_rebuilds_moving_rectangles(tmp_path):
+    world = platform_world()
+    recording = record(world, 240, riding=True)
+    path = tmp_path / "recording.npz"
+    recording.save(path, world)
+    loaded = Recording.load(path)
+    replayed = loaded.replay()
+    assert [type(i) for i in replayed.rectangles()] == [type(i) for i in world.rectangles()]
+    assert capture_state(replayed) == capture_state(world)
+    assert (replayed.balls[0]._x, replayed.balls[0]._y) == (world.balls[0]._x, world.balls[0]._y)
+
+def test_seek_with_moving_rectangles():
+    world = platform_world()
+    ring = StateRing(300, world.balls)
+    recording = record(world, 240, ring, riding=True)
+    for frame in (0, 75, 160, 240):
+        seeked = recording.seek(frame)
+        assert seeked.frame == frame
+        if frame:
+            ball, = ring.ballsAt(frame)
+            #The ring stores float32
+            assert abs(seeked.balls[0]._x - ball._x) < 1e-3 and abs(seeked.balls[0]._y - ball._y) < 1e-3
+    assert capture_state(recording.seek(240)) == capture_state(world)
+
+def test_replay_with_edits_and_particles():
+    world = World(LEVEL)
+    world.addBall(Ball(0, 100, 10, 2, "red"))
+    recording = Recording(world, keyframeInterval=30)
+    for frame in range(120):
+        if frame == 10:
+            recording.command(world, ("place", 40, 60, 30, 10, 20, "black", 0.5))
+        if frame == 20:
+            recording.command(world, ("spray", 0, 200, 25, 3))
+        if frame == 70:
+            recording.command(world, ("remove",))
+        world.run(1)
+        recording.keys(world, 8)
+        recording.endFrame(world)
+    assert capture_state(recording.replay()) == capture_state(world)
+    assert capture_state(recording.seek(120)) == capture_state(world)
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+from numpy import float32
+
+from server import SessionServer
+from loadgen import Client, run_load
+
+
+def test_clients_see_their_worlds(tmp_path):
+    # Ticks run by hand, so every STATE can be checked against the world it came from
+    async def main():
+        server = SessionServer()
+        path = str(tmp_path / "server.sock")
+        listening = await asyncio.start_unix_server(server.handle, path)
+        async with listening:
+            clients = [await Client.connect(unix=path) for _ in range(3)]
+            clients[1].send(2) #Hold one key
+            await asyncio.sleep(0.05)
+            for _ in range(30):
+                server.tick()
+                for i in clients:
+                    await i.receive()
+            for i in clients:
+                world = server.sessions[i.id].world
+                ball = world.balls[0]
+                assert i.frame == world.frame == 30
+                assert i.balls[0] == tuple(float(float32(v)) for v in (ball._x, ball._y, ball._vX, ball._vY))
+            assert clients[0].balls[0] == clients[2].balls[0] != clients[1].balls[0]
+            assert clients[1].latencies
+            for i in clients:
+                i.close()
+    asyncio.run(main())
+
+def test_unknown_map_is_refused(tmp_path):
+    async def main():
+        server = SessionServer()
+        path = str(tmp_path / "server.sock")
+        async with await asyncio.start_unix_server(server.handle, path):
+            with pytest.raises(ConnectionError):
+                await Client.connect("nowhere", unix=path)
+    asyncio.run(main())
+
+def test_loadgen_clients_are_all_served(tmp_path):
+    async def main():
+        server = SessionServer()
+        path = str(tmp_path / "server.sock")
+        serving = asyncio.ensure_future(server.serve(unix=path))
+        await asyncio.sleep(0.2)
+        try:
+            return await run_load(40, 3, unix=path, slow=2), server.metrics()
+        finally:
+            serving.cancel()
+            await asyncio.gather(serving, return_exceptions=True)
+    results, metrics = asyncio.run(main())
+    assert results["dropped"] == 0 and metrics["disconnected"] == 0
+    #Close to one STATE per tick for the fast clients, fewer for the slow ones
+    assert results["messages_per_second"] > 30
+    assert results["slow_messages_per_second"] < results["messages_per_second"]
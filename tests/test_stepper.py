@@ -0,0 +1,76 @@
+from threading import Lock
+
+import pygame
+
+from engine import World, Ball, MovingPlatform, DEFAULT_LEVEL
+from render import TileCache, draw_snapshot
+from stepper import FixedStepper, Snapshot
+
+
+class WatchedLock:
+    # A lock that counts how often it is taken and fails instead of waiting long
+    def __init__(self):
+        self.lock = Lock()
+        self.taken = 0
+
+    def __enter__(self):
+        assert self.lock.acquire(timeout=1), "drawing waited for the physics"
+        self.taken += 1
+
+    def __exit__(self, *exc):
+        self.lock.release()
+
+def world_with_platform():
+    world = World(DEFAULT_LEVEL)
+    world.addBall(Ball(0, 200, 10, 2, "red"))
+    world.addRectangle(MovingPlatform(-200, 100, 80, 15, 0, -100, 100, 2))
+    return world
+
+def test_advance_runs_whole_frames():
+    world = world_with_platform()
+    stepper = FixedStepper(world)
+    assert stepper.advance(2.5 / world.frameRate) == 2
+    assert stepper.advance(0.6 / world.frameRate) == 1 #The half frame left over adds up
+    assert world.frame == 3
+
+def test_backlog_is_dropped():
+    world = world_with_platform()
+    stepper = FixedStepper(world, maxFrames=5)
+    assert stepper.advance(20 / world.frameRate) == 5
+    assert stepper.dropped == 15
+    assert world.frame == 5
+
+def test_snapshot_blend_is_between_frames():
+    world = world_with_platform()
+    before = Snapshot.capture(world)
+    world.run(1)
+    after = Snapshot.capture(world)
+    half = before.blend(after, 0.5)
+    assert ((half.balls - (before.balls + after.balls) / 2) ** 2).max() < 1e-18
+    assert ((half.rects - (before.rects + after.rects) / 2) ** 2).max() < 1e-18
+    assert half.frame == after.frame
+
+def test_drawing_does_not_hold_the_physics_lock():
+    world = world_with_platform()
+    stepper = FixedStepper(world)
+    stepper.advance(3 / world.frameRate)
+    screen = pygame.Surface((320, 240))
+    tiles = TileCache()
+    lock = WatchedLock()
+    snapshot = stepper.snapshot()
+    camX, camY = snapshot.balls[0].tolist()
+    #Missing tiles take the lock only to look their rectangles up
+    assert draw_snapshot(screen, world, snapshot, camX, camY, 1, tiles, lock) > 0
+    assert lock.taken == len(tiles)
+    #With the tiles cached, drawing goes on while the physics holds the lock
+    with lock.lock:
+        draw_snapshot(screen, world, snapshot, camX, camY, 1, tiles, lock)
+    assert lock.taken == len(tiles)
+
+def test_drawing_without_tiles_takes_the_lock_once():
+    world = world_with_platform()
+    stepper = FixedStepper(world)
+    lock = WatchedLock()
+    snapshot = stepper.snapshot()
+    draw_snapshot(pygame.Surface((320, 240)), world, snapshot, 0, 200, 1, None, lock)
+    assert lock.taken == 1
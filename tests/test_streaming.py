@@ -0,0 +1,36 @@
+from engine import World, Ball
+from bench import dense_level
+from levels import records_from_code, save_chunked_level_file, ChunkedLevel
+from streaming import ChunkStreamer
+
+
+def script(world, frame):
+    # Roll right along the level
+    if frame % 3 == 0:
+        for i in world.balls:
+            i.exertForce(1, 0)
+
+def test_streamed_trajectory_matches_the_full_world(tmp_path):
+    code = dense_level(columns=300, rows=6)
+    path = tmp_path / "level.lvc"
+    save_chunked_level_file(path, *records_from_code(code), 256)
+    full = World(code, adaptive=True)
+    streamed = World(adaptive=True)
+    level = ChunkedLevel(path)
+    streamer = ChunkStreamer(streamed, level, margin=256, keep=512)
+    try:
+        for world in (full, streamed):
+            world.addBall(Ball(0, 400, 8, 1, "red"))
+            world.addBall(Ball(1500, 400, 8, 1, "red"))
+        most = 0
+        for frame in range(600):
+            streamer.update()
+            for world in (full, streamed):
+                script(world, frame)
+                world.run(1)
+            assert [(i._x, i._y, i._vX, i._vY) for i in streamed.balls] == [(i._x, i._y, i._vX, i._vY) for i in full.balls]
+            most = max(most, len(streamed.rectangles()))
+    finally:
+        streamer.close()
+    assert full.balls[0]._x > 1500 #Crossed several chunks
+    assert streamer.evictions > 0 and most < len(full.rectangles()) / 3
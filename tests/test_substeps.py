@@ -0,0 +1,45 @@
+from engine import World, Ball, SUBSTEPS, DEFAULT_LEVEL
+
+
+def test_fixed_substeps_by_default():
+    world = World(DEFAULT_LEVEL)
+    world.addBall(Ball(0, 200, 10, 2, "red"))
+    assert not world.adaptive
+    world.run(30)
+    assert world.substeps == SUBSTEPS
+
+def test_adaptive_resting_ball_takes_one_substep():
+    world = World("-500.0,0.0,1000,50,0.0,black,0.5", adaptive=True)
+    world.addBall(Ball(0, 10, 10, 2, "red"))
+    world.run(120)
+    assert world.substeps == 1
+
+def test_adaptive_fast_ball_does_not_tunnel():
+    # A thin wall and a ball crossing several times its own width per frame
+    world = World("100.0,500.0,2,1000,0.0,black,0.5", adaptive=True, substeps=1)
+    world.fly = True
+    ball = world.addBall(Ball(0, 0, 10, 2, "red"))
+    ball._vX = 400
+    world.run(3)
+    assert ball._x < 100
+
+def test_fixed_one_substep_tunnels():
+    # The case adaptive mode exists for
+    world = World("100.0,500.0,2,1000,0.0,black,0.5", substeps=1)
+    world.fly = True
+    ball = world.addBall(Ball(0, 0, 10, 2, "red"))
+    ball._vX = 400
+    world.run(3)
+    assert ball._x > 100
+
+def test_time_of_impact_keeps_positions_python_floats():
+    # Into the side of the wall and onto its top corner, both through the time of impact
+    for y in (0, 505):
+        world = World("100.0,500.0,2,1000,0.0,black,0.5", adaptive=True, substeps=1)
+        world.fly = True
+        ball = world.addBall(Ball(0, y, 10, 2, "red"))
+        ball._vX = 400
+        world.run(1)
+        assert ball._x < 100
+        world.run(2)
+        assert all(type(i) is float for i in (ball._x, ball._y, ball._vX, ball._vY))
@@ -0,0 +1,32 @@
+import pytest
+from numpy import array_equal
+
+from engine import World, Ball, DEFAULT_LEVEL
+from levels import records_from_code, save_level_file
+from sweep import run_sweep, scenario, scenario_grid
+
+
+GRID = scenario_grid(frames=[90], gravity=[-9.81, -5], bounciness=[None, 0.5], balls=[[{}, {"x": 300, "vX": 2}]])
+
+def test_pool_gives_the_same_results_as_one_process(tmp_path):
+    path = tmp_path / "level.lvl"
+    save_level_file(path, *records_from_code(DEFAULT_LEVEL))
+    local = run_sweep(DEFAULT_LEVEL, GRID, workers=1)
+    for results in (run_sweep(DEFAULT_LEVEL, GRID, workers=2), run_sweep(str(path), GRID, workers=2)):
+        assert len(results) == len(local) == 4
+        for a, b in zip(results, local):
+            assert a["config"] == b["config"]
+            assert array_equal(a["trajectory"], b["trajectory"]) and array_equal(a["asleep"], b["asleep"])
+
+def test_scenario_matches_a_world_run_by_hand():
+    result, = run_sweep(DEFAULT_LEVEL, [{"frames": 90, "gravity": -5, "balls": [{"x": 300, "vX": 2}]}], workers=1)
+    world = World(DEFAULT_LEVEL, gravity=-5, adaptive=True)
+    ball = world.addBall(Ball(300, 200, 10, 2, "red"))
+    ball._vX = 2
+    world.run(90)
+    assert tuple(result["trajectory"][-1, 0]) == (ball._x, ball._y, ball._vX, ball._vY)
+    assert result["stats"]["final_x"][0] == ball._x
+
+def test_unknown_settings_are_rejected():
+    with pytest.raises(ValueError):
+        scenario(gravty=-5)
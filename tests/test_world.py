@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import time
+
+import engine
+from engine import World, Ball, DEFAULT_LEVEL
+
+
+def test_engine_runs_without_pygame():
+    # pygame set to None in sys.modules makes any import of it fail
+    code = ("import sys; sys.modules['pygame'] = None\n"
+            "from engine import World, Ball, DEFAULT_LEVEL\n"
+            "world = World(DEFAULT_LEVEL); ball = world.addBall(Ball(0, 200, 10, 2, 'red')); world.run(60)\n"
+            "print(ball._x, ball._y)")
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(engine.__file__)))
+    assert result.returncode == 0, result.stderr
+    x, y = map(float, result.stdout.split())
+    world = World(DEFAULT_LEVEL)
+    ball = world.addBall(Ball(0, 200, 10, 2, "red"))
+    world.run(60)
+    assert (x, y) == (ball._x, ball._y)
+
+def test_run_is_faster_than_real_time():
+    world = World(DEFAULT_LEVEL)
+    ball = world.addBall(Ball(0, 200, 10, 2, "red"))
+    start = time.perf_counter()
+    world.run(600)
+    assert time.perf_counter() - start < 600 / world.frameRate
+    assert world.frame == 600
+    #Landed on the ground of the default map and stayed there
+    assert 0 < ball._y < ball._radius * 1.5
+
+def resting_ball():
+    world = World("-500.0,0.0,1000,50,0.0,black,0.5")
+    ball = world.addBall(Ball(0, 10, 10, 2, "red"))
+    world.run(120)
+    return world, ball
+
+def test_resting_ball_falls_asleep_and_costs_nothing():
+    world, ball = resting_ball()
+    assert ball._asleep
+    checks, position = world.collisionChecks, (ball._x, ball._y)
+    world.run(60)
+    assert world.collisionChecks == checks and (ball._x, ball._y) == position
+
+def test_pushing_wakes_the_ball():
+    world, ball = resting_ball()
+    ball.exertForce(1, 0)
+    assert not ball._asleep
+    world.run(10)
+    assert ball._x > 1
+
+def test_removing_the_ground_wakes_the_ball():
+    world, ball = resting_ball()
+    world.removeRectangle(world.rectangles()[0])
+    assert not ball._asleep
+    world.run(30)
+    assert ball._y < 0
+
+def test_ball_hit_by_another_wakes():
+    world, ball = resting_ball()
+    other = world.addBall(Ball(-100, 10, 10, 2, "blue"))
+    other._vX = 5
+    world.run(60)
+    assert ball._x > 1
+
+def test_ball_slides_down_a_slope_without_bouncing():
+    world = World("-500.0,300.0,1000,20,0.3,black,0.85")
+    slope = world.rectangles()[0]
+    (x1, y1), (x2, y2) = slope._polygon1, slope._polygon2
+    normalX, normalY = slope._normals[0]
+    ball = world.addBall(Ball((x1 + x2) / 2 + normalX * 10.5, (y1 + y2) / 2 + normalY * 10.5, 10, 2, "red"))
+    world.run(30)
+    assert ball._contacts and ball._contacts[0][0] is slope
+    start = ball._x
+    for _ in range(60):
+        world.run(1)
+        gap = (ball._x - x1) * normalX + (ball._y - y1) * normalY - ball._radius
+        assert abs(gap) < 1e-6 and abs(ball._vX * normalX + ball._vY * normalY) < 1e-6
+    #Down the slope, which falls to the right
+    assert ball._x > start + 5 and ball._contacts